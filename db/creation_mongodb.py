@@ -42,6 +42,11 @@ def create_indexes(db):
         logging.info("📌 Création des index...")
         db.societe.create_index([('nom', ASCENDING)], unique=True)
         db.avis_trustpilot.create_index([('nom_societe', ASCENDING)])
+        # Clé naturelle des avis, cible des upserts du chargement incrémental
+        db.avis_trustpilot.create_index(
+            [('id_societe', ASCENDING), ('cle_avis', ASCENDING)],
+            unique=True, partialFilterExpression={'cle_avis': {'$exists': True}}
+        )
         logging.info("✅ Index créés avec succès.")
     except Exception as e:
         logging.error(f"❌ Erreur création index : {str(e)}")
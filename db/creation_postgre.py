@@ -78,9 +78,12 @@ def create_tables(cur, log):
         date_avis TIMESTAMP,
         commentaire TEXT,
         note_commentaire INTEGER,
-        date_chargement TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        date_chargement TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        cle_avis VARCHAR(64)
     );
     """)
+    # Clé naturelle : id Trustpilot ou empreinte de l'avis, cible des upserts du chargement incrémental
+    cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS ux_avis_societe_cle ON avis_trustpilot (id_societe, cle_avis);")
     log.print("✅ Table avis_trustpilot créée.")
 
 def main():
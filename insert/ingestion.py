@@ -0,0 +1,363 @@
+import os
+import json
+import time
+import queue
+import threading
+from datetime import datetime
+
+import psycopg2
+from pymongo import MongoClient
+
+import insert_postgre as pg
+import insert_mongodb as mg
+from lecture_scrap import dossiers_scrap, fichiers_avis, fichiers_deltas, iter_avis, lire_avis, lots, cle_avis
+from manifeste import get_manifeste
+
+# Un seul lecteur des dossiers de scrap, qui alimente en parallèle les chargeurs PostgreSQL et MongoDB
+DATA_DIR = pg.DATA_RAW_TRUSTPILOT or os.path.join(mg.BASE_DIR, "data", "trustpilot")
+LOG_DIR = pg.LOG_DIR or mg.LOG_DIR
+# Avis par message envoyé aux bases, messages en attente par base (contre-pression sur le lecteur)
+INGESTION_LOT = int(os.getenv("INGESTION_LOT", "5000"))
+INGESTION_QUEUE = int(os.getenv("INGESTION_QUEUE", "8"))
+# Bases alimentées (postgre,mongodb)
+INGESTION_CIBLES = [c for c in os.getenv("INGESTION_CIBLES", f"{pg.CIBLE_MANIFESTE},{mg.CIBLE_MANIFESTE}").split(",") if c]
+
+
+class Logger:
+    """Console + fichier, avec les interfaces des loggers des deux chargeurs (print et log)"""
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.log_lines = []
+        self._lock = threading.Lock()
+
+    def log(self, msg, level="INFO"):
+        full_msg = f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {level} - {msg}"
+        with self._lock:
+            print(full_msg)
+            self.log_lines.append(full_msg)
+
+    def print(self, msg):
+        self.log(msg.strip("\n"))
+
+    def save(self):
+        with open(self.filepath, "w", encoding="utf-8") as f:
+            f.write("\n".join(self.log_lines))
+
+
+class Sink(threading.Thread):
+    """
+    Chargeur d'une base alimenté par une file bornée : messages (méthode, arguments) traités
+    dans l'ordre, une unité de validation par société. Après une erreur, les messages
+    de la société sont ignorés jusqu'à sa fin ; les autres sociétés sont chargées normalement
+    """
+    cible = None
+
+    def __init__(self, logger):
+        super().__init__(name=f"sink-{self.cible}", daemon=True)
+        self.logger = logger
+        self.queue = queue.Queue(maxsize=INGESTION_QUEUE)
+        self.manifeste = get_manifeste()
+        self.en_echec = False
+        self.total = 0
+        self.occupe = 0.0
+
+    def envoyer(self, methode, *args):
+        self.queue.put((methode, args))
+
+    def arreter(self):
+        self.queue.put(None)
+
+    def run(self):
+        while True:
+            message = self.queue.get()
+            if message is None:
+                return
+            methode, args = message
+            if self.en_echec and methode != "fin":
+                continue
+            debut = time.monotonic()
+            try:
+                if not self.en_echec:
+                    getattr(self, methode)(*args)
+            except Exception as e:
+                self.logger.log(f"[{self.cible}] Erreur {methode} : {e}", "ERROR")
+                self.en_echec = True
+                self.annuler()
+            finally:
+                self.occupe += time.monotonic() - debut
+            if methode == "fin":
+                self.en_echec = False
+
+    def enregistrer(self, path, signature, nb_lignes):
+        if self.manifeste is not None:
+            self.manifeste.enregistrer(path, self.cible, signature, nb_lignes)
+
+    def annuler(self):
+        pass
+
+
+class PostgresSink(Sink):
+    """Une transaction par société : COPY par lots, suppressions, comptage puis commit"""
+    cible = pg.CIBLE_MANIFESTE
+
+    def __init__(self, conn, logger, rejets_path):
+        super().__init__(logger)
+        self.conn = conn
+        self.rejets_path = rejets_path
+        self.cur = None
+
+    def debut(self, soc, data):
+        self.cur = self.conn.cursor()
+        self.id_societe = pg.insert_societe(self.cur, dict(data, societe=soc), self.logger)
+        self.loader = pg.CopyLoader(self.cur, self.logger, self.rejets_path) if pg.PG_CHARGEMENT == "copy" else None
+        self.ecrits = 0
+        self.supprimes = 0
+        self.a_enregistrer = []
+        # Chargement ligne à ligne : un SAVEPOINT par fichier, un fichier en erreur n'annule pas la société
+        self.fichier_courant = None
+        self.fichier_en_echec = False
+        self.ecrits_fichier = 0
+
+    def _abandonner_fichier(self):
+        """Annule les lignes du fichier en cours (erreur d'insertion, ou lecture interrompue sans message fichier)"""
+        if self.fichier_courant is not None and not self.fichier_en_echec:
+            self.cur.execute("ROLLBACK TO SAVEPOINT fichier_avis")
+            self.cur.execute("RELEASE SAVEPOINT fichier_avis")
+        self.fichier_courant = None
+
+    def avis(self, path, lot):
+        source = os.path.join(os.path.basename(os.path.dirname(path)), os.path.basename(path))
+        if self.loader is not None:
+            for avis in lot:
+                self.loader.ajouter(self.id_societe, avis, source)
+            return
+        if path != self.fichier_courant:
+            self._abandonner_fichier()
+            self.cur.execute("SAVEPOINT fichier_avis")
+            self.fichier_courant, self.fichier_en_echec, self.ecrits_fichier = path, False, 0
+        if self.fichier_en_echec:
+            return
+        try:
+            for avis in lot:
+                pg.insert_avis(self.cur, self.id_societe, avis, self.logger)
+                self.ecrits_fichier += self.cur.rowcount
+        except Exception as e:
+            self.logger.log(f"[{self.cible}] Erreur fichier {source} : {e}", "WARNING")
+            self._abandonner_fichier()
+            self.fichier_courant, self.fichier_en_echec = path, True
+
+    def fichier(self, path, signature, nb_lignes):
+        if self.loader is None and path == self.fichier_courant:
+            self.fichier_courant = None
+            if self.fichier_en_echec:
+                # Fichier non validé dans le manifeste : rechargé au prochain passage
+                return
+            self.cur.execute("RELEASE SAVEPOINT fichier_avis")
+            self.ecrits += self.ecrits_fichier
+        self.a_enregistrer.append((path, signature, nb_lignes))
+
+    def suppressions(self, path, signature, cles, nb_lignes):
+        # Les avis déjà lus doivent être en base avant d'appliquer les suppressions
+        if self.loader is not None:
+            self.loader.vider()
+        else:
+            self._abandonner_fichier()
+        self.supprimes += pg.supprimer_cles(self.cur, self.id_societe, cles)
+        self.a_enregistrer.append((path, signature, nb_lignes))
+
+    def fin(self, soc):
+        if self.loader is not None:
+            self.loader.vider()
+            self.ecrits = self.loader.charges
+        else:
+            self._abandonner_fichier()
+        total_commentaires = pg.compter_commentaires(self.cur, self.id_societe)
+        self.conn.commit()
+        self.cur.close()
+        for path, signature, nb_lignes in self.a_enregistrer:
+            self.enregistrer(path, signature, nb_lignes)
+        self.total += self.ecrits
+        rejets = f", {self.loader.rejets} rejetés" if self.loader is not None and self.loader.rejets else ""
+        self.logger.log(f"[{self.cible}] {soc} : {self.ecrits} avis nouveaux ou modifiés, {self.supprimes} supprimés{rejets}, "
+                        f"{total_commentaires} en base", "SUCCESS")
+
+    def annuler(self):
+        self.conn.rollback()
+        self.fichier_courant = None
+        if self.cur is not None:
+            self.cur.close()
+
+
+class MongoSink(Sink):
+    """Upserts non ordonnés par lot ; chaque fichier est validé dans le manifeste une fois écrit"""
+    cible = mg.CIBLE_MANIFESTE
+
+    def __init__(self, db, logger):
+        super().__init__(logger)
+        self.db = db
+        self.collection = mg.collection_avis(db)
+
+    def debut(self, soc, data):
+        mg.upsert_societe(self.db, soc, data)
+        self.soc = soc
+        self.societe_nom = data.get("societe", soc)
+        self.ecrits = 0
+        self.supprimes = 0
+        self.refuses = {}
+
+    def avis(self, path, lot):
+        ecrits, refuses = mg.upsert_avis(self.collection, self.soc, self.societe_nom, lot, self.logger)
+        self.ecrits += ecrits
+        if refuses:
+            self.refuses[path] = self.refuses.get(path, 0) + refuses
+
+    def fichier(self, path, signature, nb_lignes):
+        if path in self.refuses:
+            # Fichier non validé dans le manifeste : les avis refusés seront retentés au prochain chargement
+            self.logger.log(f"[{self.cible}] {self.refuses.pop(path)} avis refusés dans {path}, fichier à recharger", "WARNING")
+            return
+        self.enregistrer(path, signature, nb_lignes)
+
+    def suppressions(self, path, signature, cles, nb_lignes):
+        self.supprimes += mg.supprimer_cles(self.db, self.soc, cles)
+        self.enregistrer(path, signature, nb_lignes)
+
+    def fin(self, soc):
+        self.total += self.ecrits
+        self.logger.log(f"[{self.cible}] {soc} : {self.ecrits} avis nouveaux ou modifiés, {self.supprimes} supprimés", "SUCCESS")
+
+
+def cibles_a_charger(manifeste, path, sinks):
+    """[(sink, signature)] des bases pour lesquelles le fichier est nouveau ou modifié"""
+    if manifeste is None:
+        return [(sink, None) for sink in sinks]
+    signatures = manifeste.verifier_cibles(path, [sink.cible for sink in sinks])
+    return [(sink, signatures[sink.cible]) for sink in sinks if sink.cible in signatures]
+
+
+def lire_societe(soc, sinks, manifeste, logger):
+    """
+    Lecture unique des fichiers d'une société : chaque lot d'avis est envoyé tel quel
+    aux bases qui ne l'ont pas encore chargé
+    """
+    societe_path = os.path.join(DATA_DIR, soc)
+    fichier_info = pg.trouver_fichier_info_generale(societe_path, soc) if os.path.isdir(societe_path) else None
+    if not fichier_info:
+        logger.log(f"Dossier ou fichier info de {soc} introuvable - skip", "WARNING")
+        return 0
+    try:
+        with open(fichier_info, encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.log(f"Erreur lecture {fichier_info}: {e}", "ERROR")
+        return 0
+
+    for sink in sinks:
+        sink.envoyer("debut", soc, data)
+
+    lus = 0
+    for scrap_dir in dossiers_scrap(societe_path, soc):
+        scrap_path = os.path.join(societe_path, scrap_dir)
+        for file in fichiers_avis(scrap_path, soc):
+            path = os.path.join(scrap_path, file)
+            cibles = cibles_a_charger(manifeste, path, sinks)
+            if not cibles:
+                continue
+            nb_lignes = 0
+            try:
+                for lot in lots(iter_avis(path), INGESTION_LOT):
+                    for sink, _ in cibles:
+                        sink.envoyer("avis", path, lot)
+                    nb_lignes += len(lot)
+            except (OSError, ValueError) as e:
+                # Fichier non validé dans le manifeste : relu au prochain chargement
+                logger.log(f"Erreur lecture {path}: {e}", "ERROR")
+                continue
+            finally:
+                lus += nb_lignes
+            for sink, signature in cibles:
+                sink.envoyer("fichier", path, signature, nb_lignes)
+
+        for file in fichiers_deltas(scrap_path):
+            path = os.path.join(scrap_path, file)
+            cibles = cibles_a_charger(manifeste, path, sinks)
+            if not cibles:
+                continue
+            try:
+                evenements = lire_avis(path)
+            except (OSError, ValueError) as e:
+                logger.log(f"Erreur lecture deltas {path}: {e}", "ERROR")
+                continue
+            cles = [cle_avis(evt) for evt in evenements if evt.get("evenement") == "supprime"]
+            for sink, signature in cibles:
+                sink.envoyer("suppressions", path, signature, cles, len(evenements))
+
+    for sink in sinks:
+        sink.envoyer("fin", soc)
+    logger.log(f"{soc} : {lus} avis lus", "INFO")
+    return lus
+
+
+def main():
+    os.makedirs(LOG_DIR, exist_ok=True)
+    logger = Logger(os.path.join(LOG_DIR, f"ingestion_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log"))
+    manifeste = get_manifeste()
+    sinks = []
+    conn = client = None
+
+    try:
+        if mg.CIBLE_MANIFESTE in INGESTION_CIBLES:
+            # Combinaison MONGO_W / MONGO_J refusée avant tout chargement
+            mg.write_concern_avis()
+        if pg.CIBLE_MANIFESTE in INGESTION_CIBLES:
+            conn = psycopg2.connect(**pg.parametres_connexion())
+            with conn.cursor() as cur:
+                pg.preparer_schema(cur, logger)
+                if pg.INSERT_MODE == "complet":
+                    pg.truncate_tables(cur, logger)
+            conn.commit()
+            sinks.append(PostgresSink(conn, logger, pg.get_rejets_file()))
+
+        if mg.CIBLE_MANIFESTE in INGESTION_CIBLES:
+            client = MongoClient(os.getenv("MONGO_URI"), serverSelectionTimeoutMS=5000)
+            client.server_info()
+            db = client[os.getenv("MONGO_DB")]
+            if mg.INSERT_MODE == "complet":
+                db.societe.delete_many({})
+                db.avis_trustpilot.delete_many({})
+            mg.creer_index_avis(db, logger)
+            sinks.append(MongoSink(db, logger))
+
+        if manifeste is not None and pg.INSERT_MODE == "complet":
+            for sink in sinks:
+                manifeste.reinitialiser(sink.cible)
+
+        logger.log(f"Ingestion vers {', '.join(s.cible for s in sinks)} | mode {pg.INSERT_MODE}", "INFO")
+        debut = time.monotonic()
+        for sink in sinks:
+            sink.start()
+        lus = 0
+        try:
+            for soc in pg.SOCIETES_A_TRAITER:
+                lus += lire_societe(soc, sinks, manifeste, logger)
+        finally:
+            for sink in sinks:
+                sink.arreter()
+            for sink in sinks:
+                sink.join()
+
+        duree = time.monotonic() - debut
+        logger.log(f"Ingestion terminée en {duree:.1f}s | {lus} avis lus | "
+                   + ", ".join(f"{s.cible}: {s.total} écrits ({s.occupe:.1f}s d'écriture)" for s in sinks), "SUCCESS")
+    except Exception as e:
+        logger.log(f"Erreur globale : {e}", "ERROR")
+    finally:
+        if conn is not None:
+            conn.close()
+        if client is not None:
+            client.close()
+        logger.save()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,14 @@
 import os
 import json
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
-from pymongo import MongoClient
-from pymongo.errors import ConnectionFailure, PyMongoError
+from pymongo import MongoClient, UpdateOne, ASCENDING
+from pymongo.errors import BulkWriteError, ConnectionFailure, PyMongoError
+from pymongo.write_concern import WriteConcern
+from lecture_scrap import ParcoursScraps, iter_avis, lire_avis, lots, cle_avis
+from manifeste import get_manifeste
 
 # Chargement du .env avec fallback silencieux
 try:
@@ -15,6 +20,19 @@ except ImportError:
 BASE_DIR = os.getenv("BASE_DIR", "/home/datascientest/cde")
 SOCIETES_A_TRAITER = ['temu', 'tesla', 'chronopost', 'vinted']
 LOG_DIR = os.path.join(BASE_DIR, "log")
+# incremental : upserts sur (id_societe, cle_avis) ; complet : collections vidées puis rechargées
+INSERT_MODE = os.getenv("INSERT_MODE", "incremental")
+# Nom de cette base dans le manifeste des fichiers chargés
+CIBLE_MANIFESTE = "mongodb"
+# Avis envoyés par bulk_write non ordonné, lus en flux depuis les fichiers
+MONGO_BATCH_SIZE = int(os.getenv("MONGO_BATCH_SIZE", "1000"))
+# Write concern des écritures d'avis : MONGO_W=0|1|majority, MONGO_J=1 pour attendre le journal
+MONGO_W = os.getenv("MONGO_W", "1")
+MONGO_J = os.getenv("MONGO_J", "0") == "1"
+# Champs qui changent quand de nouveaux avis décalent les pages : fixés à la première insertion seulement
+CHAMPS_INSERTION = ("page", "url_page")
+# Sociétés chargées en parallèle sur le même MongoClient (pool de connexions interne)
+INSERT_WORKERS = int(os.getenv("INSERT_WORKERS", "4"))
 
 def ensure_log_dir():
     """Crée le répertoire de logs si inexistant"""
@@ -31,13 +49,15 @@ class Logger:
     def __init__(self, filepath):
         self.filepath = filepath
         self.log_lines = []
+        self._lock = threading.Lock()
 
     def log(self, msg, level="INFO"):
         """Ajoute un message de log avec timestamp"""
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         full_msg = f"[{timestamp}] {level} - {msg}"
-        print(full_msg)
-        self.log_lines.append(full_msg)
+        with self._lock:
+            print(full_msg)
+            self.log_lines.append(full_msg)
 
     def save(self):
         """Sauvegarde les logs dans le fichier"""
@@ -70,6 +90,180 @@ def convertir_repartition(repartition):
         "total": repartition.get("Total")
     }
 
+def upsert_societe(db, soc, societe_data):
+    """Données générales d'une société (PyMongoError / ValueError laissées à l'appelant)"""
+    repartition = convertir_repartition(societe_data.get("repartition_avis", {}))
+    db.societe.update_one(
+        {"nom": soc},
+        {"$set": {
+            "nom": societe_data.get("societe", soc),
+            "url": societe_data.get("url"),
+            "secteur": societe_data.get("secteur"),
+            "note_globale": float(societe_data.get("note_globale")) if societe_data.get("note_globale") else None,
+            "nombre_avis": int(societe_data.get("nombre_avis", 0)),
+            "note_1": repartition.get("1"),
+            "note_2": repartition.get("2"),
+            "note_3": repartition.get("3"),
+            "note_4": repartition.get("4"),
+            "note_5": repartition.get("5"),
+            "total_avis": repartition.get("total"),
+            "date_extraction": datetime.strptime(societe_data["date_extraction"], "%Y-%m-%d %H:%M:%S") if societe_data.get("date_extraction") else None,
+            "nombre_commentaires": int(societe_data.get("nombre_commentaires", 0)),
+            "pages_scrapees": societe_data.get("pages_scrapees", "")
+        }},
+        upsert=True
+    )
+
+def creer_index_avis(db, log):
+    """Index unique de la clé naturelle des avis (les documents antérieurs sans clé sont ignorés)"""
+    try:
+        db.avis_trustpilot.create_index(
+            [("id_societe", ASCENDING), ("cle_avis", ASCENDING)],
+            unique=True, partialFilterExpression={"cle_avis": {"$exists": True}}
+        )
+    except PyMongoError as e:
+        log.log(f"Index unique (id_societe, cle_avis) impossible : {str(e)} - relancer avec INSERT_MODE=complet", "WARNING")
+    if db.avis_trustpilot.find_one({"cle_avis": {"$exists": False}}, {"_id": 1}) is not None:
+        # Avis antérieurs à la clé naturelle : jamais rapprochés par les upserts, donc dupliqués
+        log.log("Avis sans cle_avis en base : relancer une fois avec INSERT_MODE=complet", "WARNING")
+
+def write_concern_avis():
+    """Write concern des avis d'après MONGO_W / MONGO_J (ValueError si la combinaison est impossible)"""
+    w = int(MONGO_W) if MONGO_W.isdigit() else MONGO_W
+    if w == 0 and MONGO_J:
+        raise ValueError("MONGO_W=0 (écritures non acquittées) est incompatible avec MONGO_J=1")
+    return WriteConcern(w=w, j=MONGO_J or None)
+
+def collection_avis(db):
+    """Collection des avis avec le write concern configuré"""
+    return db.avis_trustpilot.with_options(write_concern=write_concern_avis())
+
+def upsert_avis(collection, soc, societe_nom, lot, log):
+    """
+    Upsert non ordonné d'un lot d'avis sur (id_societe, cle_avis) : un avis inchangé n'est pas réécrit.
+    Renvoie (avis nouveaux ou modifiés, avis refusés) ; 0 écrit si les écritures ne sont pas acquittées (MONGO_W=0)
+    """
+    if not lot:
+        return 0, 0
+    date_chargement = datetime.utcnow()
+    operations = []
+    for avis in lot:
+        contenu = {k: v for k, v in avis.items() if k not in CHAMPS_INSERTION}
+        contenu["societe_nom"] = societe_nom
+        insertion = {k: avis[k] for k in CHAMPS_INSERTION if k in avis}
+        insertion["date_chargement"] = date_chargement
+        operations.append(UpdateOne(
+            {"id_societe": soc, "cle_avis": cle_avis(avis)},
+            {"$set": contenu, "$setOnInsert": insertion},
+            upsert=True
+        ))
+    try:
+        resultat = collection.bulk_write(operations, ordered=False)
+    except BulkWriteError as e:
+        # Non ordonné : les autres opérations du lot sont passées ; le lot n'est validé
+        # que sans erreur d'écriture ni de write concern
+        erreurs = e.details.get("writeErrors", []) + e.details.get("writeConcernErrors", [])
+        log.log(f"{len(erreurs)} avis refusés sur {len(operations)} ({soc}) : {erreurs[0].get('errmsg') if erreurs else e}", "WARNING")
+        return e.details.get("nUpserted", 0) + e.details.get("nModified", 0), max(len(erreurs), 1)
+    if not resultat.acknowledged:
+        return 0, 0
+    return resultat.upserted_count + resultat.modified_count, 0
+
+def supprimer_cles(db, soc, cles):
+    """Supprime les avis d'une société par clé naturelle ; renvoie leur nombre"""
+    if not cles:
+        return 0
+    return db.avis_trustpilot.delete_many({"id_societe": soc, "cle_avis": {"$in": cles}}).deleted_count
+
+def supprimer_avis(db, soc, deltas, manifeste, log):
+    """Supprime les avis signalés comme supprimés dans les flux de deltas [(chemin, signature)]"""
+    supprimes = 0
+    for path, signature in deltas:
+        try:
+            evenements = lire_avis(path)
+        except json.JSONDecodeError as e:
+            log.log(f"Erreur JSON dans {path}: {str(e)}", "ERROR")
+            continue
+        supprimes += supprimer_cles(db, soc, [cle_avis(evt) for evt in evenements if evt.get("evenement") == "supprime"])
+        if manifeste is not None:
+            manifeste.enregistrer(path, CIBLE_MANIFESTE, signature, len(evenements))
+    return supprimes
+
+def traiter_societe(db, soc, manifeste, log):
+    """Charge une société et ses avis ; renvoie le nombre d'avis nouveaux ou modifiés"""
+    societe_path = os.path.join(BASE_DIR, "data", "trustpilot", soc)
+    if not os.path.isdir(societe_path):
+        log.log(f"Dossier {societe_path} non trouvé, skip.", "WARNING")
+        return 0
+
+    fichier_info = trouver_fichier_info_generale(societe_path, soc)
+    if not fichier_info:
+        log.log(f"Fichier infos générales introuvable pour '{soc}', skip.", "WARNING")
+        return 0
+
+    log.log(f"Traitement de {fichier_info}", "INFO")
+    
+    try:
+        with open(fichier_info, encoding='utf-8') as f:
+            societe_data = json.load(f)
+    except json.JSONDecodeError as e:
+        log.log(f"Erreur de lecture JSON pour {fichier_info}: {str(e)}", "ERROR")
+        return 0
+
+    # Insertion des données société
+    try:
+        upsert_societe(db, soc, societe_data)
+    except PyMongoError as e:
+        log.log(f"Erreur MongoDB lors de l'insertion pour {soc}: {str(e)}", "ERROR")
+        return 0
+    except ValueError as e:
+        log.log(f"Erreur de conversion de données pour {soc}: {str(e)}", "ERROR")
+        return 0
+
+    # Traitement des avis
+    total_avis = 0
+    total_lus = 0
+    repertoires_traites = 0
+    collection = collection_avis(db)
+    societe_nom = societe_data.get("societe", soc)
+
+    # Seuls les fichiers nouveaux ou modifiés depuis le dernier chargement sont relus, en flux
+    parcours = ParcoursScraps(societe_path, soc, manifeste, CIBLE_MANIFESTE)
+    for entry, fichiers, deltas in parcours:
+        repertoires_traites += 1
+        log.log(f"Lecture dossier: {entry}", "INFO")
+
+        for file_path, signature in fichiers:
+            nb_lignes = 0
+            refuses = 0
+            try:
+                for lot in lots(iter_avis(file_path), MONGO_BATCH_SIZE):
+                    ecrits, refuses_lot = upsert_avis(collection, soc, societe_nom, lot, log)
+                    total_avis += ecrits
+                    refuses += refuses_lot
+                    nb_lignes += len(lot)
+                if refuses:
+                    # Fichier non validé dans le manifeste : les avis refusés seront retentés au prochain chargement
+                    log.log(f"{refuses} avis refusés dans {file_path}, fichier à recharger", "WARNING")
+                elif manifeste is not None:
+                    manifeste.enregistrer(file_path, CIBLE_MANIFESTE, signature, nb_lignes)
+            except json.JSONDecodeError as e:
+                log.log(f"Erreur JSON dans {file_path}: {str(e)}", "ERROR")
+            except PyMongoError as e:
+                log.log(f"Erreur MongoDB lors de l'insertion des avis {file_path}: {str(e)}", "ERROR")
+            total_lus += nb_lignes
+
+        try:
+            supprimes = supprimer_avis(db, soc, deltas, manifeste, log)
+            if supprimes:
+                log.log(f"{supprimes} avis supprimés ({entry})", "INFO")
+        except PyMongoError as e:
+            log.log(f"Erreur MongoDB lors des suppressions {entry}: {str(e)}", "ERROR")
+
+    log.log(f"Société traitée: {soc} (Avis lus: {total_lus}, nouveaux ou modifiés: {total_avis}, "
+            f"Répertoires traités: {repertoires_traites}, déjà chargés: {parcours.inchanges})", "SUCCESS")
+    return total_avis
+
 def main():
     ensure_log_dir()
     log = Logger(get_log_file())
@@ -83,112 +277,46 @@ def main():
         log.save()
         return
 
+    try:
+        write_concern_avis()
+    except ValueError as e:
+        log.log(f"Write concern invalide : {str(e)}", "ERROR")
+        log.save()
+        return
+
     try:
         # Connexion à MongoDB avec vérification
-        client = MongoClient(mongo_uri, serverSelectionTimeoutMS=5000)
+        client = MongoClient(mongo_uri, serverSelectionTimeoutMS=5000, maxPoolSize=max(INSERT_WORKERS, 1) * 2)
         client.server_info()  # Teste la connexion
         db = client[mongo_db]
         log.log(f"Connecté à MongoDB | Base: {mongo_db}", "SUCCESS")
 
-        # Vidage des collections avant import (une seule fois au début)
-        try:
-            db.societe.delete_many({})
-            db.avis_trustpilot.delete_many({})
-            log.log("Collections vidées avec succès avant import", "INFO")
-        except PyMongoError as e:
-            log.log(f"Erreur lors du vidage des collections: {str(e)}", "ERROR")
-            raise
-
-        for soc in SOCIETES_A_TRAITER:
-            societe_path = os.path.join(BASE_DIR, "data", "trustpilot", soc)
-            if not os.path.isdir(societe_path):
-                log.log(f"Dossier {societe_path} non trouvé, skip.", "WARNING")
-                continue
-
-            fichier_info = trouver_fichier_info_generale(societe_path, soc)
-            if not fichier_info:
-                log.log(f"Fichier infos générales introuvable pour '{soc}', skip.", "WARNING")
-                continue
-
-            log.log(f"Traitement de {fichier_info}", "INFO")
-            
-            try:
-                with open(fichier_info, encoding='utf-8') as f:
-                    societe_data = json.load(f)
-            except json.JSONDecodeError as e:
-                log.log(f"Erreur de lecture JSON pour {fichier_info}: {str(e)}", "ERROR")
-                continue
-
-            repartition = convertir_repartition(societe_data.get("repartition_avis", {}))
-
-            # Insertion des données société
+        # Mode complet : vidage des collections avant import (une seule fois au début)
+        if INSERT_MODE == "complet":
             try:
-                db.societe.update_one(
-                    {"nom": soc},
-                    {"$set": {
-                        "nom": societe_data.get("societe", soc),
-                        "url": societe_data.get("url"),
-                        "secteur": societe_data.get("secteur"),
-                        "note_globale": float(societe_data.get("note_globale")) if societe_data.get("note_globale") else None,
-                        "nombre_avis": int(societe_data.get("nombre_avis", 0)),
-                        "note_1": repartition.get("1"),
-                        "note_2": repartition.get("2"),
-                        "note_3": repartition.get("3"),
-                        "note_4": repartition.get("4"),
-                        "note_5": repartition.get("5"),
-                        "total_avis": repartition.get("total"),
-                        "date_extraction": datetime.strptime(societe_data["date_extraction"], "%Y-%m-%d %H:%M:%S") if societe_data.get("date_extraction") else None,
-                        "nombre_commentaires": int(societe_data.get("nombre_commentaires", 0)),
-                        "pages_scrapees": societe_data.get("pages_scrapees", "")
-                    }},
-                    upsert=True
-                )
+                db.societe.delete_many({})
+                db.avis_trustpilot.delete_many({})
+                log.log("Collections vidées avec succès avant import", "INFO")
             except PyMongoError as e:
-                log.log(f"Erreur MongoDB lors de l'insertion pour {soc}: {str(e)}", "ERROR")
-                continue
-            except ValueError as e:
-                log.log(f"Erreur de conversion de données pour {soc}: {str(e)}", "ERROR")
-                continue
-
-            # Traitement des avis
-            pattern_dir = re.compile(rf"scrap_{soc}_\d{{8}}(_\d+)?")
-            total_avis = 0
-            repertoires_traite = set()
-
-            for entry in sorted(os.listdir(societe_path)):
-                full_path = os.path.join(societe_path, entry)
-                if os.path.isdir(full_path) and pattern_dir.fullmatch(entry):
-                    if entry in repertoires_traite:
-                        log.log(f"Dossier déjà traité dans cette session: {entry}", "WARNING")
-                        continue
-                    repertoires_traite.add(entry)
-
-                    log.log(f"Lecture dossier: {entry}", "INFO")
-
-                    for file in os.listdir(full_path):
-                        if file.endswith(".json") and not file.startswith(f"{soc}_informations_generales"):
-                            file_path = os.path.join(full_path, file)
-                            try:
-                                with open(file_path, encoding='utf-8') as f:
-                                    avis_list = json.load(f)
-                                
-                                # Ajout des métadonnées
-                                for avis in avis_list:
-                                    avis.update({
-                                        "date_chargement": datetime.utcnow(),
-                                        "id_societe": soc,
-                                        "societe_nom": societe_data.get("societe", soc)
-                                    })
-                                
-                                if avis_list:
-                                    db.avis_trustpilot.insert_many(avis_list)
-                                    total_avis += len(avis_list)
-                            except json.JSONDecodeError as e:
-                                log.log(f"Erreur JSON dans {file_path}: {str(e)}", "ERROR")
-                            except PyMongoError as e:
-                                log.log(f"Erreur MongoDB lors de l'insertion des avis {file_path}: {str(e)}", "ERROR")
-
-            log.log(f"Société traitée: {soc} (Avis importés: {total_avis}, Répertoires traités: {len(repertoires_traite)})", "SUCCESS")
+                log.log(f"Erreur lors du vidage des collections: {str(e)}", "ERROR")
+                raise
+        manifeste = get_manifeste()
+        if INSERT_MODE == "complet" and manifeste is not None:
+            manifeste.reinitialiser(CIBLE_MANIFESTE)
+        creer_index_avis(db, log)
+        log.log(f"Mode de chargement : {INSERT_MODE}", "INFO")
+
+        workers = max(1, min(INSERT_WORKERS, len(SOCIETES_A_TRAITER)))
+        log.log(f"Chargement de {len(SOCIETES_A_TRAITER)} sociétés sur {workers} workers", "INFO")
+        total_avis = 0
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(traiter_societe, db, soc, manifeste, log): soc for soc in SOCIETES_A_TRAITER}
+            for future in as_completed(futures):
+                try:
+                    total_avis += future.result()
+                except Exception as e:
+                    log.log(f"Erreur inattendue pour {futures[future]}: {str(e)}", "ERROR")
+        log.log(f"Import terminé | Avis nouveaux ou modifiés: {total_avis}", "SUCCESS")
 
     except ConnectionFailure as e:
         log.log(f"Échec de connexion à MongoDB: {str(e)}", "ERROR")
@@ -1,10 +1,17 @@
+import io
 import os
 import json
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 import psycopg2
 from psycopg2 import OperationalError
+from psycopg2.pool import ThreadedConnectionPool
 from dotenv import load_dotenv
+from lecture_scrap import ParcoursScraps, iter_avis, lire_avis, cle_avis
+from manifeste import get_manifeste
+from normalisation import COLONNES_AVIS, normaliser_lot, vers_csv, vers_tuples
 
 # Chargement des variables d'environnement
 load_dotenv()
@@ -13,15 +20,45 @@ load_dotenv()
 DATA_RAW_TRUSTPILOT = os.getenv("DATA_RAW_TRUSTPILOT")
 LOG_DIR = os.getenv("LOG_DIR")
 SOCIETES_A_TRAITER = ['temu', 'tesla', 'chronopost', 'vinted']
+# incremental : upsert sur (id_societe, cle_avis) sans vider les tables ; complet : TRUNCATE puis rechargement
+INSERT_MODE = os.getenv("INSERT_MODE", "incremental")
+# Nom de cette base dans le manifeste des fichiers chargés
+CIBLE_MANIFESTE = "postgre"
+# Sociétés chargées en parallèle, une connexion du pool et une transaction chacune
+INSERT_WORKERS = int(os.getenv("INSERT_WORKERS", "4"))
+# Chargement des avis : COPY par lots (défaut) ou INSERT ligne à ligne
+PG_CHARGEMENT = os.getenv("PG_CHARGEMENT", "copy")
+PG_COPY_BATCH = int(os.getenv("PG_COPY_BATCH", "10000"))
+
+# Un avis déjà chargé n'est réécrit que si son contenu a changé
+UPSERT_AVIS_SQL = f"""
+    INSERT INTO avis_trustpilot ({", ".join(COLONNES_AVIS)}) {{source}}
+    ON CONFLICT (id_societe, cle_avis) DO UPDATE SET
+        page = EXCLUDED.page, url_page = EXCLUDED.url_page, auteur = EXCLUDED.auteur,
+        date_avis = EXCLUDED.date_avis, commentaire = EXCLUDED.commentaire,
+        note_commentaire = EXCLUDED.note_commentaire, date_chargement = EXCLUDED.date_chargement
+    WHERE (avis_trustpilot.auteur, avis_trustpilot.date_avis, avis_trustpilot.commentaire, avis_trustpilot.note_commentaire)
+        IS DISTINCT FROM (EXCLUDED.auteur, EXCLUDED.date_avis, EXCLUDED.commentaire, EXCLUDED.note_commentaire);
+"""
+INSERT_AVIS_SQL = UPSERT_AVIS_SQL.format(source=f"VALUES ({', '.join(['%s'] * len(COLONNES_AVIS))})")
+# COPY dans une table temporaire, fusionnée ensuite dans avis_trustpilot
+STAGING_SQL = f"CREATE TEMP TABLE IF NOT EXISTS avis_staging AS SELECT {', '.join(COLONNES_AVIS)} FROM avis_trustpilot WITH NO DATA"
+FUSION_STAGING_SQL = UPSERT_AVIS_SQL.format(source=f"SELECT {', '.join(COLONNES_AVIS)} FROM avis_staging")
+# NULL explicite : un champ vide reste une chaîne vide
+COPY_AVIS_SQL = f"COPY avis_staging ({', '.join(COLONNES_AVIS)}) FROM STDIN WITH (FORMAT csv, NULL '\\N')"
+
+_rejets_lock = threading.Lock()
 
 class Logger:
     def __init__(self, filepath):
         self.filepath = filepath
         self.log_lines = []
+        self._lock = threading.Lock()
     
     def print(self, msg):
-        print(msg)
-        self.log_lines.append(msg)
+        with self._lock:
+            print(msg)
+            self.log_lines.append(msg)
     
     def save(self):
         try:
@@ -37,15 +74,21 @@ def ensure_log_dir():
 def get_log_file():
     return os.path.join(LOG_DIR, f"import_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log")
 
-def connect_db():
+def get_rejets_file():
+    return os.path.join(LOG_DIR, f"rejets_postgre_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jsonl")
+
+def parametres_connexion():
+    return dict(
+        dbname=os.getenv("POSTGRES_DB"),
+        user=os.getenv("POSTGRES_USER"),
+        password=os.getenv("POSTGRES_PASSWORD"),
+        host=os.getenv("POSTGRES_HOST"),
+        port=os.getenv("POSTGRES_PORT")
+    )
+
+def creer_pool(taille):
     try:
-        return psycopg2.connect(
-            dbname=os.getenv("POSTGRES_DB"),
-            user=os.getenv("POSTGRES_USER"),
-            password=os.getenv("POSTGRES_PASSWORD"),
-            host=os.getenv("POSTGRES_HOST"),
-            port=os.getenv("POSTGRES_PORT")
-        )
+        return ThreadedConnectionPool(1, taille, **parametres_connexion())
     except OperationalError as e:
         raise RuntimeError(f"Erreur connexion PostgreSQL : {e}")
 
@@ -57,6 +100,17 @@ def truncate_tables(cur, logger):
         logger.print(f"Erreur TRUNCATE tables : {e}")
         raise
 
+def preparer_schema(cur, logger):
+    """
+    Clé naturelle des avis sur une base créée avant son introduction
+    (les avis déjà présents n'ont pas de clé : recharger une fois avec INSERT_MODE=complet)
+    """
+    cur.execute("ALTER TABLE avis_trustpilot ADD COLUMN IF NOT EXISTS cle_avis VARCHAR(64);")
+    cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS ux_avis_societe_cle ON avis_trustpilot (id_societe, cle_avis);")
+    cur.execute("SELECT EXISTS (SELECT 1 FROM avis_trustpilot WHERE cle_avis IS NULL);")
+    if cur.fetchone()[0]:
+        logger.print("⚠ Avis sans cle_avis en base : relancer une fois avec INSERT_MODE=complet")
+
 def safe_int(val):
     if val is None:
         return 0
@@ -93,6 +147,11 @@ def insert_societe(cur, societe_data, logger):
                 note_1, note_2, note_3, note_4, note_5,
                 date_extraction, nombre_commentaires
             ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            ON CONFLICT (nom) DO UPDATE SET
+                url = EXCLUDED.url, secteur = EXCLUDED.secteur, note_globale = EXCLUDED.note_globale,
+                nombre_avis = EXCLUDED.nombre_avis, note_1 = EXCLUDED.note_1, note_2 = EXCLUDED.note_2,
+                note_3 = EXCLUDED.note_3, note_4 = EXCLUDED.note_4, note_5 = EXCLUDED.note_5,
+                date_extraction = EXCLUDED.date_extraction
             RETURNING id_societe;
         """, (
             societe_data["societe"],
@@ -117,12 +176,7 @@ def insert_avis(cur, id_societe, avis, logger):
         logger.print(f"⚠ Format date avis invalide : {avis.get('date')}")
 
     try:
-        cur.execute("""
-            INSERT INTO avis_trustpilot (
-                id_societe, page, url_page, auteur, date_avis, 
-                commentaire, note_commentaire, date_chargement
-            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s);
-        """, (
+        cur.execute(INSERT_AVIS_SQL, (
             id_societe,
             avis.get("page"),
             avis.get("url_page"),
@@ -130,12 +184,83 @@ def insert_avis(cur, id_societe, avis, logger):
             date_avis,
             avis.get("commentaire"),
             safe_int(avis.get("note_commentaire")),
-            datetime.utcnow()
+            datetime.utcnow(),
+            cle_avis(avis)
         ))
     except Exception as e:
         logger.print(f"❌ Erreur insertion avis (ID société {id_societe}): {e}")
         raise
 
+class CopyLoader:
+    """
+    Chargement des avis par COPY ... FROM STDIN (CSV), par lots de `batch_size` lignes
+    normalisés colonne par colonne (normalisation.py), dans une table temporaire
+    fusionnée par upsert sur (id_societe, cle_avis).
+    Un lot refusé par PostgreSQL est rejoué ligne à ligne : seules les lignes fautives
+    partent dans le fichier de rejets, le reste du fichier est chargé
+    """
+    def __init__(self, cur, logger, rejets_path, batch_size=PG_COPY_BATCH):
+        self.cur = cur
+        self.logger = logger
+        self.rejets_path = rejets_path
+        self.batch_size = batch_size
+        self.date_chargement = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S.%f")
+        self.lot = []
+        self.lus = 0
+        self.charges = 0
+        self.rejets = 0
+        self.cur.execute(STAGING_SQL)
+
+    def ajouter(self, id_societe, avis, source):
+        self.lus += 1
+        self.lot.append((id_societe, avis, source))
+        if len(self.lot) >= self.batch_size:
+            self.vider()
+
+    def vider(self):
+        if not self.lot:
+            return
+        lot, self.lot = self.lot, []
+        df, rejets = normaliser_lot([avis for _, avis, _ in lot], [id_societe for id_societe, _, _ in lot], self.date_chargement)
+        for position, motif in rejets:
+            self._rejeter(lot[position][1], lot[position][2], motif)
+        # Un avis présent dans plusieurs scraps du lot : la dernière version lue l'emporte
+        df = df.drop_duplicates(subset=["id_societe", "cle_avis"], keep="last")
+        if df.empty:
+            return
+        buffer = io.StringIO()
+        vers_csv(df, buffer)
+        buffer.seek(0)
+
+        self.cur.execute("SAVEPOINT lot_copy")
+        try:
+            self.cur.copy_expert(COPY_AVIS_SQL, buffer)
+            self.cur.execute(FUSION_STAGING_SQL)
+            self.charges += self.cur.rowcount
+            self.cur.execute("TRUNCATE avis_staging")
+            self.cur.execute("RELEASE SAVEPOINT lot_copy")
+            return
+        except psycopg2.Error as e:
+            self.cur.execute("ROLLBACK TO SAVEPOINT lot_copy")
+            self.cur.execute("TRUNCATE avis_staging")
+            self.logger.print(f"⚠ Lot COPY de {len(df)} avis refusé ({str(e).strip()}), reprise ligne à ligne")
+
+        for position, ligne in zip(df.index, vers_tuples(df)):
+            _, avis, source = lot[position]
+            self.cur.execute("SAVEPOINT ligne_copy")
+            try:
+                self.cur.execute(INSERT_AVIS_SQL, ligne)
+                self.cur.execute("RELEASE SAVEPOINT ligne_copy")
+                self.charges += self.cur.rowcount
+            except psycopg2.Error as e:
+                self.cur.execute("ROLLBACK TO SAVEPOINT ligne_copy")
+                self._rejeter(avis, source, e)
+
+    def _rejeter(self, avis, source, erreur):
+        self.rejets += 1
+        with _rejets_lock, open(self.rejets_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"source": source, "erreur": str(erreur).strip(), "avis": avis}, ensure_ascii=False) + "\n")
+
 def trouver_fichier_info_generale(societe_path, societe_nom):
     pattern = re.compile(rf"{societe_nom}_informations_generales_\d{{8}}_\d{{6}}\.txt")
     candidats = [
@@ -145,23 +270,37 @@ def trouver_fichier_info_generale(societe_path, societe_nom):
     ]
     return max(candidats) if candidats else None
 
-def compter_commentaires(societe_path, societe_nom, logger):
-    total = 0
-    pattern_dir = re.compile(rf"scrap_{societe_nom}_\d{{8}}(_\d+)?")
-    
-    for root, dirs, files in os.walk(societe_path):
-        if pattern_dir.fullmatch(os.path.basename(root)):
-            for file in files:
-                if file.endswith('.json') and not file.startswith(f"{societe_nom}_informations_generales"):
-                    try:
-                        with open(os.path.join(root, file), 'r', encoding='utf-8') as f:
-                            data = json.load(f)
-                            total += len(data)
-                    except Exception as e:
-                        logger.print(f"⚠ Erreur lecture {file}: {e}")
-    return total
+def supprimer_cles(cur, id_societe, cles):
+    """Supprime les avis d'une société par clé naturelle ; renvoie leur nombre"""
+    if not cles:
+        return 0
+    cur.execute("DELETE FROM avis_trustpilot WHERE id_societe = %s AND cle_avis = ANY(%s);", (id_societe, cles))
+    return cur.rowcount
+
+def appliquer_suppressions(cur, id_societe, deltas, a_enregistrer, logger):
+    """
+    Supprime les avis signalés comme supprimés dans les flux de deltas [(chemin, signature)]
+    """
+    cles = []
+    for path, signature in deltas:
+        try:
+            evenements = lire_avis(path)
+        except Exception as e:
+            logger.print(f"⚠ Erreur lecture deltas {os.path.basename(path)}: {e}")
+            continue
+        cles += [cle_avis(evt) for evt in evenements if evt.get("evenement") == "supprime"]
+        a_enregistrer.append((path, signature, len(evenements)))
+    return supprimer_cles(cur, id_societe, cles)
+
+def compter_commentaires(cur, id_societe):
+    """Nombre d'avis en base après chargement (doublons entre scraps exclus)"""
+    cur.execute("""
+        UPDATE societe SET nombre_commentaires = (SELECT COUNT(*) FROM avis_trustpilot WHERE id_societe = %s)
+        WHERE id_societe = %s RETURNING nombre_commentaires;
+    """, (id_societe, id_societe))
+    return cur.fetchone()[0]
 
-def traiter_societe(soc, data_dir, logger, conn):
+def traiter_societe(soc, data_dir, logger, conn, rejets_path=None):
     societe_path = os.path.join(data_dir, soc)
     if not os.path.isdir(societe_path):
         logger.print(f"⚠ Dossier {soc} introuvable - skip")
@@ -182,49 +321,70 @@ def traiter_societe(soc, data_dir, logger, conn):
 
     try:
         with conn.cursor() as cur:
-            total_commentaires = compter_commentaires(societe_path, soc, logger)
-            data["nombre_commentaires"] = total_commentaires
-            
             id_societe = insert_societe(cur, data, logger)
             logger.print(f"\n🔍 Traitement {soc} (ID: {id_societe})")
-            logger.print(f"📊 Commentaires totaux: {total_commentaires}")
 
             total_avis = 0
-            pattern_dir = re.compile(rf"scrap_{soc}_\d{{8}}(_\d+)?")
+            manifeste = get_manifeste()
+            # Fichiers chargés, enregistrés dans le manifeste une fois le commit fait
+            a_enregistrer = []
+            total_lus = 0
+            loader = CopyLoader(cur, logger, rejets_path or get_rejets_file()) if PG_CHARGEMENT == "copy" else None
 
-            # Liste des répertoires de scrap triés par date
-            scrap_dirs = sorted([
-                d for d in os.listdir(societe_path) 
-                if os.path.isdir(os.path.join(societe_path, d)) and pattern_dir.fullmatch(d)
-            ], key=lambda x: os.path.getmtime(os.path.join(societe_path, x)), reverse=True)
-
-            for scrap_dir in scrap_dirs:
-                scrap_path = os.path.join(societe_path, scrap_dir)
+            # Un seul passage sur les fichiers pas encore chargés tels quels : lecture en flux,
+            # comptage des lignes au fil de la lecture
+            parcours = ParcoursScraps(societe_path, soc, manifeste, CIBLE_MANIFESTE)
+            for scrap_dir, json_files, deltas in parcours:
                 avis_dir = 0
-                
-                # Compter les fichiers JSON dans ce répertoire
-                json_files = [
-                    f for f in os.listdir(scrap_path) 
-                    if f.endswith('.json') and not f.startswith(f"{soc}_informations_generales")
-                ]
-                
-                for file in json_files:
+                lus_dir = 0
+                charges_avant = loader.charges if loader is not None else 0
+
+                for path, signature in json_files:
+                    file = os.path.basename(path)
+                    nb_lignes = 0
+                    ecrits_fichier = 0
+                    if loader is None:
+                        # Un fichier en erreur n'annule ni la société ni les fichiers déjà chargés
+                        cur.execute("SAVEPOINT fichier_avis")
                     try:
-                        with open(os.path.join(scrap_path, file), 'r', encoding='utf-8') as f:
-                            avis_list = json.load(f)
-                            for avis in avis_list:
+                        for avis in iter_avis(path):
+                            if loader is not None:
+                                loader.ajouter(id_societe, avis, os.path.join(scrap_dir, file))
+                            else:
                                 insert_avis(cur, id_societe, avis, logger)
-                                avis_dir += 1
+                                ecrits_fichier += cur.rowcount
+                            nb_lignes += 1
+                        if loader is None:
+                            cur.execute("RELEASE SAVEPOINT fichier_avis")
+                        avis_dir += ecrits_fichier
+                        a_enregistrer.append((path, signature, nb_lignes))
                     except Exception as e:
                         logger.print(f"⚠ Erreur fichier {file}: {e}")
-                        conn.rollback()  # Rollback seulement la transaction courante
-                        continue  # Passe au fichier suivant
-                
+                        if loader is None:
+                            cur.execute("ROLLBACK TO SAVEPOINT fichier_avis")
+                    lus_dir += nb_lignes
+
+                if loader is not None:
+                    loader.vider()
+                    avis_dir = loader.charges - charges_avant
+
+                supprimes = appliquer_suppressions(cur, id_societe, deltas, a_enregistrer, logger)
                 total_avis += avis_dir
-                logger.print(f"   📂 {scrap_dir}: {avis_dir} avis chargés")
+                total_lus += lus_dir
+                logger.print(f"   📂 {scrap_dir}: {lus_dir} avis lus, {avis_dir} nouveaux ou modifiés"
+                             + (f", {supprimes} supprimés" if supprimes else ""))
 
+            total_commentaires = compter_commentaires(cur, id_societe)
             conn.commit()
-            logger.print(f"✅ {soc}: {total_avis} avis importés au total\n")
+            if manifeste is not None:
+                for path, signature, nb_lignes in a_enregistrer:
+                    manifeste.enregistrer(path, CIBLE_MANIFESTE, signature, nb_lignes)
+            if parcours.inchanges:
+                logger.print(f"   ⏭ {parcours.inchanges} dossiers déjà chargés ignorés")
+            if loader is not None and loader.rejets:
+                logger.print(f"⚠ {soc}: {loader.rejets} avis rejetés -> {loader.rejets_path}")
+            logger.print(f"📊 Commentaires en base: {total_commentaires}")
+            logger.print(f"✅ {soc}: {total_lus} avis lus, {total_avis} importés au total\n")
             return total_avis
 
     except Exception as e:
@@ -232,31 +392,58 @@ def traiter_societe(soc, data_dir, logger, conn):
         conn.rollback()
         return 0
 
+def traiter_societe_pool(pool, soc, data_dir, logger, rejets_path):
+    """
+    Tâche d'un worker : une connexion empruntée au pool pour toute la société
+    """
+    conn = pool.getconn()
+    try:
+        return traiter_societe(soc, data_dir, logger, conn, rejets_path)
+    finally:
+        pool.putconn(conn)
+
 def main():
     ensure_log_dir()
     logger = Logger(get_log_file())
+    workers = max(1, min(INSERT_WORKERS, len(SOCIETES_A_TRAITER)))
 
     try:
-        conn = connect_db()
-        logger.print("⚡ Début importation données TrustPilot")
+        pool = creer_pool(workers)
+        logger.print(f"⚡ Début importation données TrustPilot ({workers} workers)")
 
-        # TRUNCATE une seule fois au début
-        with conn.cursor() as cur:
-            truncate_tables(cur, logger)
-        conn.commit()
+        conn = pool.getconn()
+        try:
+            with conn.cursor() as cur:
+                preparer_schema(cur, logger)
+                # Mode complet : TRUNCATE une seule fois au début
+                if INSERT_MODE == "complet":
+                    truncate_tables(cur, logger)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            pool.putconn(conn)
+        if INSERT_MODE == "complet" and get_manifeste() is not None:
+            get_manifeste().reinitialiser(CIBLE_MANIFESTE)
+        logger.print(f"Mode de chargement : {INSERT_MODE}")
 
         total_avis = 0
-        for societe in SOCIETES_A_TRAITER:
-            total_avis += traiter_societe(societe, DATA_RAW_TRUSTPILOT, logger, conn)
+        rejets_path = get_rejets_file()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(traiter_societe_pool, pool, societe, DATA_RAW_TRUSTPILOT, logger, rejets_path)
+                for societe in SOCIETES_A_TRAITER
+            ]
+            for future in as_completed(futures):
+                total_avis += future.result()
 
         logger.print(f"🏁 Import terminé avec succès | Total avis: {total_avis}")
     except Exception as e:
         logger.print(f"💥 ERREUR GLOBALE: {e}")
-        if 'conn' in locals():
-            conn.rollback()
     finally:
-        if 'conn' in locals():
-            conn.close()
+        if 'pool' in locals():
+            pool.closeall()
         logger.save()
 
 if __name__ == "__main__":
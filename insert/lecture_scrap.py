@@ -0,0 +1,145 @@
+import os
+import re
+import json
+import hashlib
+from itertools import islice
+
+# Taille des blocs lus dans les exports JSON (un tableau d'avis n'est jamais chargé en entier)
+TAILLE_BLOC = 1 << 16
+
+_decoder = json.JSONDecoder()
+_SEPARATEURS = re.compile(r"[\s,]*")
+
+
+def cle_avis(avis):
+    """
+    Clé naturelle d'un avis : id Trustpilot, sinon empreinte SHA-1 de auteur + date + texte
+    (anciens exports sans id). Les événements de suppression du flux de deltas portent la même clé ;
+    les avis chargés avant l'introduction de cle_avis n'en ont pas et exigent un rechargement complet
+    """
+    if avis.get("id_avis_trustpilot"):
+        return str(avis["id_avis_trustpilot"])
+    contenu = avis.get("cle") or f"{avis.get('auteur') or ''}|{avis.get('date') or ''}|{avis.get('commentaire') or ''}"
+    return hashlib.sha1(contenu.encode("utf-8")).hexdigest()
+
+
+def fichiers_avis(scrap_path, societe_nom):
+    """
+    Fichiers d'avis d'un dossier de scrap : le journal JSONL s'il existe,
+    sinon les exports JSON des anciens scraps
+    """
+    fichiers = sorted(os.listdir(scrap_path))
+    journaux = [f for f in fichiers if f.endswith(".jsonl") and "_commentaires_" in f]
+    if journaux:
+        return journaux
+    return [
+        f for f in fichiers
+        if f.endswith(".json") and not f.startswith(f"{societe_nom}_informations_generales")
+    ]
+
+
+def fichiers_deltas(scrap_path):
+    """
+    Flux de deltas d'un dossier de scrap (événements nouveau / modifie / supprime)
+    """
+    return sorted(f for f in os.listdir(scrap_path) if f.endswith(".jsonl") and "_deltas_" in f)
+
+
+def dossiers_scrap(societe_path, societe_nom):
+    """
+    Dossiers scrap_<societe>_<date>[_<heure>] du plus ancien au plus récent : la dernière version d'un avis l'emporte.
+    Ordre tiré de l'horodatage du nom, le mtime d'un dossier changeant à chaque écriture ou copie
+    """
+    pattern_dir = re.compile(rf"scrap_{societe_nom}_(\d{{8}})(?:_(\d+))?")
+    dossiers = []
+    for d in os.listdir(societe_path):
+        match = pattern_dir.fullmatch(d)
+        if match and os.path.isdir(os.path.join(societe_path, d)):
+            dossiers.append(((match.group(1), int(match.group(2) or 0)), d))
+    return [d for _, d in sorted(dossiers)]
+
+
+def fichiers_a_charger(manifeste, cible, scrap_path, fichiers):
+    """
+    [(chemin, signature)] des fichiers nouveaux ou modifiés depuis leur dernier chargement dans `cible`
+    """
+    chemins = [os.path.join(scrap_path, f) for f in fichiers]
+    if manifeste is None:
+        return [(path, None) for path in chemins]
+    signatures = [(path, manifeste.verifier(path, cible)) for path in chemins]
+    return [(path, signature) for path, signature in signatures if signature is not None]
+
+
+class ParcoursScraps:
+    """
+    Parcours unique des dossiers de scrap d'une société : itère sur (dossier, fichiers d'avis,
+    flux de deltas) pour chaque dossier ayant au moins un fichier à charger dans `cible`,
+    fichiers sous forme (chemin, signature) ; les dossiers déjà chargés sont comptés dans `inchanges`
+    """
+    def __init__(self, societe_path, societe_nom, manifeste=None, cible=None):
+        self.societe_path = societe_path
+        self.societe_nom = societe_nom
+        self.manifeste = manifeste
+        self.cible = cible
+        self.inchanges = 0
+
+    def __iter__(self):
+        for scrap_dir in dossiers_scrap(self.societe_path, self.societe_nom):
+            scrap_path = os.path.join(self.societe_path, scrap_dir)
+            avis = fichiers_a_charger(self.manifeste, self.cible, scrap_path, fichiers_avis(scrap_path, self.societe_nom))
+            deltas = fichiers_a_charger(self.manifeste, self.cible, scrap_path, fichiers_deltas(scrap_path))
+            if not avis and not deltas:
+                self.inchanges += 1
+                continue
+            yield scrap_dir, avis, deltas
+
+
+def _iter_tableau_json(f):
+    """
+    Éléments d'un tableau JSON décodés bloc par bloc : la mémoire reste bornée
+    par la taille d'un bloc et du plus gros avis
+    """
+    buffer = f.read(TAILLE_BLOC).lstrip()
+    if not buffer.startswith("["):
+        contenu = json.loads(buffer + f.read())
+        yield from contenu if isinstance(contenu, list) else [contenu]
+        return
+    pos, fin = 1, False
+    while True:
+        pos = _SEPARATEURS.match(buffer, pos).end()
+        if buffer.startswith("]", pos):
+            return
+        try:
+            element, pos = _decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            # Avis coupé en fin de bloc : on complète le buffer, sauf en fin de fichier
+            if fin:
+                raise
+            bloc = f.read(TAILLE_BLOC)
+            fin = not bloc
+            buffer, pos = buffer[pos:] + bloc, 0
+            continue
+        yield element
+
+
+def iter_avis(path):
+    """Avis d'un fichier JSON (tableau) ou JSONL (un avis par ligne), lus au fil de l'eau"""
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from _iter_tableau_json(f)
+
+
+def lire_avis(path):
+    """Liste des avis d'un fichier (flux de deltas, petits fichiers)"""
+    return list(iter_avis(path))
+
+
+def lots(iterable, taille):
+    """Découpe un flux d'avis en listes d'au plus `taille` éléments"""
+    iterateur = iter(iterable)
+    while lot := list(islice(iterateur, taille)):
+        yield lot
@@ -0,0 +1,122 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+
+# Registre des fichiers déjà chargés, partagé par les chargeurs PostgreSQL et MongoDB
+_manifeste = None
+_manifeste_lock = threading.Lock()
+
+
+def hash_fichier(path):
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for bloc in iter(lambda: f.read(1 << 20), b""):
+            h.update(bloc)
+    return h.hexdigest()
+
+
+class Manifeste:
+    """
+    Un enregistrement par fichier et par base cible : taille, mtime, empreinte du contenu,
+    nombre de lignes et date de chargement. Un fichier inchangé depuis son dernier
+    chargement n'est pas rouvert (taille + mtime identiques), ni rechargé (même empreinte)
+    """
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS fichiers (
+                chemin TEXT NOT NULL,
+                cible TEXT NOT NULL,
+                taille INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                hash TEXT NOT NULL,
+                nb_lignes INTEGER,
+                charge_le REAL NOT NULL,
+                PRIMARY KEY (chemin, cible)
+            )
+        """)
+        self._db.commit()
+
+    def verifier(self, path, cible):
+        """
+        None si le fichier est déjà chargé dans `cible` tel quel,
+        sinon sa signature (taille, mtime, hash) à passer à enregistrer()
+        """
+        return self.verifier_cibles(path, (cible,)).get(cible)
+
+    def verifier_cibles(self, path, cibles):
+        """
+        {cible: signature} des cibles où le fichier est nouveau ou modifié,
+        le contenu n'étant haché qu'une fois pour toutes les cibles
+        """
+        st = os.stat(path)
+        chemin = os.path.abspath(path)
+        with self._lock:
+            rows = {
+                cible: self._db.execute(
+                    "SELECT taille, mtime, hash FROM fichiers WHERE chemin = ? AND cible = ?", (chemin, cible)
+                ).fetchone()
+                for cible in cibles
+            }
+        a_verifier = [c for c, row in rows.items() if not (row and row[0] == st.st_size and row[1] == st.st_mtime)]
+        if not a_verifier:
+            return {}
+        empreinte = hash_fichier(path)
+        signatures = {}
+        for cible in a_verifier:
+            row = rows[cible]
+            if row and row[2] == empreinte:
+                # Fichier touché mais contenu identique : seul le mtime est mis à jour
+                with self._lock:
+                    self._db.execute(
+                        "UPDATE fichiers SET taille = ?, mtime = ? WHERE chemin = ? AND cible = ?",
+                        (st.st_size, st.st_mtime, chemin, cible)
+                    )
+                    self._db.commit()
+            else:
+                signatures[cible] = (st.st_size, st.st_mtime, empreinte)
+        return signatures
+
+    def enregistrer(self, path, cible, signature, nb_lignes=None):
+        """
+        À appeler une fois le contenu du fichier validé dans la base cible
+        """
+        taille, mtime, empreinte = signature
+        with self._lock:
+            self._db.execute("""
+                INSERT INTO fichiers (chemin, cible, taille, mtime, hash, nb_lignes, charge_le)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (chemin, cible) DO UPDATE SET
+                    taille = excluded.taille, mtime = excluded.mtime, hash = excluded.hash,
+                    nb_lignes = excluded.nb_lignes, charge_le = excluded.charge_le
+            """, (os.path.abspath(path), cible, taille, mtime, empreinte, nb_lignes, time.time()))
+            self._db.commit()
+
+    def reinitialiser(self, cible):
+        """
+        Oublie tous les fichiers chargés dans `cible` (rechargement complet)
+        """
+        with self._lock:
+            self._db.execute("DELETE FROM fichiers WHERE cible = ?", (cible,))
+            self._db.commit()
+
+
+def get_manifeste():
+    """
+    Manifeste unique pour tout le processus, None s'il est désactivé (MANIFESTE_DB= vide).
+    Chemin lu à l'appel : les chargeurs importent ce module avant load_dotenv()
+    """
+    global _manifeste
+    data_dir = os.getenv("DATA_RAW_TRUSTPILOT") or os.path.join(os.getenv("BASE_DIR", "/home/datascientest/cde"), "data", "trustpilot")
+    db_path = os.getenv("MANIFESTE_DB", os.path.join(data_dir, "manifeste_chargement.sqlite"))
+    if not db_path:
+        return None
+    with _manifeste_lock:
+        if _manifeste is None:
+            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+            _manifeste = Manifeste(db_path)
+        return _manifeste
@@ -0,0 +1,73 @@
+import pandas as pd
+
+from lecture_scrap import cle_avis
+
+# Normalisation d'un lot d'avis colonne par colonne, en amont des chargements par lots
+FORMAT_DATE_AVIS = "%Y-%m-%d %H:%M:%S"
+AUTEUR_MAX = 255
+CHAMPS_SOURCE = ["page", "url_page", "auteur", "date", "commentaire", "note_commentaire"]
+COLONNES_AVIS = ["id_societe", "page", "url_page", "auteur", "date_avis",
+                 "commentaire", "note_commentaire", "date_chargement", "cle_avis"]
+# Premier nombre d'un texte de note ("Noté 4 sur 5 étoiles" -> 4)
+_NOMBRE = r"(-?\d+(?:[.,]\d+)?)"
+
+
+def notes(serie):
+    """
+    Notes entières : valeurs numériques telles quelles, sinon premier nombre du texte, 0 à défaut
+    """
+    valeurs = pd.to_numeric(serie, errors="coerce")
+    textes = valeurs.isna() & serie.notna()
+    if textes.any():
+        extraits = serie[textes].astype(str).str.extract(_NOMBRE, expand=False).str.replace(",", ".", regex=False)
+        valeurs[textes] = pd.to_numeric(extraits, errors="coerce")
+    return valeurs.fillna(0).astype("int64")
+
+
+def normaliser_lot(lot, id_societe, date_chargement):
+    """
+    DataFrame typé (colonnes COLONNES_AVIS, index = position dans `lot`) et rejets [(position, motif)].
+    Date invalide -> NaT, note illisible -> 0 ; page non numérique, auteur trop long
+    ou caractère NUL (refusé par PostgreSQL) -> rejet
+    """
+    brut = pd.DataFrame(lot, columns=CHAMPS_SOURCE)
+    pages = pd.to_numeric(brut["page"], errors="coerce")
+    pages = pages.where(pages % 1 == 0)
+    df = pd.DataFrame({
+        "id_societe": id_societe,
+        "page": pages.astype("Int64"),
+        "url_page": brut["url_page"],
+        "auteur": brut["auteur"],
+        "date_avis": pd.to_datetime(brut["date"], format=FORMAT_DATE_AVIS, errors="coerce"),
+        "commentaire": brut["commentaire"],
+        "note_commentaire": notes(brut["note_commentaire"]),
+        "date_chargement": date_chargement,
+        "cle_avis": [cle_avis(avis) for avis in lot],
+    }, index=brut.index)
+
+    textes = {colonne: brut[colonne].astype("string") for colonne in ("url_page", "auteur", "commentaire")}
+    motifs = [
+        (df["page"].isna() & brut["page"].notna(), "page non numérique"),
+        (textes["auteur"].str.len() > AUTEUR_MAX, f"auteur de plus de {AUTEUR_MAX} caractères"),
+    ]
+    for texte in textes.values():
+        motifs.append((texte.str.contains("\x00", regex=False, na=False), "caractère NUL refusé par PostgreSQL"))
+
+    rejetes = pd.Series(False, index=df.index)
+    rejets = []
+    for masque, motif in motifs:
+        masque = masque.fillna(False).astype(bool) & ~rejetes
+        rejets += [(position, motif) for position in df.index[masque]]
+        rejetes |= masque
+    return df[~rejetes], rejets
+
+
+def vers_csv(df, buffer):
+    """Écrit le lot au format attendu par COPY ... (FORMAT csv, NULL '\\N')"""
+    df.to_csv(buffer, header=False, index=False, na_rep="\\N", date_format=FORMAT_DATE_AVIS)
+
+
+def vers_tuples(df):
+    """Tuples Python (None pour les valeurs manquantes) pour les reprises ligne à ligne"""
+    objets = df.astype(object)
+    return list(objets.where(df.notna(), None).itertuples(index=False, name=None))
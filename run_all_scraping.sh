@@ -61,36 +61,28 @@ check_internet_connection() {
     fi
 }
 
-# Fonction pour scraper une société
-scraper_societe() {
-    local societe=$1
-    local last_page=$(get_last_page "$societe")
-    local start_page=$((last_page + 1))
-    
+# Fonction pour scraper toutes les sociétés dans un seul processus Python
+# (le débit par hôte est régulé par le scraper, plus de pause entre sociétés)
+scraper_societes() {
     echo "=============================================="
-    echo "Scraping de $societe"
-    echo "Dernière page scrapée: $last_page"
-    echo "Prochaine page à scraper: $start_page"
-    echo "Pages à scraper: $MAX_PAGES"
+    echo "Scraping de: ${SOCIETES[*]}"
+    echo "Pages à scraper par société: $MAX_PAGES"
     echo "Répertoire de données: $DATA_DIR"
     echo "=============================================="
     echo "Début: $(date)"
     
     # Vérification de la connexion Internet avant de scraper
     if ! check_internet_connection; then
-        echo "ERREUR: Problème de connexion détecté, passage à la suivante après pause"
-        sleep 10  # Pause plus longue en cas de problème réseau
+        echo "ERREUR: Problème de connexion détecté, scraping annulé"
         return 1
     fi
     
-    # Lancement du script Python
-    if echo -e "$societe\n$MAX_PAGES" | python3 "$SCRIPT_PYTHON"; then
-        local new_last_page=$(get_last_page "$societe")
-        echo "SUCCÈS: Scraping de $societe terminé avec succès"
-        echo "Nouvelle dernière page: $new_last_page"
+    # Lancement du script Python (non interactif)
+    if python3 "$SCRIPT_PYTHON" "${SOCIETES[@]}" --pages "$MAX_PAGES" $SCRAP_OPTIONS; then
+        echo "SUCCÈS: Scraping terminé avec succès"
         return 0
     else
-        echo "ERREUR: Échec du scraping pour $societe, passage à la suivante"
+        echo "ERREUR: Échec du scraping"
         return 1
     fi
 }
@@ -123,19 +115,8 @@ echo "Résumé initial des dernières pages scrapées:"
 afficher_resume
 echo ""
 
-# Boucle sur toutes les sociétés
-for societe in "${SOCIETES[@]}"; do
-    if scraper_societe "$societe"; then
-        # Attente aléatoire entre 10 et 20 secondes avant le prochain scraping
-        sleep_time=$((10 + RANDOM % 11))
-        echo "Attente de ${sleep_time} secondes avant le prochain scraping..."
-        sleep $sleep_time
-    else
-        echo "Poursuite du script après échec pour $societe"
-        # Attente plus courte en cas d'erreur
-        sleep 5
-    fi
-done
+# Scraping de toutes les sociétés (SCRAP_OPTIONS="--async" pour le moteur asyncio)
+scraper_societes
 
 # Affichage du résumé final
 echo ""
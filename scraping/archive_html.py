@@ -0,0 +1,190 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import argparse
+import threading
+
+from extraction import parse_page, get_parse_pool
+from fingerprint import FingerprintIndex
+
+try:
+    import zstandard as zstd
+except ImportError:
+    zstd = None
+
+# Archive des pages brutes (SCRAP_ARCHIVE_HTML=1 pour l'activer sur tous les runs)
+SCRAP_ARCHIVE_HTML = os.getenv("SCRAP_ARCHIVE_HTML", "0") == "1"
+ARCHIVE_NIVEAU_ZSTD = int(os.getenv("SCRAP_ARCHIVE_NIVEAU_ZSTD", "6"))
+# Captures par tâche envoyée au pool lors d'un reparse
+REPARSE_LOT = int(os.getenv("SCRAP_REPARSE_LOT", "20"))
+
+_archives = {}
+_archives_lock = threading.Lock()
+
+
+class HtmlArchive:
+    """
+    Archive en ajout seul des réponses brutes d'un domaine : une trame zstd indépendante par page
+    (en-tête JSON + corps, à la manière d'un enregistrement WARC) et un index SQLite URL -> offset
+    """
+    def __init__(self, archive_dir, niveau=ARCHIVE_NIVEAU_ZSTD):
+        if zstd is None:
+            raise RuntimeError("zstandard est requis pour l'archive HTML (pip install zstandard)")
+        self.archive_dir = archive_dir
+        os.makedirs(archive_dir, exist_ok=True)
+        self.path = os.path.join(archive_dir, "pages.zst")
+        self._compressor = zstd.ZstdCompressor(level=niveau)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(archive_dir, "index.sqlite"), check_same_thread=False)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS captures (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                url TEXT NOT NULL,
+                page INTEGER,
+                capture_le REAL NOT NULL,
+                offset INTEGER NOT NULL,
+                longueur INTEGER NOT NULL
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_captures_url ON captures (url, capture_le)")
+        self._db.commit()
+
+    def append(self, url, page, content):
+        capture_le = time.time()
+        entete = json.dumps({"url": url, "page": page, "capture_le": capture_le}, ensure_ascii=False)
+        trame = self._compressor.compress(entete.encode("utf-8") + b"\n" + content)
+        with self._lock:
+            with open(self.path, "ab") as f:
+                offset = f.tell()
+                f.write(trame)
+                f.flush()
+                os.fsync(f.fileno())
+            self._db.execute(
+                "INSERT INTO captures (url, page, capture_le, offset, longueur) VALUES (?, ?, ?, ?, ?)",
+                (url, page, capture_le, offset, len(trame))
+            )
+            self._db.commit()
+
+    def captures(self):
+        """
+        Dernière capture de chaque URL, par page croissante : (url, page, offset, longueur)
+        """
+        with self._lock:
+            return self._db.execute("""
+                SELECT c.url, c.page, c.offset, c.longueur FROM captures c
+                JOIN (SELECT url, MAX(capture_le) AS capture_le FROM captures GROUP BY url) d
+                  ON c.url = d.url AND c.capture_le = d.capture_le
+                ORDER BY c.page, c.url
+            """).fetchall()
+
+
+def read_capture(path, offset, longueur):
+    """
+    Relit une trame de l'archive : (en-tête, corps brut)
+    """
+    with open(path, "rb") as f:
+        f.seek(offset)
+        trame = f.read(longueur)
+    brut = zstd.ZstdDecompressor().decompress(trame)
+    entete, _, content = brut.partition(b"\n")
+    return json.loads(entete), content
+
+
+def get_archive(domain_dir):
+    """
+    Archive unique par domaine pour tout le processus
+    """
+    archive_dir = os.path.join(domain_dir, "archive_html")
+    with _archives_lock:
+        if archive_dir not in _archives:
+            _archives[archive_dir] = HtmlArchive(archive_dir)
+        return _archives[archive_dir]
+
+
+def _parse_lot(path, lot, societe, with_info):
+    """
+    Tâche du pool : relit et parse un lot de captures ; renvoie [(page, url, parsed)]
+    """
+    resultats = []
+    for url, page, offset, longueur in lot:
+        _, content = read_capture(path, offset, longueur)
+        resultats.append((page, url, parse_page(content, page, url, societe, with_info)))
+        with_info = False
+    return resultats
+
+
+def reparse(domain, workers=None, writers=None, output_dir=None):
+    """
+    Reconstruit un dossier scrap_<domaine>_<timestamp> complet à partir de l'archive,
+    parsing réparti sur le pool de processus, sans aucune requête réseau
+    """
+    from cde_scrap_new import TrustpilotScraper
+
+    scraper = TrustpilotScraper(domain, writers=writers, output_dir=output_dir)
+    archive = get_archive(scraper.domain_dir)
+    captures = archive.captures()
+    if not captures:
+        logging.warning(f"Archive HTML vide pour {domain}")
+        return None
+
+    # Les avis sont déjà dans l'index d'empreintes du domaine : doublons filtrés en mémoire seulement
+    scraper.fingerprints = FingerprintIndex(None)
+    # Captures anciennes : ni deltas ni mise à jour de l'état des avis
+    scraper.changes = None
+    scraper._open_run(captures[0][1] or 1)
+    # Le reparse ne touche pas au point de reprise du scraping
+    scraper.persist_checkpoint = False
+    lots = [captures[i:i + REPARSE_LOT] for i in range(0, len(captures), REPARSE_LOT)]
+    debut = time.monotonic()
+
+    pool = get_parse_pool(workers)
+    if pool is None:
+        resultats = (_parse_lot(archive.path, lot, scraper.original_domain, i == 0) for i, lot in enumerate(lots))
+    else:
+        resultats = pool.map(_parse_lot, [archive.path] * len(lots), lots,
+                             [scraper.original_domain] * len(lots), [i == 0 for i in range(len(lots))])
+    for lot in resultats:
+        for page, url, parsed in lot:
+            scraper._handle_parsed(page, url, parsed)
+
+    scraper._finalize()
+    logging.info(
+        f"Reparse {domain} : {len(captures)} pages archivées, {scraper.sink.count} avis "
+        f"en {time.monotonic() - debut:.1f}s -> {scraper.scrap_dir}"
+    )
+    return scraper.scrap_dir
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Archive HTML brute des pages Trustpilot")
+    sub = arg_parser.add_subparsers(dest="commande", required=True)
+
+    rep = sub.add_parser("reparse", help="Reconstruit les exports d'un domaine depuis son archive")
+    rep.add_argument("domaines", nargs="+")
+    rep.add_argument("--workers", type=int, help="Processus de parsing (défaut : SCRAP_PARSE_WORKERS)")
+    rep.add_argument("--formats", help="Exports séparés par des virgules : parquet,csv,json,xlsx")
+    rep.add_argument("--output-dir", help="Répertoire de sortie (défaut : DATA_RAW_TRUSTPILOT)")
+
+    info = sub.add_parser("info", help="Résumé de l'archive d'un domaine")
+    info.add_argument("domaines", nargs="+")
+    args = arg_parser.parse_args()
+    from cde_scrap_new import configurer_logs
+    configurer_logs()
+
+    if args.commande == "reparse":
+        for domain in args.domaines:
+            reparse(domain, workers=args.workers, writers=args.formats, output_dir=args.output_dir)
+    else:
+        from cde_scrap_new import TrustpilotScraper
+        for domain in args.domaines:
+            archive = get_archive(TrustpilotScraper(domain).domain_dir)
+            captures = archive.captures()
+            taille = os.path.getsize(archive.path) if os.path.exists(archive.path) else 0
+            pages = [c[1] for c in captures]
+            print(f"{domain} : {len(captures)} URL archivées, pages {min(pages, default=0)}-{max(pages, default=0)}, "
+                  f"{taille / 1024 / 1024:.1f} Mo")
+
+if __name__ == "__main__":
+    main()
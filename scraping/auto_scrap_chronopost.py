@@ -1,5 +1,4 @@
-import subprocess
-import time
+from cde_scrap_new import scrape_batches, configurer_logs
 
 # 🔧 Paramètres à ajuster
 total_pages = 1000
@@ -7,29 +6,17 @@ pages_par_lancement = 30
 delai_minutes = 3
 nom_domaine = "chronopost.fr"
 
-page_courante = 1
-
-while page_courante <= total_pages:
-    print(f"=== Lancement du scraping : pages {page_courante} à {min(page_courante + pages_par_lancement - 1, total_pages)} ===")
-
-    # Simuler les inputs du script interactif
-    inputs = f"{nom_domaine}\n{pages_par_lancement}\n"
-
-    try:
-        subprocess.run(
-            ["python3", "cde_scrap_new.py"], 
-            input=inputs.encode(),
-            check=True
-        )
-    except subprocess.CalledProcessError as e:
-        print(f"❌ Erreur lors du scraping : {e}")
-        break
-
-    page_courante += pages_par_lancement
-
-    if page_courante <= total_pages:
-        print(f"⏳ Attente de {delai_minutes} minutes avant prochain run...")
-        time.sleep(delai_minutes * 60)
-
-print("✅ Scraping terminé sur 1000 pages.")
-
+# Garde obligatoire : les processus de parsing (spawn) réimportent ce script
+if __name__ == "__main__":
+    configurer_logs()
+    # Tous les lots tournent dans ce processus (imports, UserAgent et session HTTP partagés) ;
+    # chaque lot reprend après derniere_page.txt comme auparavant
+    print(f"=== Lancement du scraping de {nom_domaine} : {total_pages} pages par lots de {pages_par_lancement} ===")
+    scrapers = scrape_batches(
+        nom_domaine,
+        total_pages,
+        pages_par_lot=pages_par_lancement,
+        pause_entre_lots=delai_minutes * 60,
+    )
+
+    print(f"✅ Scraping terminé : {len(scrapers)} lot(s), {sum(s.sink.count for s in scrapers)} avis.")
@@ -0,0 +1,284 @@
+import os
+import sys
+import json
+import time
+import glob
+import random
+import socket
+import logging
+import argparse
+import resource
+import tempfile
+import subprocess
+from datetime import datetime
+from urllib.parse import urlsplit, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Pages Trustpilot enregistrées : <fixtures>/<domaine>/page_<n>.html
+FIXTURES_DIR = os.getenv(
+    "BENCH_FIXTURES_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "fixtures", "trustpilot")
+)
+LIVE_BASE_URL = "https://fr.trustpilot.com"
+ERREURS_5XX = (500, 502, 504)
+
+
+def enregistrer(domaine, pages, fixtures_dir=FIXTURES_DIR):
+    """
+    Enregistre les pages réelles d'une société comme fixtures (arrêt à la première page sans avis)
+    """
+    import requests
+    from extraction import extract_next_data
+    from throttle import get_controller
+
+    dossier = os.path.join(fixtures_dir, domaine)
+    os.makedirs(dossier, exist_ok=True)
+    controller = get_controller(urlsplit(LIVE_BASE_URL).netloc)
+    headers = {
+        "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36",
+        "Accept-Language": "fr-FR,fr;q=0.9,en-US;q=0.8,en;q=0.7",
+    }
+    for page in range(1, pages + 1):
+        controller.wait()
+        resp = requests.get(f"{LIVE_BASE_URL}/review/{domaine}?page={page}", headers=headers, timeout=30)
+        resp.raise_for_status()
+        controller.on_success()
+        data = extract_next_data(resp.content)
+        if not data or not data["props"]["pageProps"].get("reviews"):
+            logging.info(f"Aucun avis page {page}, fin de l'enregistrement")
+            break
+        with open(os.path.join(dossier, f"page_{page}.html"), "wb") as f:
+            f.write(resp.content)
+        logging.info(f"Fixture {domaine} page {page} enregistrée")
+
+
+def charger_fixtures(fixtures_dir=FIXTURES_DIR):
+    fixtures = {}
+    for dossier in sorted(glob.glob(os.path.join(fixtures_dir, "*"))):
+        fichiers = glob.glob(os.path.join(dossier, "page_*.html"))
+        fichiers.sort(key=lambda f: int(os.path.basename(f)[5:-5]))
+        if fichiers:
+            fixtures[os.path.basename(dossier)] = [open(f, "rb").read() for f in fichiers]
+    return fixtures
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    """
+    Remplaçant local de fr.trustpilot.com : /review/<domaine>?page=N servi depuis les fixtures
+    (en boucle au-delà de la dernière page enregistrée), avec latence, 429 et 5xx simulés
+    """
+    fixtures = {}
+    latence = 0.0
+    gigue = 0.0
+    taux_429 = 0.0
+    taux_5xx = 0.0
+    retry_after = 1
+
+    def do_GET(self):
+        time.sleep(max(0.0, self.latence + random.uniform(-self.gigue, self.gigue)))
+        url = urlsplit(self.path)
+        domaine = url.path.rstrip("/").rsplit("/", 1)[-1]
+        pages = self.fixtures.get(domaine)
+        if not url.path.startswith("/review/") or not pages:
+            self.send_error(404)
+            return
+
+        tirage = random.random()
+        if tirage < self.taux_429:
+            self.send_response(429)
+            self.send_header("Retry-After", str(self.retry_after))
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if tirage < self.taux_429 + self.taux_5xx:
+            self.send_error(random.choice(ERREURS_5XX))
+            return
+
+        page = int(parse_qs(url.query).get("page", ["1"])[0])
+        body = pages[(page - 1) % len(pages)]
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def servir(port, latence=0.0, gigue=0.0, taux_429=0.0, taux_5xx=0.0, retry_after=1, graine=None,
+           fixtures_dir=FIXTURES_DIR):
+    fixtures = charger_fixtures(fixtures_dir)
+    if not fixtures:
+        raise SystemExit(f"Aucune fixture dans {fixtures_dir} (commande 'enregistrer')")
+    random.seed(graine)
+    ReplayHandler.fixtures = fixtures
+    ReplayHandler.latence = latence
+    ReplayHandler.gigue = gigue
+    ReplayHandler.taux_429 = taux_429
+    ReplayHandler.taux_5xx = taux_5xx
+    ReplayHandler.retry_after = retry_after
+    serveur = ThreadingHTTPServer(("127.0.0.1", port), ReplayHandler)
+    serveur.daemon_threads = True
+    logging.info(f"Serveur de rejeu sur http://127.0.0.1:{port} : {', '.join(fixtures)}")
+    serveur.serve_forever()
+
+
+def _port_libre():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _lancer_serveur(args):
+    port = args.port or _port_libre()
+    commande = [
+        sys.executable, os.path.abspath(__file__), "--fixtures", args.fixtures, "serveur", "--port", str(port),
+        "--latence", str(args.latence), "--gigue", str(args.gigue),
+        "--taux-429", str(args.taux_429), "--taux-5xx", str(args.taux_5xx),
+        "--retry-after", str(args.retry_after),
+    ]
+    if args.graine is not None:
+        commande += ["--graine", str(args.graine)]
+    proc = subprocess.Popen(commande)
+    limite = time.monotonic() + 10
+    while time.monotonic() < limite:
+        if proc.poll() is not None:
+            raise SystemExit("Le serveur de rejeu s'est arrêté au démarrage")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return proc, f"http://127.0.0.1:{port}"
+        except OSError:
+            time.sleep(0.05)
+    proc.terminate()
+    raise SystemExit("Le serveur de rejeu ne répond pas")
+
+
+def bench(args):
+    """
+    Fait tourner TrustpilotScraper contre le serveur local et mesure débit, CPU et mémoire
+    """
+    proc, base_url = _lancer_serveur(args)
+    try:
+        with tempfile.TemporaryDirectory(prefix="bench_scrap_") as tmp:
+            # La configuration des modules de scraping est lue à l'import
+            os.environ.update({
+                "TRUSTPILOT_BASE_URL": base_url,
+                "DATA_RAW_TRUSTPILOT": tmp,
+                "LOG_DIR": os.path.join(tmp, "log"),
+                "HTTP_CACHE_DIR": "",
+                "SCRAP_RATE_INITIALE": str(args.rate),
+                "SCRAP_RATE_MAX": str(args.rate),
+                # Les fixtures sont rejouées en boucle : sans cela tout serait doublon après un tour
+                "SCRAP_DEDUP": "1" if args.dedup else "0",
+            })
+            if args.parse_workers is not None:
+                os.environ["SCRAP_PARSE_WORKERS"] = str(args.parse_workers)
+            from cde_scrap_new import TrustpilotScraper
+            from extraction import shutdown_parse_pool, PARSE_WORKERS
+            logging.getLogger().setLevel(args.log_level)
+
+            debut = time.perf_counter()
+            self_avant = resource.getrusage(resource.RUSAGE_SELF)
+            enfants_avant = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+            if args.mode_async:
+                from cde_scrap_async import AsyncScrapingEngine
+                engine = AsyncScrapingEngine(rate_global=args.rate, rate_hote=args.rate, writers=args.formats,
+                                             parse_workers=PARSE_WORKERS)
+                scrapers = engine.run([(domaine, args.pages, 1) for domaine in args.domaines])
+            else:
+                scrapers = []
+                for domaine in args.domaines:
+                    scraper = TrustpilotScraper(domaine, args.pages, writers=args.formats, start_page=1)
+                    scraper.scrape()
+                    scrapers.append(scraper)
+            # Les processus de parsing doivent être terminés pour compter dans RUSAGE_CHILDREN
+            shutdown_parse_pool()
+
+            duree = time.perf_counter() - debut
+            self_apres = resource.getrusage(resource.RUSAGE_SELF)
+            enfants_apres = resource.getrusage(resource.RUSAGE_CHILDREN)
+    finally:
+        proc.terminate()
+        proc.wait()
+
+    cpu = (self_apres.ru_utime - self_avant.ru_utime + self_apres.ru_stime - self_avant.ru_stime
+           + enfants_apres.ru_utime - enfants_avant.ru_utime + enfants_apres.ru_stime - enfants_avant.ru_stime)
+    pages = sum(len(s.pages_done) for s in scrapers)
+    avis = sum(s.sink.count for s in scrapers)
+    resultat = {
+        "date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "mode": "async" if args.mode_async else "sync",
+        "domaines": args.domaines,
+        "pages_demandees": args.pages,
+        "parse_workers": PARSE_WORKERS,
+        "latence": args.latence,
+        "taux_429": args.taux_429,
+        "taux_5xx": args.taux_5xx,
+        "rate": args.rate,
+        "pages": pages,
+        "avis": avis,
+        "duree_s": round(duree, 3),
+        "pages_par_s": round(pages / duree, 2) if duree else 0,
+        "avis_par_s": round(avis / duree, 2) if duree else 0,
+        "cpu_s": round(cpu, 3),
+        # ru_maxrss en Ko sous Linux
+        "rss_max_mo": round(max(self_apres.ru_maxrss, enfants_apres.ru_maxrss) / 1024, 1),
+        "rss_max_parseur_mo": round(enfants_apres.ru_maxrss / 1024, 1),
+    }
+    print(
+        f"{resultat['mode']} : {pages} pages, {avis} avis en {resultat['duree_s']}s -> "
+        f"{resultat['pages_par_s']} pages/s, {resultat['avis_par_s']} avis/s, "
+        f"CPU {resultat['cpu_s']}s, RSS max {resultat['rss_max_mo']} Mo"
+    )
+    if args.sortie:
+        with open(args.sortie, "a", encoding="utf-8") as f:
+            f.write(json.dumps(resultat, ensure_ascii=False) + "\n")
+    return resultat
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    arg_parser = argparse.ArgumentParser(description="Benchmark hors ligne du scraper Trustpilot (pages rejouées)")
+    arg_parser.add_argument("--fixtures", default=FIXTURES_DIR, help="Répertoire des pages enregistrées")
+    sub = arg_parser.add_subparsers(dest="commande", required=True)
+
+    enreg = sub.add_parser("enregistrer", help="Enregistre des pages réelles comme fixtures")
+    enreg.add_argument("domaine")
+    enreg.add_argument("--pages", type=int, default=5)
+
+    simulation = argparse.ArgumentParser(add_help=False)
+    simulation.add_argument("--port", type=int, default=0, help="Port du serveur local (défaut : port libre)")
+    simulation.add_argument("--latence", type=float, default=0.05, help="Latence simulée par requête (s)")
+    simulation.add_argument("--gigue", type=float, default=0.0, help="Variation aléatoire de la latence (s)")
+    simulation.add_argument("--taux-429", type=float, default=0.0, help="Proportion de réponses 429")
+    simulation.add_argument("--taux-5xx", type=float, default=0.0, help="Proportion de réponses 500/502/504")
+    simulation.add_argument("--retry-after", type=int, default=1, help="Retry-After des 429 (s)")
+    simulation.add_argument("--graine", type=int, help="Graine aléatoire (tirages reproductibles)")
+
+    sub.add_parser("serveur", parents=[simulation], help="Lance uniquement le serveur de rejeu")
+
+    bench_parser = sub.add_parser("bench", parents=[simulation], help="Mesure le scraper contre le serveur de rejeu")
+    bench_parser.add_argument("domaines", nargs="+", help="Domaines présents dans les fixtures")
+    bench_parser.add_argument("--pages", type=int, default=50, help="Pages par domaine (fixtures rejouées en boucle)")
+    bench_parser.add_argument("--async", dest="mode_async", action="store_true", help="Moteur asyncio")
+    bench_parser.add_argument("--parse-workers", type=int, help="Processus de parsing (0 : en ligne)")
+    bench_parser.add_argument("--rate", type=float, default=1000, help="Débit max par hôte et global (requêtes/s)")
+    bench_parser.add_argument("--formats", help="Exports mesurés : parquet,csv,json,xlsx")
+    bench_parser.add_argument("--dedup", action="store_true", help="Mesure avec l'index d'empreintes actif")
+    bench_parser.add_argument("--sortie", help="Fichier JSONL où ajouter le résultat")
+    bench_parser.add_argument("--log-level", default="WARNING")
+
+    args = arg_parser.parse_args()
+    if args.commande == "enregistrer":
+        enregistrer(args.domaine, args.pages, args.fixtures)
+    elif args.commande == "serveur":
+        port = args.port or 8765
+        servir(port, args.latence, args.gigue, args.taux_429, args.taux_5xx, args.retry_after, args.graine,
+               args.fixtures)
+    else:
+        bench(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,306 @@
+import os
+import time
+import asyncio
+import logging
+import argparse
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from cde_scrap_new import TrustpilotScraper, PAGE_FIN, RETRY_ROUNDS, log_dir, configurer_logs
+from extraction import parse_page, get_parse_pool, PARSE_WORKERS, PARSE_QUEUE
+from http_cache import get_cache
+from throttle import get_controller, parse_retry_after, THROTTLE_STATUSES
+from telemetry import get_telemetrie, aiohttp_trace_config
+
+# Limites de débit (requêtes / seconde) : globale pour tout le moteur, et plafond par hôte
+RATE_GLOBAL = float(os.getenv("SCRAP_RATE_GLOBAL", "4"))
+RATE_HOTE = float(os.getenv("SCRAP_RATE_HOTE", "2"))
+CONCURRENCE = int(os.getenv("SCRAP_CONCURRENCE", "8"))
+PAGES_PAR_PLAGE = int(os.getenv("SCRAP_PAGES_PAR_PLAGE", "10"))
+
+RETRY_STATUSES = {500, 502, 504}
+
+
+class RateLimiter:
+    """
+    Seau de jetons partagé entre coroutines : au plus `rate` requêtes par seconde,
+    avec une rafale maximale de `burst` requêtes
+    """
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class DomainRun:
+    """
+    Découpage d'un domaine en plages de pages pendant un run asynchrone
+    et fin détectée (plus d'avis ou watermark atteint)
+    """
+    def __init__(self, scraper, max_pages):
+        self.scraper = scraper
+        self.start_page = scraper._first_page()
+        self.end_page = self.start_page + max_pages
+        self.fin = self.end_page
+        scraper._open_run(self.start_page)
+
+    def plages(self, taille):
+        if self.scraper.incremental:
+            # Le watermark impose un parcours séquentiel depuis la page 1
+            yield range(self.start_page, self.end_page)
+            return
+        for debut in range(self.start_page, self.end_page, taille):
+            yield range(debut, min(debut + taille, self.end_page))
+
+    def fin_atteinte(self, page):
+        return page >= self.fin
+
+    def marquer_fin(self, page):
+        self.fin = min(self.fin, page)
+
+    def finalize(self):
+        if self.scraper.retry_queue:
+            logging.warning(
+                f"[{self.scraper.original_domain}] Pages abandonnées après {RETRY_ROUNDS} tours de reprise : "
+                f"{sorted(self.scraper.retry_queue)}"
+            )
+        self.scraper._finalize()
+        self.scraper._update_watermark()
+
+
+class AsyncScrapingEngine:
+    """
+    Moteur asyncio : plusieurs domaines et plusieurs plages de pages d'un même domaine
+    en parallèle, sous une limite de débit globale et un contrôleur AIMD par hôte.
+    Les pages téléchargées passent par une file bornée vers un pool de processus de parsing
+    """
+    def __init__(self, rate_global=RATE_GLOBAL, rate_hote=RATE_HOTE,
+                 concurrence=CONCURRENCE, pages_par_plage=PAGES_PAR_PLAGE, max_retries=3, incremental=False,
+                 writers=None, output_dir=None, parse_workers=PARSE_WORKERS, parse_queue=PARSE_QUEUE):
+        self.rate_global = rate_global
+        self.rate_hote = rate_hote
+        self.concurrence = concurrence
+        self.pages_par_plage = pages_par_plage
+        self.max_retries = max_retries
+        self.incremental = incremental
+        self.writers = writers
+        self.output_dir = output_dir
+        self.parse_workers = parse_workers
+        self.parse_queue = parse_queue
+        self._global_limiter = None
+        self._semaphore = None
+        self._queue = None
+        self.cache = get_cache()
+        self.telemetrie = get_telemetrie(log_dir)
+
+    def _mesurer(self, domaine, url, page, mesure, statut, tentative, octets=0, cache=False, erreur=None):
+        if self.telemetrie is None:
+            return
+        self.telemetrie.requete(
+            domaine, url, statut, page=page,
+            total=time.perf_counter() - mesure["debut"] if "debut" in mesure else None,
+            ttfb=mesure.get("ttfb"), dns=mesure.get("dns"), connect=mesure.get("connect"),
+            attente=mesure.get("attente", 0.0), octets=octets, tentatives=tentative, cache=cache, erreur=erreur,
+        )
+
+    async def _fetch(self, session, url, headers, domaine, page=None):
+        controller = get_controller(urlsplit(url).netloc, rate_max=self.rate_hote)
+        headers_base = headers
+        if self.cache is not None:
+            cached = self.cache.lookup(url, ttl=0 if self.incremental else None)
+            if cached is not None:
+                self._mesurer(domaine, url, page, {}, cached.status_code, 1, len(cached.content), cache=True)
+                return cached.content
+            headers = {**headers, **self.cache.conditional_headers(url)}
+        for tentative in range(1, self.max_retries + 1):
+            # Rempli par la TraceConfig : debut, dns, connect, ttfb
+            mesure = {}
+            debut_attente = time.perf_counter()
+            # Créneau de l'hôte d'abord : un hôte ralenti (AIMD, Retry-After) attend sans
+            # occuper de slot de concurrence ni consommer de jeton global
+            await controller.async_wait()
+            async with self._semaphore:
+                await self._global_limiter.acquire()
+                mesure["attente"] = time.perf_counter() - debut_attente
+                try:
+                    async with session.get(url, headers=headers, trace_request_ctx=mesure) as resp:
+                        if resp.status == 304 and self.cache is not None:
+                            revalidated = self.cache.revalidate(url)
+                            if revalidated is not None:
+                                self._mesurer(domaine, url, page, mesure, resp.status, tentative,
+                                              len(revalidated.content), cache=True)
+                                return revalidated.content
+                            # Entrée évincée depuis la requête conditionnelle : un 304 n'a pas de corps,
+                            # on redemande la page sans condition plutôt que de parser une réponse vide
+                            self._mesurer(domaine, url, page, mesure, resp.status, tentative)
+                            logging.info(f"Cache HTTP : entrée évincée avant le 304, nouvelle requête pour {url}")
+                            headers = headers_base
+                            continue
+                        if resp.status >= 400:
+                            self._mesurer(domaine, url, page, mesure, resp.status, tentative)
+                        if resp.status in THROTTLE_STATUSES:
+                            # Le contrôleur décale les prochains créneaux de l'hôte (Retry-After)
+                            controller.on_throttle(parse_retry_after(resp.headers.get("Retry-After")))
+                            logging.warning(f"{resp.status} sur {url} (tentative {tentative}/{self.max_retries})")
+                            continue
+                        if resp.status in RETRY_STATUSES:
+                            raise aiohttp.ClientResponseError(
+                                resp.request_info, resp.history, status=resp.status, message=resp.reason
+                            )
+                        resp.raise_for_status()
+                        content = await resp.read()
+                        self._mesurer(domaine, url, page, mesure, resp.status, tentative, len(content))
+                        controller.on_success()
+                        if self.cache is not None and resp.status == 200:
+                            self.cache.store(url, resp.status, dict(resp.headers), content)
+                        return content
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    if not isinstance(e, aiohttp.ClientResponseError):
+                        self._mesurer(domaine, url, page, mesure, None, tentative, erreur=type(e).__name__)
+                    logging.warning(f"Erreur requête {url} (tentative {tentative}/{self.max_retries}) : {e}")
+            await asyncio.sleep(2 ** (tentative - 1))
+        return None
+
+    async def _scrape_pages(self, session, run, pages):
+        scraper = run.scraper
+        consecutive_errors = 0
+        for page in pages:
+            if run.fin_atteinte(page):
+                return
+            url = scraper._page_url(page)
+            logging.info(f"Scraping page {page}: {url}")
+
+            content = await self._fetch(session, url, scraper._headers(), scraper.original_domain, page)
+            if content is None:
+                logging.error(f"Erreur requête page {page}, mise en file de reprise")
+                scraper.retry_queue.append(page)
+                consecutive_errors += 1
+                if consecutive_errors > 3:
+                    logging.error(f"[{scraper.original_domain}] Trop d'erreurs consécutives, arrêt de la plage {pages[0]}-{pages[-1]}")
+                    return
+                continue
+            consecutive_errors = 0
+            scraper._archive_page(page, url, content)
+            # Bloque le téléchargement quand les parseurs ont trop de retard
+            await self._queue.put((run, page, url, content))
+
+    async def _parse_worker(self, pool):
+        """
+        Consommateur de la file : parsing dans le pool de processus, puis écriture
+        et point de reprise dans la boucle asyncio (état du scraper non partagé)
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            run, page, url, content = await self._queue.get()
+            try:
+                if run.fin_atteinte(page):
+                    continue
+                scraper = run.scraper
+                args = (content, page, url, scraper.original_domain, scraper.info_data is None)
+                if pool is None:
+                    parsed = parse_page(*args)
+                else:
+                    parsed = await loop.run_in_executor(pool, parse_page, *args)
+                if run.fin_atteinte(page):
+                    continue
+                if scraper._handle_parsed(page, url, parsed) == PAGE_FIN:
+                    scraper.end_reached = True
+                    run.marquer_fin(page + 1 if scraper.watermark_reached else page)
+            except Exception as e:
+                logging.error(f"Erreur parsing page {page} : {e}")
+                run.scraper.retry_queue.append(page)
+            finally:
+                self._queue.task_done()
+
+    async def _retry_failed(self, session, runs):
+        """
+        Les pages en échec sont retentées après le premier passage plutôt qu'abandonnées
+        """
+        for tour in range(1, RETRY_ROUNDS + 1):
+            pending = [(run, sorted(set(run.scraper.retry_queue))) for run in runs if run.scraper.retry_queue]
+            if not pending:
+                return
+            for run, pages in pending:
+                run.scraper.retry_queue = []
+                logging.info(f"File de reprise {run.scraper.original_domain} (tour {tour}/{RETRY_ROUNDS}) : pages {pages}")
+            await asyncio.gather(*(self._scrape_pages(session, run, pages) for run, pages in pending))
+            await self._queue.join()
+
+    async def _run(self, jobs):
+        self._global_limiter = RateLimiter(self.rate_global, burst=self.concurrence)
+        self._semaphore = asyncio.Semaphore(self.concurrence)
+        self._queue = asyncio.Queue(maxsize=max(1, self.parse_queue))
+        pool = get_parse_pool(self.parse_workers)
+        parseurs = [asyncio.create_task(self._parse_worker(pool)) for _ in range(max(1, self.parse_workers))]
+
+        runs = []
+        for domain, max_pages, *start_page in jobs:
+            scraper = TrustpilotScraper(domain, max_pages, incremental=self.incremental, writers=self.writers,
+                                        output_dir=self.output_dir, start_page=start_page[0] if start_page else None)
+            runs.append(DomainRun(scraper, max_pages))
+        timeout = aiohttp.ClientTimeout(total=30)
+        connector = aiohttp.TCPConnector(limit=self.concurrence)
+        trace_configs = [aiohttp_trace_config()] if self.telemetrie is not None else []
+        async with aiohttp.ClientSession(timeout=timeout, connector=connector, trace_configs=trace_configs) as session:
+            await asyncio.gather(*(
+                self._scrape_pages(session, run, plage)
+                for run in runs
+                for plage in run.plages(self.pages_par_plage)
+            ))
+            await self._queue.join()
+            await self._retry_failed(session, runs)
+        for parseur in parseurs:
+            parseur.cancel()
+
+        for run in runs:
+            run.finalize()
+        return [run.scraper for run in runs]
+
+    def run(self, jobs):
+        """
+        jobs : liste de (domaine, nombre max de pages[, page de départ])
+        """
+        return asyncio.run(self._run(jobs))
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Scraping Trustpilot asynchrone multi-domaines")
+    arg_parser.add_argument("domaines", nargs="+", help="Noms de domaine (ex: chronopost.fr)")
+    arg_parser.add_argument("--pages", type=int, default=30, help="Nombre max de pages par domaine")
+    arg_parser.add_argument("--pages-par-plage", type=int, default=PAGES_PAR_PLAGE)
+    arg_parser.add_argument("--rate-global", type=float, default=RATE_GLOBAL, help="Requêtes/s tous hôtes confondus")
+    arg_parser.add_argument("--rate-hote", type=float, default=RATE_HOTE, help="Plafond du débit adaptatif par hôte (requêtes/s)")
+    arg_parser.add_argument("--concurrence", type=int, default=CONCURRENCE, help="Requêtes simultanées max")
+    arg_parser.add_argument("--incremental", action="store_true", help="Nouveaux avis uniquement (watermark par domaine)")
+    arg_parser.add_argument("--formats", default=None, help="Exports séparés par des virgules : parquet,csv,json,xlsx")
+    arg_parser.add_argument("--parse-workers", type=int, default=PARSE_WORKERS, help="Processus de parsing (0 : dans la boucle)")
+    args = arg_parser.parse_args()
+    configurer_logs()
+
+    engine = AsyncScrapingEngine(
+        rate_global=args.rate_global,
+        rate_hote=args.rate_hote,
+        concurrence=args.concurrence,
+        pages_par_plage=args.pages_par_plage,
+        incremental=args.incremental,
+        writers=args.formats,
+        parse_workers=args.parse_workers,
+    )
+    engine.run([(domain, args.pages) for domain in args.domaines])
+
+if __name__ == "__main__":
+    main()
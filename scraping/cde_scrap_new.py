@@ -2,11 +2,22 @@ import os
 import re
 import time
 import json
+import argparse
 import logging
 import requests
-import pandas as pd
 from datetime import datetime
-from bs4 import BeautifulSoup
+from collections import deque
+from urllib.parse import urlsplit
+from concurrent.futures import Future
+from extraction import parse_page, get_parse_pool, PARSE_WORKERS, PARSE_QUEUE
+from http_cache import get_cache
+from jsonl_sink import JsonlSink, atomic_write
+from fingerprint import get_fingerprint_index, SCRAP_DEDUP
+from archive_html import get_archive, SCRAP_ARCHIVE_HTML
+from deltas import get_change_tracker, delta, NOUVEAU, MODIFIE, SCRAP_DELTAS
+from telemetry import get_telemetrie
+from writers import get_writers, write_results
+from throttle import get_controller, parse_retry_after, THROTTLE_STATUSES
 from fake_useragent import UserAgent
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
@@ -37,242 +48,499 @@ log_dir = resolve_env_vars(env_vars.get("LOG_DIR"), env_vars)
 if not log_dir:
     log_dir = os.path.join(base_dir, "log")
 
-os.makedirs(data_raw_trustpilot, exist_ok=True)
-os.makedirs(log_dir, exist_ok=True)
-
-log_file = os.path.join(log_dir, f"scraping_trustpilot_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log")
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    handlers=[logging.FileHandler(log_file, encoding="utf-8"), logging.StreamHandler()]
-)
+def configurer_logs():
+    """
+    Répertoires de sortie et journal fichier + console, à appeler depuis les points d'entrée :
+    les processus de parsing (spawn) réimportent le module principal et ne doivent pas ouvrir de journal
+    """
+    os.makedirs(data_raw_trustpilot, exist_ok=True)
+    os.makedirs(log_dir, exist_ok=True)
+    log_file = os.path.join(log_dir, f"scraping_trustpilot_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log")
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+        handlers=[logging.FileHandler(log_file, encoding="utf-8"), logging.StreamHandler()]
+    )
+    return log_file
+
+# Surchargeable pour rejouer des pages enregistrées sur un serveur local (bench_replay.py)
+TRUSTPILOT_BASE_URL = env_vars.get("TRUSTPILOT_BASE_URL", "https://fr.trustpilot.com").rstrip("/")
+TRUSTPILOT_HOST = urlsplit(TRUSTPILOT_BASE_URL).netloc
+
+_user_agent = None
+_session = None
+
+def get_user_agent():
+    """UserAgent partagé : construit une seule fois par processus"""
+    global _user_agent
+    if _user_agent is None:
+        _user_agent = UserAgent()
+    return _user_agent
+
+def get_session():
+    """Session HTTP partagée (pool de connexions réutilisé d'un lot à l'autre)"""
+    global _session
+    if _session is None:
+        _session = requests.Session()
+        # 429 / 503 sont laissés au contrôleur AIMD (Retry-After, baisse du débit) : sans
+        # respect_retry_after_header=False, urllib3 les rejouerait lui-même dès qu'un Retry-After est présent
+        retry = Retry(total=5, backoff_factor=1, status_forcelist=[500,502,504], respect_retry_after_header=False)
+        adapter = HTTPAdapter(max_retries=retry)
+        _session.mount('https://', adapter)
+        _session.mount('http://', adapter)
+    return _session
+
+def trustpilot_headers(ua=None):
+    return {
+        "User-Agent": (ua or get_user_agent()).random,
+        "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
+        "Accept-Language": "fr-FR,fr;q=0.9,en-US;q=0.8,en;q=0.7",
+        "Referer": "https://www.google.com/"
+    }
+
+# Issue du traitement d'une page
+PAGE_OK, PAGE_FIN, PAGE_ECHEC = "ok", "fin", "echec"
+# Nombre de passes sur la file des pages en échec en fin de run
+RETRY_ROUNDS = int(env_vars.get("SCRAP_RETRY_ROUNDS", "3"))
+
+def domain_dir(domain, output_dir=None):
+    """Répertoire des scraps d'un domaine (extension retirée : chronopost.fr -> chronopost)"""
+    return os.path.join(output_dir or data_raw_trustpilot, re.sub(r"\.[a-z]{2,}$", "", domain.lower().strip()))
+
+def read_last_page(path):
+    """Dernière page sauvegardée dans derniere_page.txt, 0 si aucune"""
+    if os.path.exists(path):
+        try:
+            return int(open(path, "r", encoding="utf-8").read().strip())
+        except Exception as e:
+            logging.warning(f"Erreur lecture {path} : {e}")
+    return 0
 
 class TrustpilotScraper:
-    def __init__(self, domain, max_pages=30):
+    def __init__(self, domain, max_pages=30, incremental=False, writers=None, output_dir=None, start_page=None,
+                 archive_html=None):
         self.original_domain = domain.lower().strip()
         self.domain = re.sub(r"\.[a-z]{2,}$", "", self.original_domain)
-        self.domain_dir = os.path.join(data_raw_trustpilot, self.domain)
+        self.domain_dir = domain_dir(self.original_domain, output_dir)
         os.makedirs(self.domain_dir, exist_ok=True)
         self.max_pages = max_pages
-        self.ua = UserAgent()
-        self.session = self._init_session()
+        # Plage explicite : sinon reprise après derniere_page.txt
+        self.start_page = start_page
+        self.ua = get_user_agent()
+        self.session = get_session()
+        self.throttle = get_controller(TRUSTPILOT_HOST)
+        self.cache = get_cache()
         self.last_page_path = os.path.join(self.domain_dir, "derniere_page.txt")
         self.info_data = None
-        self.last_successful_page = 0
-
-    def _init_session(self):
-        session = requests.Session()
-        retry = Retry(total=5, backoff_factor=1, status_forcelist=[500,502,503,504])
-        adapter = HTTPAdapter(max_retries=retry)
-        session.mount('https://', adapter)
-        return session
+        self.writers = get_writers(writers)
+        self.scrap_dir = None
+        self.timestamp = None
+        self.sink = None
+        self.pages_done = set()
+        self.checkpoint = 0
+        self.retry_queue = []
+        self.end_reached = False
+        # Mode incrémental : on repart de la page 1 (tri par date) jusqu'aux avis déjà connus
+        self.incremental = incremental
+        self.watermark_path = os.path.join(self.domain_dir, "watermark.json")
+        self.watermark = self._load_watermark() if incremental else None
+        self.watermark_reached = False
+        self.newest_review = None
+        # Empreintes des avis déjà écrits (tous runs confondus) pour ne pas les réécrire
+        self.fingerprints = get_fingerprint_index(os.path.join(self.domain_dir, "empreintes.bin")) if SCRAP_DEDUP else None
+        # Archive des réponses brutes pour pouvoir reparser sans rescraper (archive_html.py reparse)
+        archiver = SCRAP_ARCHIVE_HTML if archive_html is None else archive_html
+        self.archive = get_archive(self.domain_dir) if archiver else None
+        # Flux de deltas (nouveau / modifie / supprime) d'après l'état des avis déjà vus
+        self.changes = get_change_tracker(os.path.join(self.domain_dir, "etat_avis.sqlite")) if SCRAP_DELTAS else None
+        self.deltas = None
+        self.debut_run = None
+        self.telemetrie = get_telemetrie(log_dir)
+        self.erreur_parsing = False
 
     def _headers(self):
-        return {
-            "User-Agent": self.ua.random,
-            "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
-            "Accept-Language": "fr-FR,fr;q=0.9,en-US;q=0.8,en;q=0.7",
-            "Referer": "https://www.google.com/"
-        }
+        return trustpilot_headers(self.ua)
+
+    def _get(self, url):
+        if self.cache is not None:
+            # Entrée fraîche déjà cherchée par _fetch : requête conditionnelle directe
+            return self.cache.fetch(self.session, url, headers=self._headers(), timeout=30)
+        return self.session.get(url, headers=self._headers(), timeout=30)
+
+    def _read_last_page(self):
+        return read_last_page(self.last_page_path)
 
     def _load_last_page(self):
-        if os.path.exists(self.last_page_path):
-            try:
-                page = int(open(self.last_page_path, "r", encoding="utf-8").read().strip())
-                logging.info(f"Reprise à partir de la page {page + 1}")
-                return page + 1
-            except Exception as e:
-                logging.warning(f"Erreur lecture {self.last_page_path} : {e}")
-        return 1
+        page = self._read_last_page()
+        if page:
+            logging.info(f"Reprise à partir de la page {page + 1}")
+        return page + 1
 
     def _save_last_page(self, page):
         try:
-            with open(self.last_page_path, "w", encoding="utf-8") as f:
-                f.write(str(page))
-            self.last_successful_page = page
+            atomic_write(self.last_page_path, str(page))
         except Exception as e:
             logging.error(f"Erreur sauvegarde {self.last_page_path} : {e}")
 
-    def _extract_json_ld(self, soup):
-        """
-        Extraction robuste des informations générales :
-        - secteur (name)
-        - repartition des avis (csvw:columns)
-        - nombre total d'avis (total dans la répartition ou somme)
-        """
+    def _load_watermark(self):
+        if os.path.exists(self.watermark_path):
+            try:
+                with open(self.watermark_path, "r", encoding="utf-8") as f:
+                    watermark = json.load(f)
+                logging.info(f"Watermark {self.domain} : avis {watermark.get('id')} du {watermark.get('published_date')}")
+                return watermark
+            except Exception as e:
+                logging.warning(f"Erreur lecture {self.watermark_path} : {e}")
+        return None
+
+    def _save_watermark(self, watermark):
         try:
-            script_ld = soup.find("script", type="application/ld+json", attrs={"data-business-unit-json-ld-dataset": "true"})
-            if not script_ld:
-                logging.warning("Aucun script ld+json trouvé.")
-                return None
-            data_ld = json.loads(script_ld.string)
-
-            secteur = data_ld.get("@graph", {}).get("name", "Non renseigné")
-            repartition = {}
-            nombre_avis = "N/A"
-
-            graph = data_ld.get("@graph")
-            if graph:
-                # Ici selon ta structure c'est un dict (pas liste) dans @graph, donc on adapte
-                # Dans l'exemple que tu as donné, @graph est un dict avec mainEntity
-                main_entity = graph.get("mainEntity")
-                if main_entity:
-                    table_schema = main_entity.get("csvw:tableSchema", {})
-                    columns = table_schema.get("csvw:columns", [])
-                    for col in columns:
-                        nom_col = col.get("csvw:name", "")
-                        cellules = col.get("csvw:cells", [])
-                        if not cellules:
-                            continue
-                        try:
-                            valeur = int(cellules[0].get("csvw:value", 0))
-                        except Exception:
-                            valeur = 0
-                        repartition[nom_col] = valeur
-
-                    if "Total" in repartition:
-                        nombre_avis = repartition["Total"]
-                    else:
-                        nombre_avis = sum(v for k,v in repartition.items() if isinstance(v, int))
-
-            else:
-                logging.warning("Structure @graph manquante ou inattendue dans JSON-LD")
-
-            # secteur dans name sous @graph ou dans racine ?
-            # Tu avais dans ton exemple : "name": "Chronopost"
-            secteur = data_ld.get("@graph", {}).get("name") or data_ld.get("name", "Non renseigné")
-
-            return {
-                "secteur": secteur,
-                "repartition_avis": repartition,
-                "nombre_avis": nombre_avis
-            }
+            atomic_write(self.watermark_path, json.dumps(watermark, ensure_ascii=False, indent=4))
+            self.watermark = watermark
         except Exception as e:
-            logging.error(f"Erreur extraction JSON-LD: {e}")
+            logging.error(f"Erreur sauvegarde {self.watermark_path} : {e}")
+
+    @staticmethod
+    def _published_date(date_raw):
+        if not date_raw:
+            return None
+        try:
+            return parser.isoparse(date_raw)
+        except Exception:
             return None
 
-    def _extract_note_globale(self, soup):
+    def _apply_watermark(self, reviews, published_dates):
+        """
+        Mode incrémental : ne garde que les avis plus récents que le watermark
+        (id ou publishedDate brute) et note l'avis le plus récent rencontré
+        """
+        wm_id = self.watermark.get("id") if self.watermark else None
+        wm_date = None
+        if self.watermark and self.watermark.get("published_date"):
+            wm_date = parser.isoparse(self.watermark["published_date"])
+
+        nouveaux = []
+        for rev, date_raw in zip(reviews, published_dates):
+            published = self._published_date(date_raw)
+            review_id = rev["id_avis_trustpilot"]
+            if (wm_id and review_id == wm_id) or (wm_date and published and published < wm_date):
+                self.watermark_reached = True
+                break
+            nouveaux.append(rev)
+            if published and (self.newest_review is None or published > self.newest_review[1]):
+                self.newest_review = (review_id, published, date_raw)
+        return nouveaux
+
+    def _update_watermark(self):
+        if not self.incremental or self.newest_review is None:
+            return
+        if self.retry_queue:
+            logging.warning("Pages abandonnées pendant le run : watermark conservé")
+            return
+        if self.watermark and not self.watermark_reached:
+            logging.warning(
+                f"Avis déjà connus non atteints en {self.max_pages} pages : watermark conservé, "
+                f"relancer avec plus de pages pour combler l'écart"
+            )
+            return
+        review_id, _, published_raw = self.newest_review
+        self._save_watermark({
+            "id": review_id,
+            "published_date": published_raw,
+            "date_maj": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        })
+        logging.info(f"Nouveau watermark {self.domain} : avis {review_id} du {published_raw}")
+
+    def _page_url(self, page):
+        url = f"{TRUSTPILOT_BASE_URL}/review/{self.original_domain}?page={page}"
+        if self.incremental:
+            url += "&sort=recency"
+        return url
+
+    def _open_run(self, start_page):
         """
-        Extraction note globale depuis meta property="og:title"
+        Crée le dossier de scrap du run et ouvre le journal JSONL des avis
         """
+        self.checkpoint = start_page - 1
+        # Une plage explicite ne fait avancer derniere_page.txt que si elle la prolonge
+        self.saved_checkpoint = self._read_last_page()
+        self.persist_checkpoint = self.checkpoint <= self.saved_checkpoint
+        self.timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        self.scrap_dir = os.path.join(self.domain_dir, f"scrap_{self.domain}_{self.timestamp}")
+        os.makedirs(self.scrap_dir, exist_ok=True)
+        self.sink = JsonlSink(os.path.join(self.scrap_dir, f"{self.domain}_commentaires_{self.timestamp}.jsonl"))
+        self.debut_run = time.time()
+        if self.changes is not None:
+            self.deltas = JsonlSink(os.path.join(self.scrap_dir, f"{self.domain}_deltas_{self.timestamp}.jsonl"))
+
+    def _archive_page(self, page, url, content):
+        if self.archive is None:
+            return
         try:
-            meta_og = soup.find("meta", property="og:title")
-            if meta_og and meta_og.has_attr("content"):
-                content = meta_og["content"]
-                match = re.search(r"avec\s+([\d,\.]+)\s*/\s*5", content)
-                if match:
-                    note = match.group(1).replace(",", ".")
-                    return note
-            return "N/A"
+            self.archive.append(url, page, content)
         except Exception as e:
-            logging.error(f"Erreur extraction note globale: {e}")
-            return "N/A"
+            logging.error(f"Erreur archivage HTML page {page} : {e}")
+
+    def _write_page(self, page_reviews):
+        # Les données sont sur disque avant que le point de reprise n'avance
+        comparaisons = self.changes.comparer(page_reviews) if self.changes is not None else None
+        a_ecrire, empreintes = page_reviews, []
+        if self.fingerprints is not None:
+            a_ecrire, empreintes = self.fingerprints.filtrer(page_reviews)
+            if comparaisons:
+                # Un avis modifié ou réapparu après une suppression est réécrit même si sa clé est
+                # déjà connue : les chargeurs ont appliqué la suppression, il doit revenir dans le journal
+                retenus = {id(r) for r in a_ecrire}
+                a_ecrire += [r for evt, r, *_ in comparaisons if evt in (NOUVEAU, MODIFIE) and id(r) not in retenus]
+            if len(a_ecrire) < len(page_reviews):
+                logging.info(f"{len(page_reviews) - len(a_ecrire)} avis déjà scrapés ignorés")
+        self.sink.write_page(a_ecrire)
+        if comparaisons is not None:
+            self.deltas.write_page([delta(evt, cle, record=r) for evt, r, cle, _ in comparaisons if evt])
+            self.changes.valider(comparaisons)
+        # Empreintes enregistrées après le journal : au pire un doublon, jamais un avis perdu
+        if self.fingerprints is not None:
+            self.fingerprints.ajouter(empreintes)
+        return len(a_ecrire)
+
+    def _fetch(self, url, page=None):
+        """
+        GET régulé par le contrôleur AIMD de l'hôte ; 429 / 503 abaissent le débit
+        et respectent Retry-After, puis lèvent une HTTPError
+        """
+        debut = time.perf_counter()
+        if self.cache is not None:
+            # En incrémental la page 1 doit toujours être revalidée
+            cached = self.cache.lookup(url, ttl=0 if self.incremental else None)
+            if cached is not None:
+                self._mesurer(url, page, cached, debut, 0.0, cache=True)
+                return cached
+        self.throttle.wait()
+        attente = time.perf_counter() - debut
+        try:
+            resp = self._get(url)
+        except requests.RequestException as e:
+            self._mesurer(url, page, None, debut, attente, erreur=type(e).__name__)
+            raise
+        self._mesurer(url, page, resp, debut, attente)
+        if resp.status_code in THROTTLE_STATUSES:
+            retry_after = parse_retry_after(resp.headers.get("Retry-After"))
+            self.throttle.on_throttle(retry_after)
+            raise requests.HTTPError(f"{resp.status_code} (throttling) pour {url}", response=resp)
+        resp.raise_for_status()
+        self.throttle.on_success()
+        return resp
+
+    def _mesurer(self, url, page, resp, debut, attente, cache=False, erreur=None):
+        """
+        Télémétrie d'une requête synchrone : requests ne donne que le délai jusqu'aux en-têtes
+        (elapsed) et les reprises urllib3, pas de détail DNS / connexion
+        """
+        if self.telemetrie is None:
+            return
+        retries = getattr(getattr(resp, "raw", None), "retries", None)
+        elapsed = getattr(resp, "elapsed", None)
+        self.telemetrie.requete(
+            self.original_domain, url, page=page,
+            statut=resp.status_code if resp is not None else None,
+            total=time.perf_counter() - debut - attente,
+            ttfb=elapsed.total_seconds() if elapsed is not None else None,
+            attente=attente,
+            octets=len(resp.content) if resp is not None else 0,
+            tentatives=1 + len(retries.history) if retries is not None else 1,
+            cache=cache or getattr(resp, "from_cache", False),
+            erreur=erreur,
+        )
+
+    def _mark_page_done(self, page):
+        self.pages_done.add(page)
+        if self.incremental:
+            return
+        # Le point de reprise n'avance que sur des pages contiguës déjà écrites
+        checkpoint = self.checkpoint
+        while checkpoint + 1 in self.pages_done:
+            checkpoint += 1
+        if checkpoint != self.checkpoint:
+            self.checkpoint = checkpoint
+            if self.persist_checkpoint and checkpoint > self.saved_checkpoint:
+                self._save_last_page(checkpoint)
+
+    def _process_page(self, page, url, content):
+        """
+        Parse puis traite une page dans le processus courant (file de reprise)
+        """
+        parsed = parse_page(content, page, url, self.original_domain, with_info=self.info_data is None)
+        return self._handle_parsed(page, url, parsed)
+
+    def _submit_parse(self, pool, page, url, content):
+        if pool is None:
+            future = Future()
+            future.set_result(parse_page(content, page, url, self.original_domain, with_info=self.info_data is None))
+            return future
+        return pool.submit(parse_page, content, page, url, self.original_domain, self.info_data is None)
+
+    def _handle_parsed(self, page, url, parsed):
+        """
+        Traite le résultat de parse_page ; renvoie PAGE_OK ou PAGE_FIN (plus d'avis, watermark atteint)
+        """
+        if self.info_data is None and parsed["info"] is not None:
+            self.info_data = parsed["info"]
+        if self.telemetrie is not None:
+            self.telemetrie.parse(self.original_domain, page, parsed["duree_parse"], len(parsed["reviews"]))
+
+        if parsed["error"]:
+            logging.error(f"Erreur parsing JSON page {page}: {parsed['error']}")
+            self.erreur_parsing = True
+            return PAGE_FIN
+        page_reviews = parsed["reviews"]
+        if not page_reviews:
+            logging.info(f"Aucun avis trouvé page {page} -> fin scraping {self.original_domain}")
+            return PAGE_FIN
+
+        if self.incremental:
+            page_reviews = self._apply_watermark(page_reviews, parsed["published"])
+
+        nb_ecrits = self._write_page(page_reviews)
+        self._mark_page_done(page)
+        logging.info(f"Page {page} traitée, {nb_ecrits} avis récupérés")
+
+        if self.watermark_reached:
+            logging.info(f"Avis déjà connus atteints page {page} -> fin scraping incrémental")
+            return PAGE_FIN
+        return PAGE_OK
+
+    def _scrape_page(self, page):
+        url = self._page_url(page)
+        logging.info(f"Scraping page {page}: {url}")
+        try:
+            resp = self._fetch(url, page)
+        except requests.RequestException as e:
+            logging.error(f"Erreur requête page {page} : {e}")
+            return PAGE_ECHEC
+        self._archive_page(page, url, resp.content)
+        return self._process_page(page, url, resp.content)
+
+    def _process_retry_queue(self):
+        """
+        Les pages en échec sont retentées en fin de run plutôt qu'abandonnées
+        """
+        for tour in range(1, RETRY_ROUNDS + 1):
+            if not self.retry_queue:
+                return
+            pages = sorted(set(self.retry_queue))
+            self.retry_queue = []
+            logging.info(f"File de reprise {self.original_domain} (tour {tour}/{RETRY_ROUNDS}) : pages {pages}")
+            for page in pages:
+                if self._scrape_page(page) == PAGE_ECHEC:
+                    self.retry_queue.append(page)
+        if self.retry_queue:
+            logging.warning(f"Pages abandonnées après {RETRY_ROUNDS} tours de reprise : {self.retry_queue}")
+
+    def _first_page(self):
+        if self.incremental:
+            return 1
+        if self.start_page:
+            return self.start_page
+        return self._load_last_page()
+
+    def _collect_parsed(self, en_cours, taille_max):
+        """
+        Traite dans l'ordre des pages les parsings terminés, en bloquant tant que plus de
+        `taille_max` pages attendent ; renvoie True si la fin du scraping est atteinte
+        """
+        while en_cours and (len(en_cours) > taille_max or en_cours[0][2].done()):
+            page, url, future = en_cours.popleft()
+            if self._handle_parsed(page, url, future.result()) == PAGE_FIN:
+                # Pages déjà téléchargées au-delà de la fin : ignorées
+                for *_, reste in en_cours:
+                    reste.cancel()
+                en_cours.clear()
+                self.end_reached = True
+                return True
+        return False
 
     def scrape(self):
-        start_page = self._load_last_page()
-        current_page = start_page
-        all_reviews = []
-        first_page_scraped = None
+        """
+        Pipeline : le téléchargement des pages continue pendant que les pages précédentes
+        sont parsées par le pool de processus (au plus PARSE_QUEUE pages en attente)
+        """
+        start_page = self._first_page()
+        self._open_run(start_page)
+        pool = get_parse_pool()
+        en_cours = deque()
         consecutive_errors = 0
 
-        while current_page < start_page + self.max_pages:
-            url = f"https://fr.trustpilot.com/review/{self.original_domain}?page={current_page}"
-            logging.info(f"Scraping page {current_page}: {url}")
-
+        for page in range(start_page, start_page + self.max_pages):
+            url = self._page_url(page)
+            logging.info(f"Scraping page {page}: {url}")
             try:
-                resp = self.session.get(url, headers=self._headers(), timeout=30)
-                resp.raise_for_status()
-                consecutive_errors = 0
+                content = self._fetch(url, page).content
             except requests.RequestException as e:
-                logging.error(f"Erreur requête page {current_page} : {e}")
+                logging.error(f"Erreur requête page {page} : {e}")
+                self.retry_queue.append(page)
                 consecutive_errors += 1
                 if consecutive_errors > 3:
                     logging.error("Trop d'erreurs consécutives, arrêt du scraping")
                     break
-                current_page += 1
                 continue
-
-            soup = BeautifulSoup(resp.text, "html.parser")
-
-            if first_page_scraped is None:
-                ld_data = self._extract_json_ld(soup)
-                note_globale = self._extract_note_globale(soup)
-                if not ld_data:
-                    logging.warning("Impossible d'extraire JSON-LD, données générales incomplètes.")
-                    ld_data = {"secteur": "Non renseigné", "repartition_avis": {}, "nombre_avis": "N/A"}
-                self.info_data = {
-                    "societe": self.original_domain,
-                    "url": url,
-                    "secteur": ld_data["secteur"],
-                    "note_globale": note_globale,
-                    "nombre_avis": ld_data["nombre_avis"],
-                    "repartition_avis": ld_data["repartition_avis"],
-                    "date_extraction": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                    "nombre_commentaires": 0,
-                    "pages_scrapees": ""
-                }
-
-            script_tag = soup.find("script", id="__NEXT_DATA__", type="application/json")
-            if not script_tag:
-                logging.error(f"Script __NEXT_DATA__ non trouvé page {current_page}, arrêt")
+            consecutive_errors = 0
+            self._archive_page(page, url, content)
+            en_cours.append((page, url, self._submit_parse(pool, page, url, content)))
+            if self._collect_parsed(en_cours, PARSE_QUEUE - 1):
                 break
 
-            try:
-                data = json.loads(script_tag.string)
-                reviews = data["props"]["pageProps"].get("reviews", [])
-                if first_page_scraped is None:
-                    first_page_scraped = current_page
-                if not reviews:
-                    logging.info(f"Aucun avis trouvé page {current_page} -> fin scraping")
-                    break
-            except Exception as e:
-                logging.error(f"Erreur parsing JSON page {current_page}: {e}")
-                break
+        self._collect_parsed(en_cours, 0)
+        self._process_retry_queue()
+        self._finalize()
+        self._update_watermark()
+
+    def _couverture_complete(self):
+        """
+        Toutes les pages du run ont été lues sans trou ni erreur
+        """
+        return (not self.incremental and bool(self.pages_done) and not self.retry_queue
+                and not self.erreur_parsing and self.checkpoint == max(self.pages_done))
 
-            page_reviews = []
-            for rev in reviews:
-                date_raw = rev.get("dates", {}).get("publishedDate")
-                if date_raw:
-                    try:
-                        date_parsed = parser.isoparse(date_raw)
-                        date_formatted = date_parsed.strftime("%Y-%m-%d %H:%M:%S")
-                    except Exception:
-                        date_formatted = date_raw
-                else:
-                    date_formatted = None
-
-                r = {
-                    "page": current_page,
-                    "url_page": url,
-                    "auteur": rev.get("consumer", {}).get("displayName"),
-                    "date": date_formatted,
-                    "commentaire": rev.get("text"),
-                    "note_commentaire": str(rev.get("rating", ""))
-                }
-                page_reviews.append(r)
-
-            all_reviews.extend(page_reviews)
-            self._save_last_page(current_page)
-            logging.info(f"Page {current_page} traitée, {len(page_reviews)} avis récupérés")
-
-            sleep_time = 5 + (current_page % 6)
-            logging.info(f"Pause {sleep_time} secondes avant page suivante...")
-            time.sleep(sleep_time)
-
-            current_page += 1
-
-        if all_reviews:
-            self._save_results(all_reviews, first_page_scraped if first_page_scraped else start_page)
-            pages_range = f"-{first_page_scraped if first_page_scraped else start_page} à {self.last_successful_page}"
-            self.info_data["pages_scrapees"] = pages_range
-            self.info_data["nombre_commentaires"] = len(all_reviews)
+    def _emettre_suppressions(self, depuis):
+        """
+        Après un passage complet (page 1 jusqu'à la fin), les avis non revus depuis `depuis`
+        sont émis comme supprimés dans le flux de deltas du run
+        """
+        os.makedirs(self.scrap_dir, exist_ok=True)
+        deltas = JsonlSink(self.deltas.path)
+        self.changes.emettre_suppressions(depuis, deltas)
+        deltas.close()
+        self._nettoyer_run()
+
+    def _nettoyer_run(self):
+        if self.deltas is not None and os.path.exists(self.deltas.path) and not os.path.getsize(self.deltas.path):
+            os.remove(self.deltas.path)
+        if os.path.isdir(self.scrap_dir) and not os.listdir(self.scrap_dir):
+            os.rmdir(self.scrap_dir)
+
+    def _finalize(self):
+        self.sink.close()
+        if self.telemetrie is not None:
+            self.telemetrie.ecrire(self.original_domain)
+        if self.deltas is not None:
+            self.deltas.close()
+            if self.end_reached and min(self.pages_done, default=0) == 1 and self._couverture_complete():
+                self._emettre_suppressions(self.debut_run)
+        if self.sink.count:
+            self.info_data["pages_scrapees"] = f"-{min(self.pages_done)} à {max(self.pages_done)}"
+            self.info_data["nombre_commentaires"] = self.sink.count
+            self._save_results()
         else:
             logging.warning("Aucun avis récupéré durant ce scraping.")
+            os.remove(self.sink.path)
+        self._nettoyer_run()
 
-    def _save_results(self, reviews, first_page_scraped):
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        scrap_dir = os.path.join(self.domain_dir, f"scrap_{self.domain}_{timestamp}")
-        os.makedirs(scrap_dir, exist_ok=True)
+    def _save_results(self):
+        """
+        Exports (Parquet par défaut, CSV / JSON / Excel sur demande) construits
+        à partir du journal JSONL du run, qui reste la source de référence
+        """
+        scrap_dir, timestamp = self.scrap_dir, self.timestamp
 
         try:
             path_info = os.path.join(scrap_dir, f"{self.domain}_informations_generales_{timestamp}.txt")
@@ -282,28 +550,127 @@ class TrustpilotScraper:
         except Exception as e:
             logging.error(f"Erreur sauvegarde informations générales : {e}")
 
-        df = pd.DataFrame(reviews)
-        csv_path = os.path.join(scrap_dir, f"{self.domain}_commentaires_{timestamp}.csv")
-        json_path = os.path.join(scrap_dir, f"{self.domain}_commentaires_{timestamp}.json")
-        excel_path = os.path.join(scrap_dir, f"{self.domain}_commentaires_{timestamp}.xlsx")
-
-        df.to_csv(csv_path, index=False, encoding="utf-8-sig")
-        with open(json_path, "w", encoding="utf-8") as f:
-            json.dump(reviews, f, ensure_ascii=False, indent=2)
-        df.to_excel(excel_path, index=False)
+        base_path = os.path.join(scrap_dir, f"{self.domain}_commentaires_{timestamp}")
+        write_results(self.writers, self.sink, base_path)
 
         logging.info(f"Données sauvegardées dans {scrap_dir}")
 
-def main():
+def scrape_domain(domain, max_pages=30, start_page=None, incremental=False, output_dir=None, writers=None):
+    """
+    Scrape un domaine dans le processus courant et renvoie le scraper (info_data, pages_done, ...)
+    """
+    scraper = TrustpilotScraper(domain, max_pages, incremental=incremental, writers=writers,
+                                output_dir=output_dir, start_page=start_page)
+    scraper.scrape()
+    return scraper
+
+def scrape_batches(domain, total_pages, pages_par_lot=30, start_page=None, pause_entre_lots=0,
+                   output_dir=None, writers=None):
+    """
+    Enchaîne des lots de `pages_par_lot` pages dans le même processus (un dossier de scrap par lot).
+    Sans `start_page`, chaque lot reprend après derniere_page.txt
+    """
+    pages_faites = 0
+    scrapers = []
+    while pages_faites < total_pages:
+        taille = min(pages_par_lot, total_pages - pages_faites)
+        debut = start_page + pages_faites if start_page else None
+        logging.info(f"=== Lot {domain} : {taille} pages" + (f" à partir de la page {debut}" if debut else "") + " ===")
+        scraper = scrape_domain(domain, taille, start_page=debut, output_dir=output_dir, writers=writers)
+        scrapers.append(scraper)
+        pages_faites += taille
+        if scraper.end_reached:
+            logging.info(f"Fin des avis atteinte pour {domain}, arrêt des lots")
+            break
+        if pause_entre_lots and pages_faites < total_pages:
+            logging.info(f"Pause {pause_entre_lots} secondes avant le lot suivant...")
+            time.sleep(pause_entre_lots)
+    # Historique complet parcouru en plusieurs lots : suppressions détectées sur l'ensemble
+    dernier = scrapers[-1] if scrapers else None
+    if (dernier and dernier.changes is not None and start_page == 1 and len(scrapers) > 1
+            and dernier.end_reached and all(s._couverture_complete() for s in scrapers)):
+        dernier._emettre_suppressions(scrapers[0].debut_run)
+    return scrapers
+
+def parse_plage(value):
+    """'1-177' -> (1, 177)"""
+    match = re.fullmatch(r"(\d+)-(\d+)", value.strip())
+    if not match or int(match.group(1)) > int(match.group(2)):
+        raise argparse.ArgumentTypeError(f"Plage de pages invalide : {value} (attendu DEBUT-FIN)")
+    return int(match.group(1)), int(match.group(2))
+
+def main_interactif():
     domain = input("Entrez le nom de domaine (ex: chronopost.fr) : ").strip()
     if not domain:
         logging.error("Le domaine ne peut pas être vide.")
         return
     max_pages_input = input("Nombre max de pages à scraper (défaut 30) : ").strip()
     max_pages = int(max_pages_input) if max_pages_input.isdigit() else 30
+    try:
+        incremental = input("Mode incrémental, nouveaux avis uniquement (o/N) : ").strip().lower() == "o"
+    except EOFError:
+        incremental = False
 
-    scraper = TrustpilotScraper(domain, max_pages)
-    scraper.scrape()
+    scrape_domain(domain, max_pages, incremental=incremental)
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        description="Scraping des avis Trustpilot (sans argument : mode interactif)"
+    )
+    arg_parser.add_argument("domaines", nargs="*", help="Noms de domaine (ex: chronopost.fr temu.com)")
+    arg_parser.add_argument("--pages", type=int, default=30, help="Nombre max de pages par domaine (reprise après derniere_page.txt)")
+    arg_parser.add_argument("--plage", type=parse_plage, help="Plage explicite de pages, ex: 1-177")
+    arg_parser.add_argument("--lots", type=int, help="Découpe la plage / les pages en lots de N pages dans le même processus")
+    arg_parser.add_argument("--pause-lots", type=float, default=0, help="Pause (s) entre deux lots")
+    arg_parser.add_argument("--incremental", action="store_true", help="Nouveaux avis uniquement (watermark par domaine)")
+    arg_parser.add_argument("--output-dir", help="Répertoire de sortie (défaut : DATA_RAW_TRUSTPILOT)")
+    arg_parser.add_argument("--formats", help="Exports séparés par des virgules : parquet,csv,json,xlsx")
+    arg_parser.add_argument("--rate-initiale", type=float, help="Débit de départ par hôte (requêtes/s)")
+    arg_parser.add_argument("--rate-max", type=float, help="Plafond du débit adaptatif par hôte (requêtes/s)")
+    arg_parser.add_argument("--async", dest="mode_async", action="store_true", help="Moteur asyncio : domaines et plages en parallèle")
+    arg_parser.add_argument("--rate-global", type=float, help="Moteur asyncio : requêtes/s tous hôtes confondus")
+    arg_parser.add_argument("--parse-workers", type=int, help="Processus de parsing des pages (0 : parsing en ligne)")
+    args = arg_parser.parse_args()
+    configurer_logs()
+
+    if not args.domaines:
+        main_interactif()
+        return
+
+    controller = get_controller(TRUSTPILOT_HOST)
+    if args.rate_max:
+        get_controller(TRUSTPILOT_HOST, rate_max=args.rate_max)
+    if args.rate_initiale:
+        controller.rate = min(args.rate_initiale, controller.rate_max)
+
+    start_page, max_pages = None, args.pages
+    if args.plage:
+        start_page, fin = args.plage
+        max_pages = fin - start_page + 1
+
+    if args.parse_workers is not None:
+        get_parse_pool(args.parse_workers)
+
+    if args.mode_async:
+        from cde_scrap_async import AsyncScrapingEngine, RATE_GLOBAL
+        engine = AsyncScrapingEngine(
+            rate_global=args.rate_global or RATE_GLOBAL,
+            parse_workers=PARSE_WORKERS if args.parse_workers is None else args.parse_workers,
+            rate_hote=controller.rate_max,
+            incremental=args.incremental,
+            writers=args.formats,
+            output_dir=args.output_dir,
+        )
+        engine.run([(domain, max_pages, start_page) for domain in args.domaines])
+        return
+
+    for domain in args.domaines:
+        if args.lots and not args.incremental:
+            scrape_batches(domain, max_pages, args.lots, start_page=start_page, pause_entre_lots=args.pause_lots,
+                           output_dir=args.output_dir, writers=args.formats)
+        else:
+            scrape_domain(domain, max_pages, start_page=start_page, incremental=args.incremental,
+                          output_dir=args.output_dir, writers=args.formats)
 
 if __name__ == "__main__":
     main()
@@ -3,8 +3,12 @@ import mwparserfromhell
 import re
 import json
 import os
+import argparse
 from urllib.parse import unquote
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from http_cache import get_cache
 
 # Charger les variables d'environnement du fichier .env
 load_dotenv()
@@ -16,6 +20,13 @@ if not BASE_DIR:
 # Chemin du dossier wikipedia sous data/
 WIKI_DATA_DIR = os.path.join(BASE_DIR, "data", "wikipedia")
 os.makedirs(WIKI_DATA_DIR, exist_ok=True)
+# revid de la dernière version parsée de chaque page
+REVISIONS_PATH = os.path.join(WIKI_DATA_DIR, "revisions.json")
+
+WIKIPEDIA_API = "https://fr.wikipedia.org/w/api.php"
+WIKIDATA_API = "https://www.wikidata.org/w/api.php"
+# Valeurs multiples max par requête de l'API MediaWiki (titles=, ids=)
+TAILLE_LOT = 50
 
 SOCIETE_IDS = {
     "Temu (marché)": "1",
@@ -24,6 +35,55 @@ SOCIETE_IDS = {
     "Vinted": "4"
 }
 
+_session = None
+
+def get_session():
+    """Session HTTP partagée pour Wikipedia et Wikidata (pool de connexions réutilisé)"""
+    global _session
+    if _session is None:
+        _session = requests.Session()
+        _session.headers["User-Agent"] = "trustpilot-analyse/1.0 (scraping infobox entreprises)"
+        retry = Retry(total=5, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504])
+        _session.mount("https://", HTTPAdapter(max_retries=retry))
+    return _session
+
+def http_get(url, params=None, ttl=None):
+    """GET via le cache HTTP disque s'il est activé (HTTP_CACHE_DIR)"""
+    cache = get_cache()
+    if cache is not None:
+        return cache.get(get_session(), url, params=params, ttl=ttl)
+    return get_session().get(url, params=params, timeout=30)
+
+def lots(valeurs, taille=TAILLE_LOT):
+    valeurs = list(valeurs)
+    for i in range(0, len(valeurs), taille):
+        yield valeurs[i:i + taille]
+
+def query_pages(titres, ttl=None, **params):
+    """
+    action=query sur plusieurs titres à la fois (titles=A|B|C) ; renvoie {titre demandé: page}
+    en suivant normalisations et redirections
+    """
+    resultat = {}
+    for lot in lots(titres):
+        data = http_get(WIKIPEDIA_API, params={
+            "action": "query",
+            "format": "json",
+            "formatversion": "2",
+            "redirects": "1",
+            "titles": "|".join(lot),
+            **params,
+        }, ttl=ttl).json()
+        query = data.get("query", {})
+        renommages = {r["from"]: r["to"] for r in query.get("normalized", []) + query.get("redirects", [])}
+        pages = {page["title"]: page for page in query.get("pages", [])}
+        for titre in lot:
+            cible = titre
+            while cible in renommages:
+                cible = renommages[cible]
+            resultat[titre] = pages.get(cible, {"missing": True})
+    return resultat
+
 def clean_wikitext(text):
     text = str(text)
     text = re.sub(r"\[\[(?:[^|\]]+\|)?([^\]]+)\]\]", r"\1", text)
@@ -35,22 +95,7 @@ def clean_wikitext(text):
     text = re.sub(r"\{\{lang\|[^|]+\|([^}]+)\}\}", r"\1", text)
     return text.strip()
 
-def get_infobox(page_title):
-    url = "https://fr.wikipedia.org/w/api.php"
-    params = {
-        "action": "query",
-        "format": "json",
-        "titles": page_title,
-        "prop": "revisions|pageprops",
-        "rvprop": "content",
-        "rvslots": "main",
-    }
-    response = requests.get(url, params=params)
-    data = response.json()
-    page = next(iter(data["query"]["pages"].values()))
-    if "missing" in page:
-        return {"error": f"Page '{page_title}' non trouvée"}
-    wikitext = page["revisions"][0]["slots"]["main"]["*"]
+def parse_infobox(page_title, wikitext):
     parsed = mwparserfromhell.parse(wikitext)
     infobox = {}
     infobox["id_societe"] = SOCIETE_IDS.get(page_title, "")
@@ -61,62 +106,150 @@ def get_infobox(page_title):
                 value = clean_wikitext(param.value.strip())
                 infobox[key] = value
             break
-    if "SIREN" not in infobox or not infobox.get("SIREN"):
-        wikidata_id = page.get("pageprops", {}).get("wikibase_item")
-        if wikidata_id:
-            siren = get_siren_from_wikidata(wikidata_id)
-            if siren:
-                infobox["SIREN"] = siren
-    if "logo" in infobox:
-        infobox["logo_url"] = get_image_url(infobox["logo"])
     return infobox
 
-def get_siren_from_wikidata(wikidata_id):
-    url = f"https://www.wikidata.org/w/api.php?action=wbgetentities&ids={wikidata_id}&format=json&props=claims"
-    response = requests.get(url)
-    data = response.json()
-    try:
-        return data["entities"][wikidata_id]["claims"]["P1616"][0]["mainsnak"]["datavalue"]["value"]
-    except (KeyError, IndexError):
-        return None
-
-def get_image_url(filename):
-    filename = unquote(filename.split("|")[0].strip())
-    url = "https://fr.wikipedia.org/w/api.php"
-    params = {
-        "action": "query",
-        "format": "json",
-        "titles": f"File:{filename}",
-        "prop": "imageinfo",
-        "iiprop": "url",
+def get_revisions(page_titles):
+    """
+    revid courant de chaque page, sans le contenu (toujours revalidé, jamais servi par le cache)
+    """
+    pages = query_pages(page_titles, ttl=0, prop="revisions", rvprop="ids")
+    return {
+        titre: page["revisions"][0]["revid"]
+        for titre, page in pages.items() if not page.get("missing") and page.get("revisions")
     }
-    response = requests.get(url, params=params)
-    data = response.json()
-    page = next(iter(data["query"]["pages"].values()))
-    return page.get("imageinfo", [{}])[0].get("url", "")
-
-entreprises = [
-    "Chronopost",
-    "Vinted",
-    "Temu (marché)",
-    "Tesla (automobile)"
-]
-
-results = {}
-for entreprise in entreprises:
-    print(f"\n🔍 Traitement de : {entreprise}")
-    data = get_infobox(entreprise)
-    results[entreprise] = data
-
-    filename = os.path.join(WIKI_DATA_DIR, f"{SOCIETE_IDS[entreprise]}_infobox.json")
-    with open(filename, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=4, sort_keys=True)
-    print(f"✅ Fichier créé : {filename}")
-
-global_filename = os.path.join(WIKI_DATA_DIR, "entreprises_infobox.json")
-with open(global_filename, "w", encoding="utf-8") as f:
-    json.dump(results, f, ensure_ascii=False, indent=4, sort_keys=True)
-
-print("\n✅ Export terminé :")
-print(f"- Fichiers individuels : {WIKI_DATA_DIR}/1_infobox.json, 2_infobox.json, etc.")
-print(f"- Fichier global : {WIKI_DATA_DIR}/entreprises_infobox.json")
+
+def get_contents(revisions):
+    """
+    Wikitext et wikibase_item de plusieurs révisions (revids=1|2|3) : une URL par révision,
+    donc une réponse que le cache HTTP peut garder indéfiniment ; renvoie {titre: page}
+    """
+    titres = {revid: titre for titre, revid in revisions.items()}
+    pages = {}
+    for lot in lots(sorted(titres)):
+        data = http_get(WIKIPEDIA_API, params={
+            "action": "query",
+            "format": "json",
+            "formatversion": "2",
+            "revids": "|".join(str(revid) for revid in lot),
+            "prop": "revisions|pageprops",
+            "rvprop": "ids|content",
+            "rvslots": "main",
+        }).json()
+        for page in data.get("query", {}).get("pages", []):
+            for revision in page.get("revisions", []):
+                if revision["revid"] in titres:
+                    pages[titres[revision["revid"]]] = {**page, "revisions": [revision]}
+    return pages
+
+def get_infoboxes(page_titles, revisions):
+    """
+    Contenu de plusieurs pages par lots de 50 révisions, puis SIREN (Wikidata)
+    et URL des logos, eux aussi par lots
+    """
+    pages = get_contents({titre: revisions[titre] for titre in page_titles if titre in revisions})
+    infoboxes, wikidata_ids = {}, {}
+    for titre in page_titles:
+        page = pages.get(titre)
+        if not page:
+            infoboxes[titre] = {"error": f"Page '{titre}' non trouvée"}
+            continue
+        infobox = parse_infobox(titre, page["revisions"][0]["slots"]["main"]["content"])
+        infoboxes[titre] = infobox
+        wikidata_id = page.get("pageprops", {}).get("wikibase_item")
+        if not infobox.get("SIREN") and wikidata_id:
+            wikidata_ids[titre] = wikidata_id
+
+    sirens = get_sirens_from_wikidata(set(wikidata_ids.values()))
+    for titre, wikidata_id in wikidata_ids.items():
+        if sirens.get(wikidata_id):
+            infoboxes[titre]["SIREN"] = sirens[wikidata_id]
+
+    logos = {titre: infobox["logo"] for titre, infobox in infoboxes.items() if "logo" in infobox}
+    urls = get_image_urls(set(logos.values()))
+    for titre, logo in logos.items():
+        infoboxes[titre]["logo_url"] = urls.get(logo, "")
+    return infoboxes
+
+def get_sirens_from_wikidata(wikidata_ids):
+    sirens = {}
+    for lot in lots(sorted(wikidata_ids)):
+        response = http_get(WIKIDATA_API, params={
+            "action": "wbgetentities",
+            "ids": "|".join(lot),
+            "format": "json",
+            "props": "claims",
+        })
+        entities = response.json().get("entities", {})
+        for wikidata_id in lot:
+            try:
+                sirens[wikidata_id] = entities[wikidata_id]["claims"]["P1616"][0]["mainsnak"]["datavalue"]["value"]
+            except (KeyError, IndexError):
+                sirens[wikidata_id] = None
+    return sirens
+
+def get_image_urls(logos):
+    """
+    URL de plusieurs fichiers en une requête imageinfo par lot ; clé : valeur brute du champ logo
+    """
+    fichiers = {f"File:{unquote(logo.split('|')[0].strip())}": logo for logo in logos}
+    pages = query_pages(list(fichiers), prop="imageinfo", iiprop="url")
+    return {
+        logo: pages.get(fichier, {}).get("imageinfo", [{}])[0].get("url", "")
+        for fichier, logo in fichiers.items()
+    }
+
+def load_revisions():
+    if not os.path.exists(REVISIONS_PATH):
+        return {}
+    with open(REVISIONS_PATH, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def infobox_path(entreprise):
+    return os.path.join(WIKI_DATA_DIR, f"{SOCIETE_IDS.get(entreprise, entreprise)}_infobox.json")
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Infobox Wikipedia / SIREN Wikidata des entreprises")
+    arg_parser.add_argument("entreprises", nargs="*", default=list(SOCIETE_IDS), help="Titres des pages Wikipedia")
+    arg_parser.add_argument("--force", action="store_true", help="Reparse toutes les pages, même inchangées")
+    args = arg_parser.parse_args()
+    entreprises = args.entreprises
+
+    anciennes = {} if args.force else load_revisions()
+    courantes = get_revisions(entreprises)
+    results, a_parser = {}, []
+    for entreprise in entreprises:
+        path = infobox_path(entreprise)
+        if courantes.get(entreprise) and anciennes.get(entreprise) == courantes[entreprise] and os.path.exists(path):
+            print(f"⏭️ {entreprise} : révision {courantes[entreprise]} inchangée")
+            with open(path, "r", encoding="utf-8") as f:
+                results[entreprise] = json.load(f)
+        else:
+            a_parser.append(entreprise)
+
+    revisions = dict(anciennes)
+    if a_parser:
+        print(f"\n🔍 Traitement de : {', '.join(a_parser)}")
+        infoboxes = get_infoboxes(a_parser, courantes)
+        for entreprise in a_parser:
+            data = infoboxes[entreprise]
+            if "error" not in data:
+                revisions[entreprise] = courantes[entreprise]
+            results[entreprise] = data
+            filename = infobox_path(entreprise)
+            with open(filename, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False, indent=4, sort_keys=True)
+            print(f"✅ Fichier créé : {filename}")
+
+    with open(REVISIONS_PATH, "w", encoding="utf-8") as f:
+        json.dump(revisions, f, ensure_ascii=False, indent=4, sort_keys=True)
+
+    global_filename = os.path.join(WIKI_DATA_DIR, "entreprises_infobox.json")
+    with open(global_filename, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=4, sort_keys=True)
+
+    print("\n✅ Export terminé :")
+    print(f"- Fichiers individuels : {WIKI_DATA_DIR}/1_infobox.json, 2_infobox.json, etc.")
+    print(f"- Fichier global : {WIKI_DATA_DIR}/entreprises_infobox.json")
+
+if __name__ == "__main__":
+    main()
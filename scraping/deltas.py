@@ -0,0 +1,122 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from datetime import datetime
+
+from fingerprint import review_key
+
+# Détection des avis nouveaux / modifiés / supprimés (SCRAP_DELTAS=0 pour la désactiver)
+SCRAP_DELTAS = os.getenv("SCRAP_DELTAS", "1") != "0"
+
+NOUVEAU, MODIFIE, SUPPRIME = "nouveau", "modifie", "supprime"
+# Champs dont la modification produit un événement "modifie"
+CHAMPS_CONTENU = ("auteur", "date", "commentaire", "note_commentaire")
+
+_trackers = {}
+_trackers_lock = threading.Lock()
+
+
+def content_hash(record):
+    contenu = json.dumps([record.get(champ) for champ in CHAMPS_CONTENU], ensure_ascii=False)
+    return hashlib.blake2b(contenu.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def delta(evenement, cle, record=None, id_avis=None):
+    """
+    Événement du flux de deltas : l'avis complet pour nouveau / modifie, la clé seule pour supprime
+    """
+    evt = {"evenement": evenement, "cle": cle, "detecte_le": datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+    if record is not None:
+        evt.update(record)
+    else:
+        evt["id_avis_trustpilot"] = id_avis
+    return evt
+
+
+class ChangeTracker:
+    """
+    Empreinte de contenu de chaque avis connu d'un domaine (SQLite) : compare les avis
+    rescrapés à l'état précédent et garde la date du dernier passage pour repérer les suppressions
+    """
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS avis (
+                cle TEXT PRIMARY KEY,
+                id_avis_trustpilot TEXT,
+                hash TEXT NOT NULL,
+                premier_vu REAL NOT NULL,
+                vu_le REAL NOT NULL,
+                supprime INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_avis_vu_le ON avis (vu_le)")
+        self._db.commit()
+
+    def comparer(self, records):
+        """
+        [(événement ou None si inchangé, avis, clé, hash)] sans rien enregistrer
+        """
+        comparaisons = []
+        with self._lock:
+            for record in records:
+                cle = review_key(record)
+                empreinte = content_hash(record)
+                row = self._db.execute("SELECT hash, supprime FROM avis WHERE cle = ?", (cle,)).fetchone()
+                if row is None or row[1]:
+                    evenement = NOUVEAU
+                elif row[0] != empreinte:
+                    evenement = MODIFIE
+                else:
+                    evenement = None
+                comparaisons.append((evenement, record, cle, empreinte))
+        return comparaisons
+
+    def valider(self, comparaisons):
+        """
+        Enregistre l'état des avis vus, une fois les deltas écrits
+        """
+        maintenant = time.time()
+        with self._lock:
+            self._db.executemany("""
+                INSERT INTO avis (cle, id_avis_trustpilot, hash, premier_vu, vu_le, supprime)
+                VALUES (?, ?, ?, ?, ?, 0)
+                ON CONFLICT (cle) DO UPDATE SET hash = excluded.hash, vu_le = excluded.vu_le, supprime = 0
+            """, [
+                (cle, record.get("id_avis_trustpilot"), empreinte, maintenant, maintenant)
+                for _, record, cle, empreinte in comparaisons
+            ])
+            self._db.commit()
+
+    def emettre_suppressions(self, depuis, sink):
+        """
+        Avis encore présents au dernier passage complet mais pas revus depuis `depuis` :
+        écrits comme supprimés dans `sink` ; renvoie leur nombre
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT cle, id_avis_trustpilot FROM avis WHERE vu_le < ? AND supprime = 0", (depuis,)
+            ).fetchall()
+            if not rows:
+                return 0
+            sink.write_page([delta(SUPPRIME, cle, id_avis=id_avis) for cle, id_avis in rows])
+            self._db.executemany("UPDATE avis SET supprime = 1 WHERE cle = ?", [(cle,) for cle, _ in rows])
+            self._db.commit()
+        logging.info(f"{len(rows)} avis supprimés détectés ({self.db_path})")
+        return len(rows)
+
+
+def get_change_tracker(db_path):
+    """
+    Suivi unique par fichier pour tout le processus
+    """
+    with _trackers_lock:
+        if db_path not in _trackers:
+            _trackers[db_path] = ChangeTracker(db_path)
+        return _trackers[db_path]
@@ -0,0 +1,323 @@
+import os
+import math
+import time
+import sqlite3
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import requests
+
+from cde_scrap_new import (
+    data_raw_trustpilot, get_session, trustpilot_headers, configurer_logs, TRUSTPILOT_BASE_URL, TRUSTPILOT_HOST
+)
+from extraction import TrustpilotPage
+from http_cache import get_cache
+from throttle import get_controller, parse_retry_after, THROTTLE_STATUSES
+from scheduler import JobQueue
+
+# Frontière de découverte des sociétés (pages catégories et sociétés similaires)
+FRONTIERE_DB = os.getenv("DECOUVERTE_DB", os.path.join(data_raw_trustpilot, "frontiere.sqlite"))
+DECOUVERTE_WORKERS = int(os.getenv("DECOUVERTE_WORKERS", "4"))
+PROFONDEUR_MAX = int(os.getenv("DECOUVERTE_PROFONDEUR_MAX", "3"))
+PAGES_MAX_CATEGORIE = int(os.getenv("DECOUVERTE_PAGES_MAX_CATEGORIE", "20"))
+# Sociétés envoyées au scheduler à partir de ce nombre d'avis
+AVIS_MIN = int(os.getenv("DECOUVERTE_AVIS_MIN", "100"))
+
+CATEGORIE, SOCIETE = "categorie", "societe"
+# Les pages catégories passent avant les pages sociétés (sociétés similaires)
+PRIORITE_CATEGORIE = 100
+
+
+def _noeuds(data):
+    """Parcours de tous les dictionnaires d'un __NEXT_DATA__"""
+    pile = [data]
+    while pile:
+        noeud = pile.pop()
+        if isinstance(noeud, dict):
+            yield noeud
+            pile.extend(noeud.values())
+        elif isinstance(noeud, list):
+            pile.extend(noeud)
+
+
+def analyser_page(data):
+    """
+    Sociétés (identifyingName), catégories (categoryId) et nombre de pages d'une page Trustpilot.
+    Le schéma exact variant selon le type de page, tout le __NEXT_DATA__ est parcouru
+    """
+    societes, categories, total_pages = {}, set(), None
+    for noeud in _noeuds(data.get("props", {}).get("pageProps", {})):
+        domaine = noeud.get("identifyingName")
+        if isinstance(domaine, str) and "." in domaine:
+            domaine = domaine.lower()
+            avis = noeud.get("numberOfReviews")
+            avis = avis if isinstance(avis, int) else 0
+            if domaine not in societes or avis > societes[domaine][1]:
+                societes[domaine] = (noeud.get("displayName") or domaine, avis)
+        categorie = noeud.get("categoryId")
+        if isinstance(categorie, str) and categorie:
+            categories.add(categorie)
+        if total_pages is None and isinstance(noeud.get("totalPages"), int):
+            total_pages = noeud["totalPages"]
+    return societes, categories, total_pages
+
+
+def priorite_societe(nombre_avis):
+    return math.log10(1 + nombre_avis)
+
+
+class Frontiere:
+    """
+    Frontière persistante (SQLite) : URL dédupliquées, servies par priorité décroissante,
+    et sociétés découvertes avec leur nombre d'avis
+    """
+    def __init__(self, db_path=FRONTIERE_DB):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS urls (
+                url TEXT PRIMARY KEY,
+                type TEXT NOT NULL,
+                priorite REAL NOT NULL,
+                profondeur INTEGER NOT NULL,
+                statut TEXT NOT NULL DEFAULT 'en_attente',
+                decouverte_le REAL NOT NULL,
+                visitee_le REAL
+            );
+            CREATE INDEX IF NOT EXISTS idx_urls_frontiere ON urls (statut, priorite);
+            CREATE TABLE IF NOT EXISTS societes (
+                domaine TEXT PRIMARY KEY,
+                nom TEXT,
+                nombre_avis INTEGER NOT NULL DEFAULT 0,
+                source TEXT,
+                decouverte_le REAL NOT NULL,
+                planifiee INTEGER NOT NULL DEFAULT 0
+            );
+        """)
+        self._db.commit()
+
+    def ajouter(self, url, type_url, priorite, profondeur):
+        """Ignoré si l'URL est déjà connue (visitée ou en attente)"""
+        with self._lock:
+            self._db.execute(
+                "INSERT OR IGNORE INTO urls (url, type, priorite, profondeur, decouverte_le) VALUES (?, ?, ?, ?, ?)",
+                (url, type_url, priorite, profondeur, time.time())
+            )
+            self._db.commit()
+
+    def reprendre_interrompues(self):
+        with self._lock:
+            self._db.execute("UPDATE urls SET statut = 'en_attente' WHERE statut = 'en_cours'")
+            self._db.commit()
+
+    def reserver(self, limite):
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT * FROM urls WHERE statut = 'en_attente' ORDER BY priorite DESC, decouverte_le LIMIT ?",
+                (limite,)
+            ).fetchall()
+            self._db.executemany("UPDATE urls SET statut = 'en_cours' WHERE url = ?", [(r["url"],) for r in rows])
+            self._db.commit()
+        return [dict(r) for r in rows]
+
+    def terminer(self, url, statut="visitee"):
+        with self._lock:
+            self._db.execute("UPDATE urls SET statut = ?, visitee_le = ? WHERE url = ?", (statut, time.time(), url))
+            self._db.commit()
+
+    def enregistrer_societes(self, societes, source):
+        """Renvoie les domaines jamais vus"""
+        nouvelles = []
+        with self._lock:
+            for domaine, (nom, avis) in societes.items():
+                cur = self._db.execute(
+                    "INSERT OR IGNORE INTO societes (domaine, nom, nombre_avis, source, decouverte_le) VALUES (?, ?, ?, ?, ?)",
+                    (domaine, nom, avis, source, time.time())
+                )
+                if cur.rowcount:
+                    nouvelles.append(domaine)
+                else:
+                    self._db.execute(
+                        "UPDATE societes SET nombre_avis = MAX(nombre_avis, ?) WHERE domaine = ?", (avis, domaine)
+                    )
+            self._db.commit()
+        return nouvelles
+
+    def societes(self, avis_min=0, non_planifiees=False):
+        requete = "SELECT * FROM societes WHERE nombre_avis >= ?"
+        if non_planifiees:
+            requete += " AND planifiee = 0"
+        with self._lock:
+            return [dict(r) for r in self._db.execute(requete + " ORDER BY nombre_avis DESC", (avis_min,))]
+
+    def marquer_planifiee(self, domaine):
+        with self._lock:
+            self._db.execute("UPDATE societes SET planifiee = 1 WHERE domaine = ?", (domaine,))
+            self._db.commit()
+
+    def compter(self):
+        with self._lock:
+            return {r[0]: r[1] for r in self._db.execute("SELECT statut, COUNT(*) FROM urls GROUP BY statut")}
+
+
+class DiscoveryCrawler:
+    """
+    Parcours des pages catégories et des pages sociétés (sociétés similaires) à concurrence
+    bornée ; le débit vers Trustpilot reste régulé par le contrôleur AIMD partagé avec le scraper
+    """
+    def __init__(self, frontiere, workers=DECOUVERTE_WORKERS, profondeur_max=PROFONDEUR_MAX,
+                 avis_min=AVIS_MIN, queue=None, intervalle=None):
+        self.frontiere = frontiere
+        self.workers = workers
+        self.profondeur_max = profondeur_max
+        self.avis_min = avis_min
+        self.queue = queue
+        self.intervalle = intervalle
+        # Domaines déjà présents dans la file du scheduler, lue une seule fois
+        self.domaines_en_file = None
+        self.session = get_session()
+        self.throttle = get_controller(TRUSTPILOT_HOST)
+        self.cache = get_cache()
+
+    def amorcer(self, domaines=()):
+        self.frontiere.ajouter(f"{TRUSTPILOT_BASE_URL}/categories", CATEGORIE, PRIORITE_CATEGORIE, 0)
+        for domaine in domaines:
+            self.frontiere.ajouter(f"{TRUSTPILOT_BASE_URL}/review/{domaine}", SOCIETE, PRIORITE_CATEGORIE, 0)
+
+    def _get(self, url):
+        self.throttle.wait()
+        if self.cache is not None:
+            resp = self.cache.get(self.session, url, headers=trustpilot_headers(), timeout=30)
+        else:
+            resp = self.session.get(url, headers=trustpilot_headers(), timeout=30)
+        if resp.status_code in THROTTLE_STATUSES:
+            self.throttle.on_throttle(parse_retry_after(resp.headers.get("Retry-After")))
+            raise requests.HTTPError(f"{resp.status_code} (throttling) pour {url}", response=resp)
+        resp.raise_for_status()
+        self.throttle.on_success()
+        return resp.content
+
+    def visiter(self, entree):
+        """Exécuté dans un thread : téléchargement et analyse d'une URL de la frontière"""
+        data = TrustpilotPage(self._get(entree["url"])).next_data()
+        if not data:
+            raise ValueError(f"Script __NEXT_DATA__ non trouvé : {entree['url']}")
+        return analyser_page(data)
+
+    def _etendre(self, entree, resultat):
+        societes, categories, total_pages = resultat
+        url, profondeur = entree["url"], entree["profondeur"]
+        nouvelles = self.frontiere.enregistrer_societes(societes, url)
+        if nouvelles:
+            logging.info(f"{len(nouvelles)} nouvelle(s) société(s) depuis {url}")
+
+        if profondeur < self.profondeur_max:
+            for categorie in categories:
+                self.frontiere.ajouter(f"{TRUSTPILOT_BASE_URL}/categories/{categorie}", CATEGORIE,
+                                       PRIORITE_CATEGORIE - profondeur - 1, profondeur + 1)
+            for domaine, (_, avis) in societes.items():
+                self.frontiere.ajouter(f"{TRUSTPILOT_BASE_URL}/review/{domaine}", SOCIETE,
+                                       priorite_societe(avis), profondeur + 1)
+        # Pagination d'une catégorie : mêmes profondeur et priorité décroissante avec la page
+        if entree["type"] == CATEGORIE and total_pages and "?page=" not in url and "/categories/" in url:
+            for page in range(2, min(total_pages, PAGES_MAX_CATEGORIE) + 1):
+                self.frontiere.ajouter(f"{url}?page={page}", CATEGORIE,
+                                       entree["priorite"] - page / 100, profondeur)
+
+    def planifier(self):
+        """
+        Sociétés découvertes avec assez d'avis -> jobs 'complet' du scheduler
+        (et rafraîchissement incrémental récurrent si un intervalle est donné)
+        """
+        if self.queue is None:
+            return 0
+        if self.domaines_en_file is None:
+            self.domaines_en_file = {row["domaine"] for row in self.queue.lister()}
+        n = 0
+        for societe in self.frontiere.societes(self.avis_min, non_planifiees=True):
+            domaine = societe["domaine"]
+            if domaine not in self.domaines_en_file:
+                self.domaines_en_file.add(domaine)
+                priorite = int(priorite_societe(societe["nombre_avis"]))
+                self.queue.ajouter(domaine, "complet", priorite=priorite)
+                if self.intervalle:
+                    self.queue.ajouter(domaine, "incremental", priorite=priorite, dans=self.intervalle,
+                                       intervalle=self.intervalle)
+                n += 1
+            self.frontiere.marquer_planifiee(domaine)
+        if n:
+            logging.info(f"{n} société(s) ajoutée(s) à la file de scraping")
+        return n
+
+    def run(self, max_pages=None):
+        self.frontiere.reprendre_interrompues()
+        visitees = 0
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while True:
+                libres = self.workers - len(running)
+                if max_pages is not None:
+                    libres = min(libres, max_pages - visitees - len(running))
+                if libres > 0:
+                    for entree in self.frontiere.reserver(libres):
+                        running[pool.submit(self.visiter, entree)] = entree
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    entree = running.pop(future)
+                    visitees += 1
+                    try:
+                        self._etendre(entree, future.result())
+                        self.frontiere.terminer(entree["url"])
+                    except Exception as e:
+                        logging.error(f"Erreur découverte {entree['url']} : {e}")
+                        self.frontiere.terminer(entree["url"], "echec")
+                # Les sociétés découvertes partent au scheduler au fil de l'eau
+                self.planifier()
+        logging.info(f"Découverte terminée : {visitees} page(s) visitée(s), frontière {self.frontiere.compter()}")
+        return visitees
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Découverte des sociétés Trustpilot (catégories, sociétés similaires)")
+    sub = arg_parser.add_subparsers(dest="commande", required=True)
+
+    amorce = sub.add_parser("amorcer", help="Ajoute la page des catégories et des sociétés de départ")
+    amorce.add_argument("domaines", nargs="*")
+
+    crawl = sub.add_parser("crawl", help="Parcourt la frontière")
+    crawl.add_argument("--workers", type=int, default=DECOUVERTE_WORKERS)
+    crawl.add_argument("--max-pages", type=int, help="Nombre max de pages visitées")
+    crawl.add_argument("--profondeur", type=int, default=PROFONDEUR_MAX)
+    crawl.add_argument("--avis-min", type=int, default=AVIS_MIN, help="Avis min pour planifier le scraping")
+    crawl.add_argument("--sans-planifier", action="store_true", help="N'alimente pas la file du scheduler")
+    crawl.add_argument("--intervalle", type=float, help="Ajoute aussi un job incrémental récurrent (heures)")
+
+    liste = sub.add_parser("lister", help="Domaines découverts, un par ligne")
+    liste.add_argument("--avis-min", type=int, default=0)
+    args = arg_parser.parse_args()
+    configurer_logs()
+
+    frontiere = Frontiere()
+    if args.commande == "amorcer":
+        DiscoveryCrawler(frontiere).amorcer(args.domaines)
+    elif args.commande == "crawl":
+        crawler = DiscoveryCrawler(
+            frontiere, workers=args.workers, profondeur_max=args.profondeur, avis_min=args.avis_min,
+            queue=None if args.sans_planifier else JobQueue(),
+            intervalle=int(args.intervalle * 3600) if args.intervalle else None,
+        )
+        if not frontiere.compter():
+            crawler.amorcer()
+        crawler.run(args.max_pages)
+    else:
+        for societe in frontiere.societes(args.avis_min):
+            print(societe["domaine"])
+
+if __name__ == "__main__":
+    main()
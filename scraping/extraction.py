@@ -0,0 +1,294 @@
+import os
+import re
+import json
+import time
+import html
+import logging
+import threading
+import multiprocessing
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from bs4 import BeautifulSoup
+from dateutil import parser
+
+# Marqueurs des balises recherchées directement dans les octets de la réponse
+NEXT_DATA_MARKER = b'id="__NEXT_DATA__"'
+JSON_LD_MARKER = b'data-business-unit-json-ld-dataset="true"'
+OG_TITLE_RE = re.compile(rb'<meta\s[^>]*property="og:title"[^>]*>', re.IGNORECASE)
+CONTENT_ATTR_RE = re.compile(rb'\scontent="([^"]*)"', re.IGNORECASE)
+
+# Processus de parsing (0 : parsing dans le processus courant) et profondeur de la file entre les étapes
+PARSE_WORKERS = int(os.getenv("SCRAP_PARSE_WORKERS", str(os.cpu_count() or 1)))
+PARSE_QUEUE = int(os.getenv("SCRAP_PARSE_QUEUE", str(2 * max(1, PARSE_WORKERS))))
+
+_parse_pool = None
+_parse_workers = PARSE_WORKERS
+_parse_pool_lock = threading.Lock()
+
+
+def _script_payload(content, marker):
+    """
+    Contenu brut de la balise <script> portant `marker` dans ses attributs, sans parser le HTML
+    """
+    idx = content.find(marker)
+    if idx == -1:
+        return None
+    start = content.rfind(b"<script", 0, idx)
+    if start == -1 or b">" in content[start:idx]:
+        return None
+    body_start = content.find(b">", idx)
+    if body_start == -1:
+        return None
+    body_start += 1
+    end = content.find(b"</script>", body_start)
+    if end == -1:
+        return None
+    return content[body_start:end]
+
+
+def extract_next_data(content):
+    payload = _script_payload(content, NEXT_DATA_MARKER)
+    return json.loads(payload) if payload else None
+
+
+def extract_json_ld(content):
+    payload = _script_payload(content, JSON_LD_MARKER)
+    return json.loads(payload) if payload else None
+
+
+def extract_og_title(content):
+    tag = OG_TITLE_RE.search(content)
+    if not tag:
+        return None
+    match = CONTENT_ATTR_RE.search(tag.group(0))
+    if not match:
+        return None
+    return html.unescape(match.group(1).decode("utf-8", errors="replace"))
+
+
+class TrustpilotPage:
+    """
+    Page Trustpilot téléchargée : les charges utiles (__NEXT_DATA__, ld+json, og:title)
+    sont extraites directement des octets, BeautifulSoup n'est construit qu'en secours
+    """
+    def __init__(self, content):
+        self.content = content if isinstance(content, bytes) else content.encode("utf-8")
+        self._soup = None
+
+    @property
+    def soup(self):
+        if self._soup is None:
+            self._soup = BeautifulSoup(self.content, "html.parser")
+        return self._soup
+
+    def next_data(self):
+        try:
+            data = extract_next_data(self.content)
+            if data is not None:
+                return data
+        except ValueError as e:
+            logging.debug(f"Extraction rapide __NEXT_DATA__ impossible : {e}")
+        script_tag = self.soup.find("script", id="__NEXT_DATA__", type="application/json")
+        if not script_tag:
+            return None
+        return json.loads(script_tag.string)
+
+    def json_ld(self):
+        try:
+            data = extract_json_ld(self.content)
+            if data is not None:
+                return data
+        except ValueError as e:
+            logging.debug(f"Extraction rapide JSON-LD impossible : {e}")
+        script_ld = self.soup.find("script", type="application/ld+json", attrs={"data-business-unit-json-ld-dataset": "true"})
+        if not script_ld:
+            return None
+        return json.loads(script_ld.string)
+
+    def og_title(self):
+        title = extract_og_title(self.content)
+        if title is not None:
+            return title
+        meta_og = self.soup.find("meta", property="og:title")
+        if meta_og and meta_og.has_attr("content"):
+            return meta_og["content"]
+        return None
+
+
+def parse_json_ld(page_html):
+    """
+    Extraction robuste des informations générales :
+    - secteur (name)
+    - repartition des avis (csvw:columns)
+    - nombre total d'avis (total dans la répartition ou somme)
+    """
+    try:
+        data_ld = page_html.json_ld()
+        if not data_ld:
+            logging.warning("Aucun script ld+json trouvé.")
+            return None
+
+        secteur = data_ld.get("@graph", {}).get("name", "Non renseigné")
+        repartition = {}
+        nombre_avis = "N/A"
+
+        graph = data_ld.get("@graph")
+        if graph:
+            # Ici selon ta structure c'est un dict (pas liste) dans @graph, donc on adapte
+            # Dans l'exemple que tu as donné, @graph est un dict avec mainEntity
+            main_entity = graph.get("mainEntity")
+            if main_entity:
+                table_schema = main_entity.get("csvw:tableSchema", {})
+                columns = table_schema.get("csvw:columns", [])
+                for col in columns:
+                    nom_col = col.get("csvw:name", "")
+                    cellules = col.get("csvw:cells", [])
+                    if not cellules:
+                        continue
+                    try:
+                        valeur = int(cellules[0].get("csvw:value", 0))
+                    except Exception:
+                        valeur = 0
+                    repartition[nom_col] = valeur
+
+                if "Total" in repartition:
+                    nombre_avis = repartition["Total"]
+                else:
+                    nombre_avis = sum(v for k,v in repartition.items() if isinstance(v, int))
+
+        else:
+            logging.warning("Structure @graph manquante ou inattendue dans JSON-LD")
+
+        # secteur dans name sous @graph ou dans racine ?
+        # Tu avais dans ton exemple : "name": "Chronopost"
+        secteur = data_ld.get("@graph", {}).get("name") or data_ld.get("name", "Non renseigné")
+
+        return {
+            "secteur": secteur,
+            "repartition_avis": repartition,
+            "nombre_avis": nombre_avis
+        }
+    except Exception as e:
+        logging.error(f"Erreur extraction JSON-LD: {e}")
+        return None
+
+
+def parse_note_globale(page_html):
+    """
+    Extraction note globale depuis meta property="og:title"
+    """
+    try:
+        content = page_html.og_title()
+        if content:
+            match = re.search(r"avec\s+([\d,\.]+)\s*/\s*5", content)
+            if match:
+                note = match.group(1).replace(",", ".")
+                return note
+        return "N/A"
+    except Exception as e:
+        logging.error(f"Erreur extraction note globale: {e}")
+        return "N/A"
+
+
+def build_info_data(page_html, url, societe):
+    """
+    Construit les informations générales de la société à partir de la première page scrapée
+    """
+    ld_data = parse_json_ld(page_html)
+    note_globale = parse_note_globale(page_html)
+    if not ld_data:
+        logging.warning("Impossible d'extraire JSON-LD, données générales incomplètes.")
+        ld_data = {"secteur": "Non renseigné", "repartition_avis": {}, "nombre_avis": "N/A"}
+    return {
+        "societe": societe,
+        "url": url,
+        "secteur": ld_data["secteur"],
+        "note_globale": note_globale,
+        "nombre_avis": ld_data["nombre_avis"],
+        "repartition_avis": ld_data["repartition_avis"],
+        "date_extraction": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "nombre_commentaires": 0,
+        "pages_scrapees": ""
+    }
+
+
+def extract_reviews(page_html, page):
+    """
+    Liste brute des avis contenue dans le script __NEXT_DATA__ de la page
+    """
+    data = page_html.next_data()
+    if not data:
+        raise ValueError(f"Script __NEXT_DATA__ non trouvé page {page}")
+    return data["props"]["pageProps"].get("reviews", [])
+
+
+def map_review(rev, page, url):
+    date_raw = rev.get("dates", {}).get("publishedDate")
+    if date_raw:
+        try:
+            date_parsed = parser.isoparse(date_raw)
+            date_formatted = date_parsed.strftime("%Y-%m-%d %H:%M:%S")
+        except Exception:
+            date_formatted = date_raw
+    else:
+        date_formatted = None
+
+    return {
+        "id_avis_trustpilot": rev.get("id"),
+        "page": page,
+        "url_page": url,
+        "auteur": rev.get("consumer", {}).get("displayName"),
+        "date": date_formatted,
+        "commentaire": rev.get("text"),
+        "note_commentaire": str(rev.get("rating", ""))
+    }
+
+
+def parse_page(content, page, url, societe, with_info=False):
+    """
+    Étape de parsing (exécutée dans un processus du pool) : octets bruts -> avis normalisés.
+    Renvoie un dict picklable : info (si demandée), avis, dates publishedDate brutes, erreur
+    """
+    debut = time.perf_counter()
+    page_html = TrustpilotPage(content)
+    parsed = {"info": None, "reviews": [], "published": [], "error": None, "duree_parse": 0.0}
+    if with_info:
+        parsed["info"] = build_info_data(page_html, url, societe)
+    try:
+        reviews = extract_reviews(page_html, page)
+    except Exception as e:
+        parsed["error"] = str(e)
+        parsed["duree_parse"] = time.perf_counter() - debut
+        return parsed
+    parsed["reviews"] = [map_review(rev, page, url) for rev in reviews]
+    parsed["published"] = [rev.get("dates", {}).get("publishedDate") for rev in reviews]
+    parsed["duree_parse"] = time.perf_counter() - debut
+    return parsed
+
+
+def get_parse_pool(workers=None):
+    """
+    Pool de processus de parsing unique pour tout le processus, None si le parsing reste en ligne.
+    Le nombre de processus peut être fixé tant que le pool n'est pas créé
+    """
+    global _parse_pool, _parse_workers
+    with _parse_pool_lock:
+        if _parse_pool is None and workers is not None:
+            _parse_workers = workers
+        if _parse_workers <= 0:
+            return None
+        if _parse_pool is None:
+            # spawn : le pool peut être créé depuis un thread du scheduler, fork n'y est pas sûr
+            _parse_pool = ProcessPoolExecutor(max_workers=_parse_workers, mp_context=multiprocessing.get_context("spawn"))
+        return _parse_pool
+
+
+def shutdown_parse_pool():
+    """
+    Arrête le pool de parsing (processus attendus) ; un prochain appel à get_parse_pool le recrée
+    """
+    global _parse_pool
+    with _parse_pool_lock:
+        pool, _parse_pool = _parse_pool, None
+    if pool is not None:
+        pool.shutdown(wait=True)
@@ -0,0 +1,93 @@
+import os
+import hashlib
+import logging
+import threading
+from array import array
+from bisect import bisect_left
+
+# Déduplication des avis au moment du scraping (SCRAP_DEDUP=0 pour la désactiver)
+SCRAP_DEDUP = os.getenv("SCRAP_DEDUP", "1") != "0"
+
+_index = {}
+_index_lock = threading.Lock()
+
+
+def review_key(record):
+    """
+    Clé d'un avis : id Trustpilot, sinon auteur + date + texte
+    """
+    if record.get("id_avis_trustpilot"):
+        return f"id:{record['id_avis_trustpilot']}"
+    return f"{record.get('auteur') or ''}|{record.get('date') or ''}|{record.get('commentaire') or ''}"
+
+
+def fingerprint(record):
+    digest = hashlib.blake2b(review_key(record).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+class FingerprintIndex:
+    """
+    Empreintes 64 bits des avis déjà écrits pour un domaine : fichier binaire en ajout seul,
+    chargé en tableau trié (8 octets par avis), les ajouts du run restent dans un set.
+    Sans chemin, l'index ne vit qu'en mémoire
+    """
+    def __init__(self, path):
+        self.path = path
+        self.connues = array("Q")
+        if path and os.path.exists(path):
+            with open(path, "rb") as f:
+                self.connues.frombytes(f.read(os.path.getsize(path) // 8 * 8))
+            self.connues = array("Q", sorted(self.connues))
+        self.ajoutees = set()
+        self._lock = threading.Lock()
+        if path:
+            logging.info(f"Index d'empreintes {path} : {len(self.connues)} avis connus")
+
+    def __contains__(self, empreinte):
+        if empreinte in self.ajoutees:
+            return True
+        i = bisect_left(self.connues, empreinte)
+        return i < len(self.connues) and self.connues[i] == empreinte
+
+    def __len__(self):
+        return len(self.connues) + len(self.ajoutees)
+
+    def filtrer(self, records):
+        """
+        Avis jamais vus (doublons internes à la page compris) et leurs empreintes, sans rien enregistrer
+        """
+        nouveaux, empreintes, vues = [], [], set()
+        with self._lock:
+            for record in records:
+                empreinte = fingerprint(record)
+                if empreinte in vues or empreinte in self:
+                    continue
+                vues.add(empreinte)
+                nouveaux.append(record)
+                empreintes.append(empreinte)
+        return nouveaux, empreintes
+
+    def ajouter(self, empreintes):
+        """
+        Enregistre les empreintes une fois les avis écrits dans le journal
+        """
+        if not empreintes:
+            return
+        with self._lock:
+            if self.path:
+                with open(self.path, "ab") as f:
+                    f.write(array("Q", empreintes).tobytes())
+                    f.flush()
+                    os.fsync(f.fileno())
+            self.ajoutees.update(empreintes)
+
+
+def get_fingerprint_index(path):
+    """
+    Index unique par fichier pour tout le processus (runs d'un même domaine en parallèle)
+    """
+    with _index_lock:
+        if path not in _index:
+            _index[path] = FingerprintIndex(path)
+        return _index[path]
@@ -0,0 +1,244 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+import requests
+
+# Cache désactivé tant que HTTP_CACHE_DIR n'est pas défini
+HTTP_CACHE_DIR = os.getenv("HTTP_CACHE_DIR")
+HTTP_CACHE_MAX_MB = int(os.getenv("HTTP_CACHE_MAX_MB", "500"))
+
+# Durée de fraîcheur (secondes) par type d'endpoint : le premier motif qui correspond s'applique
+TTL_PAR_ENDPOINT = [
+    ("trustpilot_review", re.compile(r"trustpilot\.com/review/"), 6 * 3600),
+    ("wikipedia_api", re.compile(r"wikipedia\.org/w/api\.php"), 30 * 86400),
+    ("wikidata_api", re.compile(r"wikidata\.org/w/api\.php"), 30 * 86400),
+]
+TTL_DEFAUT = 3600
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def ttl_for(url):
+    for _, motif, ttl in TTL_PAR_ENDPOINT:
+        if motif.search(url):
+            return ttl
+    return TTL_DEFAUT
+
+
+class CachedResponse:
+    """
+    Réponse HTTP minimale (servie par le cache ou le réseau), compatible
+    avec l'usage qu'en font les scrapers : content, text, json(), raise_for_status()
+    """
+    def __init__(self, url, status_code, headers, content, from_cache=False):
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.from_cache = from_cache
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} Error for url: {self.url}", response=self)
+
+
+class HttpCache:
+    """
+    Cache disque des réponses HTTP, clé = URL complète.
+    Index SQLite (ETag, Last-Modified, date de stockage, dernier accès) + corps en fichiers,
+    revalidation conditionnelle et éviction LRU au-delà de `max_bytes`
+    """
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(cache_dir, "index.sqlite"), check_same_thread=False)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS entrees (
+                cle TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                status INTEGER,
+                headers TEXT,
+                etag TEXT,
+                last_modified TEXT,
+                stocke_le REAL,
+                dernier_acces REAL,
+                taille INTEGER
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_entrees_acces ON entrees (dernier_acces)")
+        self._db.commit()
+
+    @classmethod
+    def from_env(cls):
+        if not HTTP_CACHE_DIR:
+            return None
+        return cls(HTTP_CACHE_DIR, HTTP_CACHE_MAX_MB * 1024 * 1024)
+
+    @staticmethod
+    def full_url(url, params=None):
+        if not params:
+            return url
+        return requests.Request("GET", url, params=params).prepare().url
+
+    @staticmethod
+    def _cle(url):
+        return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+    def _body_path(self, cle):
+        return os.path.join(self.cache_dir, cle[:2], cle)
+
+    def _entry(self, url):
+        row = self._db.execute(
+            "SELECT cle, status, headers, etag, last_modified, stocke_le FROM entrees WHERE cle = ?",
+            (self._cle(url),)
+        ).fetchone()
+        if not row:
+            return None
+        cle, status, headers, etag, last_modified, stocke_le = row
+        return {
+            "cle": cle, "status": status, "headers": json.loads(headers or "{}"),
+            "etag": etag, "last_modified": last_modified, "stocke_le": stocke_le
+        }
+
+    def _read(self, url, entry):
+        try:
+            with open(self._body_path(entry["cle"]), "rb") as f:
+                content = f.read()
+        except OSError:
+            return None
+        self._db.execute("UPDATE entrees SET dernier_acces = ? WHERE cle = ?", (time.time(), entry["cle"]))
+        self._db.commit()
+        return CachedResponse(url, entry["status"], entry["headers"], content, from_cache=True)
+
+    def lookup(self, url, ttl=None):
+        """
+        Réponse en cache encore fraîche pour `url`, sinon None
+        """
+        ttl = ttl_for(url) if ttl is None else ttl
+        with self._lock:
+            entry = self._entry(url)
+            if entry and time.time() - entry["stocke_le"] < ttl:
+                return self._read(url, entry)
+        return None
+
+    def conditional_headers(self, url):
+        """
+        En-têtes If-None-Match / If-Modified-Since pour revalider une entrée périmée
+        """
+        with self._lock:
+            entry = self._entry(url)
+        headers = {}
+        if entry:
+            if entry["etag"]:
+                headers["If-None-Match"] = entry["etag"]
+            if entry["last_modified"]:
+                headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def revalidate(self, url):
+        """
+        Réponse 304 : l'entrée redevient fraîche et son corps est resservi
+        """
+        with self._lock:
+            entry = self._entry(url)
+            if not entry:
+                return None
+            self._db.execute("UPDATE entrees SET stocke_le = ? WHERE cle = ?", (time.time(), entry["cle"]))
+            return self._read(url, entry)
+
+    def store(self, url, status, headers, content):
+        cle = self._cle(url)
+        headers = {k: v for k, v in headers.items() if k.lower() in ("content-type", "etag", "last-modified")}
+        path = self._body_path(cle)
+        now = time.time()
+        lower = {k.lower(): v for k, v in headers.items()}
+        with self._lock:
+            # Corps écrit sous le verrou : deux threads sur la même URL partagent le fichier temporaire
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+            self._db.execute(
+                "INSERT OR REPLACE INTO entrees VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (cle, url, status, json.dumps(headers), lower.get("etag"), lower.get("last-modified"),
+                 now, now, len(content))
+            )
+            self._db.commit()
+            self._evict()
+
+    def _evict(self):
+        total = self._db.execute("SELECT COALESCE(SUM(taille), 0) FROM entrees").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        supprimees = 0
+        for cle, taille in self._db.execute("SELECT cle, taille FROM entrees ORDER BY dernier_acces").fetchall():
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(self._body_path(cle))
+            except OSError:
+                pass
+            self._db.execute("DELETE FROM entrees WHERE cle = ?", (cle,))
+            total -= taille
+            supprimees += 1
+        self._db.commit()
+        logging.info(f"Cache HTTP : {supprimees} entrée(s) évincée(s) (LRU)")
+
+    def get(self, session, url, params=None, headers=None, timeout=30, ttl=None):
+        """
+        GET via le cache : entrée fraîche servie directement, sinon requête
+        conditionnelle et mise à jour du cache sur 200 / 304
+        """
+        url = self.full_url(url, params)
+        cached = self.lookup(url, ttl)
+        if cached is not None:
+            logging.debug(f"Cache HTTP (frais) : {url}")
+            return cached
+        return self.fetch(session, url, headers=headers, timeout=timeout)
+
+    def fetch(self, session, url, headers=None, timeout=30):
+        """
+        Requête conditionnelle pour une entrée absente ou périmée (lookup() déjà fait),
+        mise à jour du cache sur 200 / 304
+        """
+        request_headers = dict(headers or {})
+        request_headers.update(self.conditional_headers(url))
+        resp = session.get(url, headers=request_headers, timeout=timeout)
+        if resp.status_code == 304:
+            revalidated = self.revalidate(url)
+            if revalidated is not None:
+                logging.debug(f"Cache HTTP (revalidé) : {url}")
+                return revalidated
+            # Entrée évincée entre la requête et la réponse : un 304 n'a pas de corps, on redemande la page
+            logging.debug(f"Cache HTTP (entrée évincée, requête sans condition) : {url}")
+            resp = session.get(url, headers=headers, timeout=timeout)
+        if resp.status_code == 200:
+            self.store(url, resp.status_code, resp.headers, resp.content)
+        return CachedResponse(url, resp.status_code, dict(resp.headers), resp.content)
+
+
+def get_cache():
+    """
+    Instance partagée du cache (None si HTTP_CACHE_DIR n'est pas défini)
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = HttpCache.from_env()
+        return _cache
@@ -0,0 +1,53 @@
+import os
+import json
+
+
+class JsonlSink:
+    """
+    Journal JSONL des avis : chaque page est ajoutée dès qu'elle est parsée puis
+    forcée sur disque (fsync), avant que le point de reprise n'avance
+    """
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self._file = open(path, "a", encoding="utf-8")
+
+    def write_page(self, records):
+        if not records:
+            return
+        self._file.write("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.count += len(records)
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+    def __iter__(self):
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    def iter_batches(self, batch_size):
+        batch = []
+        for record in self:
+            batch.append(record)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+def atomic_write(path, text):
+    """
+    Écriture atomique d'un petit fichier d'état (fichier temporaire + fsync + rename)
+    """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
@@ -0,0 +1,304 @@
+import os
+import math
+import time
+import sqlite3
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from cde_scrap_new import scrape_domain, parse_plage, domain_dir, read_last_page, data_raw_trustpilot, configurer_logs
+
+# File de jobs persistante
+SCRAP_QUEUE_DB = os.getenv("SCRAP_QUEUE_DB", os.path.join(data_raw_trustpilot, "scrap_queue.sqlite"))
+SCHEDULER_WORKERS = int(os.getenv("SCHEDULER_WORKERS", "4"))
+PAGES_PAR_JOB = int(os.getenv("SCHEDULER_PAGES_PAR_JOB", "30"))
+PAGES_INCREMENTAL = int(os.getenv("SCHEDULER_PAGES_INCREMENTAL", "50"))
+MAX_TENTATIVES = int(os.getenv("SCHEDULER_MAX_TENTATIVES", "5"))
+BACKOFF_BASE = 300
+# Trustpilot affiche 20 avis par page
+AVIS_PAR_PAGE = 20
+
+MODES = ("pages", "incremental", "complet")
+
+
+class JobQueue:
+    """
+    File de jobs de scraping dans SQLite : domaine, plage de pages ou mode,
+    priorité, prochaine exécution, tentatives
+    """
+    def __init__(self, db_path=SCRAP_QUEUE_DB):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                domaine TEXT NOT NULL,
+                mode TEXT NOT NULL DEFAULT 'pages',
+                page_debut INTEGER,
+                page_fin INTEGER,
+                priorite INTEGER NOT NULL DEFAULT 0,
+                prochaine_execution REAL NOT NULL,
+                intervalle INTEGER,
+                tentatives INTEGER NOT NULL DEFAULT 0,
+                statut TEXT NOT NULL DEFAULT 'en_attente',
+                derniere_erreur TEXT,
+                cree_le REAL NOT NULL,
+                maj_le REAL NOT NULL
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_jobs_dus ON jobs (statut, prochaine_execution, priorite)")
+        self._db.commit()
+
+    def ajouter(self, domaine, mode="pages", page_debut=None, page_fin=None, priorite=0,
+                dans=0, intervalle=None):
+        if mode not in MODES:
+            raise ValueError(f"Mode inconnu : {mode} (disponibles : {', '.join(MODES)})")
+        if mode == "pages" and (page_debut is None or page_fin is None):
+            raise ValueError("Le mode 'pages' exige une plage de pages")
+        if intervalle and mode != "incremental":
+            # Un job 'complet' récurrent redécouperait le domaine en plages à chaque passage
+            raise ValueError("Seuls les jobs 'incremental' peuvent être récurrents")
+        now = time.time()
+        with self._lock:
+            cur = self._db.execute(
+                """INSERT INTO jobs (domaine, mode, page_debut, page_fin, priorite, prochaine_execution,
+                                     intervalle, cree_le, maj_le)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                (domaine.lower().strip(), mode, page_debut, page_fin, priorite, now + dans, intervalle, now, now)
+            )
+            self._db.commit()
+            return cur.lastrowid
+
+    def lister(self):
+        with self._lock:
+            return self._db.execute(
+                "SELECT * FROM jobs ORDER BY statut, prochaine_execution, priorite DESC"
+            ).fetchall()
+
+    def supprimer(self, job_id):
+        with self._lock:
+            self._db.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            self._db.commit()
+
+    def reprendre_interrompus(self):
+        """Jobs restés 'en_cours' après un arrêt brutal du démon"""
+        with self._lock:
+            n = self._db.execute("UPDATE jobs SET statut = 'en_attente' WHERE statut = 'en_cours'").rowcount
+            self._db.commit()
+        if n:
+            logging.info(f"{n} job(s) interrompu(s) remis en file")
+
+    def reserver(self, domaines_occupes, limite):
+        """
+        Jobs dus, par priorité décroissante, au plus un par domaine (politesse)
+        et hors domaines déjà en cours de scraping
+        """
+        now = time.time()
+        jobs = []
+        with self._lock:
+            rows = self._db.execute(
+                """SELECT * FROM jobs WHERE statut = 'en_attente' AND prochaine_execution <= ?
+                   ORDER BY priorite DESC, prochaine_execution, id""",
+                (now,)
+            ).fetchall()
+            occupes = set(domaines_occupes)
+            for row in rows:
+                if len(jobs) >= limite:
+                    break
+                if row["domaine"] in occupes:
+                    continue
+                occupes.add(row["domaine"])
+                self._db.execute("UPDATE jobs SET statut = 'en_cours', maj_le = ? WHERE id = ?", (now, row["id"]))
+                jobs.append(dict(row))
+            self._db.commit()
+        return jobs
+
+    def prochaine_echeance(self):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT MIN(prochaine_execution) FROM jobs WHERE statut = 'en_attente'"
+            ).fetchone()
+        return row[0]
+
+    def terminer(self, job):
+        now = time.time()
+        with self._lock:
+            if job["intervalle"] and job["mode"] == "incremental":
+                # Job récurrent (ex: rafraîchissement incrémental quotidien)
+                self._db.execute(
+                    """UPDATE jobs SET statut = 'en_attente', tentatives = 0, derniere_erreur = NULL,
+                       prochaine_execution = ?, maj_le = ? WHERE id = ?""",
+                    (now + job["intervalle"], now, job["id"])
+                )
+            else:
+                self._db.execute("UPDATE jobs SET statut = 'termine', maj_le = ? WHERE id = ?", (now, job["id"]))
+            self._db.commit()
+
+    def echouer(self, job, erreur, page_debut=None, page_fin=None):
+        now = time.time()
+        tentatives = job["tentatives"] + 1
+        statut = "echec" if tentatives >= MAX_TENTATIVES else "en_attente"
+        with self._lock:
+            self._db.execute(
+                """UPDATE jobs SET statut = ?, tentatives = ?, derniere_erreur = ?, prochaine_execution = ?,
+                   page_debut = COALESCE(?, page_debut), page_fin = COALESCE(?, page_fin), maj_le = ?
+                   WHERE id = ?""",
+                (statut, tentatives, str(erreur)[:500], now + BACKOFF_BASE * 2 ** (tentatives - 1),
+                 page_debut, page_fin, now, job["id"])
+            )
+            self._db.commit()
+        return statut
+
+
+def total_pages(info_data):
+    """Nombre de pages d'un domaine d'après le nombre d'avis du JSON-LD"""
+    try:
+        return max(1, math.ceil(int(info_data["nombre_avis"]) / AVIS_PAR_PAGE))
+    except (TypeError, ValueError, KeyError):
+        return None
+
+
+class Scheduler:
+    """
+    Démon : exécute les jobs dus en parallèle (un seul job à la fois par domaine,
+    le débit par hôte restant régulé par le contrôleur AIMD partagé)
+    """
+    def __init__(self, queue, workers=SCHEDULER_WORKERS, pages_par_job=PAGES_PAR_JOB, poll=30):
+        self.queue = queue
+        self.workers = workers
+        self.pages_par_job = pages_par_job
+        self.poll = poll
+
+    def _planifier_complet(self, job, scraper):
+        """
+        Après la première plage d'un job 'complet' : découpe le reste du domaine
+        en jobs de plages, d'après le nombre total d'avis
+        """
+        total = total_pages(scraper.info_data) if scraper.info_data else None
+        if total is None:
+            logging.warning(f"Nombre d'avis inconnu pour {job['domaine']}, pas de découpage")
+            return
+        debut = scraper.start_page + self.pages_par_job
+        n = 0
+        for page in range(debut, total + 1, self.pages_par_job):
+            self.queue.ajouter(job["domaine"], "pages", page, min(page + self.pages_par_job - 1, total),
+                               priorite=job["priorite"])
+            n += 1
+        logging.info(f"{job['domaine']} : {total} pages au total, {n} job(s) de plages ajoutés")
+
+    def executer(self, job):
+        domaine = job["domaine"]
+        logging.info(f"▶ Job {job['id']} : {domaine} ({job['mode']})")
+        if job["mode"] == "incremental":
+            scraper = scrape_domain(domaine, PAGES_INCREMENTAL, incremental=True)
+        elif job["mode"] == "pages":
+            scraper = scrape_domain(domaine, job["page_fin"] - job["page_debut"] + 1, start_page=job["page_debut"])
+        else:
+            debut = job["page_debut"] or read_last_page(os.path.join(domain_dir(domaine), "derniere_page.txt")) + 1
+            scraper = scrape_domain(domaine, self.pages_par_job, start_page=debut)
+            if scraper.retry_queue:
+                # Les pages abandonnées de la première plage deviennent un job à part
+                pages = sorted(scraper.retry_queue)
+                self.queue.ajouter(domaine, "pages", pages[0], pages[-1], priorite=job["priorite"])
+                scraper.retry_queue = []
+            if not scraper.end_reached:
+                self._planifier_complet(job, scraper)
+        return scraper
+
+    def _fin_job(self, job, future):
+        try:
+            scraper = future.result()
+        except Exception as e:
+            statut = self.queue.echouer(job, e)
+            logging.error(f"✖ Job {job['id']} ({job['domaine']}) en erreur : {e} -> {statut}")
+            return
+        if scraper.retry_queue:
+            # Seules les pages abandonnées sont rejouées
+            pages = sorted(scraper.retry_queue)
+            statut = self.queue.echouer(job, f"Pages abandonnées : {pages}",
+                                        pages[0] if job["mode"] == "pages" else None,
+                                        pages[-1] if job["mode"] == "pages" else None)
+            logging.warning(f"Job {job['id']} ({job['domaine']}) incomplet -> {statut}")
+            return
+        self.queue.terminer(job)
+        logging.info(f"✔ Job {job['id']} ({job['domaine']}) terminé : {scraper.sink.count} avis")
+
+    def run(self):
+        self.queue.reprendre_interrompus()
+        logging.info(f"Démarrage du scheduler ({self.workers} workers, file {self.queue.db_path})")
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while True:
+                libres = self.workers - len(running)
+                if libres:
+                    occupes = [job["domaine"] for job in running.values()]
+                    for job in self.queue.reserver(occupes, libres):
+                        running[pool.submit(self.executer, job)] = job
+
+                if running:
+                    # Un slot libéré est immédiatement réattribué au job dû suivant
+                    timeout = self._attente()
+                    done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        self._fin_job(running.pop(future), future)
+                else:
+                    time.sleep(self._attente())
+
+    def _attente(self):
+        echeance = self.queue.prochaine_echeance()
+        if echeance is None:
+            return self.poll
+        return min(self.poll, max(0.5, echeance - time.time()))
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="File de jobs de scraping Trustpilot")
+    sub = arg_parser.add_subparsers(dest="commande", required=True)
+
+    ajout = sub.add_parser("ajouter", help="Ajoute un job à la file")
+    ajout.add_argument("domaine")
+    mode = ajout.add_mutually_exclusive_group()
+    mode.add_argument("--plage", type=parse_plage, help="Plage de pages, ex: 1-30")
+    mode.add_argument("--incremental", action="store_true", help="Nouveaux avis uniquement")
+    ajout.add_argument("--priorite", type=int, default=0)
+    ajout.add_argument("--dans", type=int, default=0, help="Délai avant la première exécution (secondes)")
+    ajout.add_argument("--intervalle", type=float, help="Job incrémental récurrent : période en heures")
+
+    sub.add_parser("lister", help="Affiche la file")
+    suppr = sub.add_parser("supprimer", help="Supprime un job")
+    suppr.add_argument("job_id", type=int)
+    daemon = sub.add_parser("daemon", help="Lance le démon")
+    daemon.add_argument("--workers", type=int, default=SCHEDULER_WORKERS)
+
+    args = arg_parser.parse_args()
+    configurer_logs()
+    queue = JobQueue()
+
+    if args.commande == "ajouter":
+        if args.intervalle and not args.incremental:
+            arg_parser.error("--intervalle n'est possible qu'avec --incremental")
+        if args.plage:
+            job_id = queue.ajouter(args.domaine, "pages", *args.plage, priorite=args.priorite, dans=args.dans)
+        else:
+            # Sans plage : historique complet, découpé d'après le nombre d'avis
+            mode = "incremental" if args.incremental else "complet"
+            intervalle = int(args.intervalle * 3600) if args.intervalle else None
+            job_id = queue.ajouter(args.domaine, mode, priorite=args.priorite, dans=args.dans, intervalle=intervalle)
+        print(f"Job {job_id} ajouté")
+    elif args.commande == "lister":
+        for row in queue.lister():
+            plage = f"{row['page_debut']}-{row['page_fin']}" if row["page_debut"] else "-"
+            print(f"{row['id']:>5} {row['domaine']:<25} {row['mode']:<12} {plage:<11} "
+                  f"prio={row['priorite']:<3} {row['statut']:<11} "
+                  f"prochaine={time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(row['prochaine_execution']))} "
+                  f"tentatives={row['tentatives']}")
+    elif args.commande == "supprimer":
+        queue.supprimer(args.job_id)
+    else:
+        Scheduler(queue, workers=args.workers).run()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+import os
+import json
+import time
+import threading
+from datetime import datetime
+from bisect import bisect_left
+
+from jsonl_sink import atomic_write
+
+# Mesures par requête (SCRAP_TELEMETRIE=0 pour les désactiver)
+SCRAP_TELEMETRIE = os.getenv("SCRAP_TELEMETRIE", "1") != "0"
+# Fichier lu par le textfile collector de node_exporter (défaut : répertoire des logs)
+SCRAP_PROM_TEXTFILE = os.getenv("SCRAP_PROM_TEXTFILE")
+
+# Bornes des histogrammes (secondes, octets)
+BORNES_LATENCE = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+BORNES_PARSE = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+BORNES_OCTETS = (16384, 65536, 131072, 262144, 524288, 1048576, 2097152, 4194304)
+# Phases d'une requête : résolution DNS, connexion (TCP + TLS), premier octet, totale, attente du débit
+PHASES = ("dns", "connect", "ttfb", "total", "attente")
+
+_telemetrie = None
+_telemetrie_lock = threading.Lock()
+
+
+class Histogramme:
+    def __init__(self, bornes):
+        self.bornes = bornes
+        self.compteurs = [0] * (len(bornes) + 1)
+        self.somme = 0.0
+        self.nombre = 0
+
+    def observer(self, valeur):
+        self.compteurs[bisect_left(self.bornes, valeur)] += 1
+        self.somme += valeur
+        self.nombre += 1
+
+    def prometheus(self, nom, labels):
+        lignes, cumul = [], 0
+        for borne, compteur in zip(self.bornes + ("+Inf",), self.compteurs):
+            cumul += compteur
+            lignes.append(f'{nom}_bucket{{{labels},le="{borne}"}} {cumul}')
+        lignes.append(f"{nom}_sum{{{labels}}} {self.somme}")
+        lignes.append(f"{nom}_count{{{labels}}} {self.nombre}")
+        return lignes
+
+
+class Telemetrie:
+    """
+    Mesures de chaque requête et de chaque parsing, agrégées en histogrammes par domaine.
+    Les lignes JSON sont ajoutées au fichier du run à chaque fin de domaine,
+    le fichier Prometheus est réécrit en entier (écriture atomique)
+    """
+    def __init__(self, repertoire):
+        os.makedirs(repertoire, exist_ok=True)
+        horodatage = datetime.now().strftime("%Y%m%d_%H%M%S")
+        self.jsonl_path = os.path.join(repertoire, f"telemetrie_scraping_{horodatage}.jsonl")
+        self.prom_path = SCRAP_PROM_TEXTFILE or os.path.join(repertoire, "scraping_trustpilot.prom")
+        self._lock = threading.Lock()
+        self._en_attente = {}
+        self._latences = {}
+        self._parse = {}
+        self._octets = {}
+        self._requetes = {}
+        self._tentatives = {}
+
+    def requete(self, domaine, url, statut, page=None, total=None, ttfb=None, dns=None, connect=None,
+                attente=0.0, octets=0, tentatives=1, cache=False, erreur=None):
+        mesure = {
+            "type": "requete", "horodatage": time.time(), "domaine": domaine, "page": page, "url": url,
+            "statut": statut, "cache": cache, "tentatives": tentatives, "octets": octets, "erreur": erreur,
+            "dns": dns, "connect": connect, "ttfb": ttfb, "total": total, "attente": attente,
+        }
+        with self._lock:
+            self._en_attente.setdefault(domaine, []).append(mesure)
+            cle_statut = (domaine, str(statut) if statut is not None else "erreur", "oui" if cache else "non")
+            self._requetes[cle_statut] = self._requetes.get(cle_statut, 0) + 1
+            self._tentatives[domaine] = self._tentatives.get(domaine, 0) + tentatives
+            if cache:
+                return
+            for phase in PHASES:
+                if mesure[phase] is not None:
+                    cle = (domaine, phase)
+                    if cle not in self._latences:
+                        self._latences[cle] = Histogramme(BORNES_LATENCE)
+                    self._latences[cle].observer(mesure[phase])
+            if octets:
+                if domaine not in self._octets:
+                    self._octets[domaine] = Histogramme(BORNES_OCTETS)
+                self._octets[domaine].observer(octets)
+
+    def parse(self, domaine, page, duree, nb_avis):
+        with self._lock:
+            self._en_attente.setdefault(domaine, []).append({
+                "type": "parse", "horodatage": time.time(), "domaine": domaine, "page": page,
+                "duree": duree, "avis": nb_avis,
+            })
+            if domaine not in self._parse:
+                self._parse[domaine] = Histogramme(BORNES_PARSE)
+            self._parse[domaine].observer(duree)
+
+    def ecrire(self, domaine):
+        """
+        Fin d'un domaine : ses mesures rejoignent le JSONL, le fichier Prometheus est régénéré
+        """
+        with self._lock:
+            mesures = self._en_attente.pop(domaine, [])
+            if mesures:
+                with open(self.jsonl_path, "a", encoding="utf-8") as f:
+                    f.write("".join(json.dumps(m, ensure_ascii=False) + "\n" for m in mesures))
+            texte = "\n".join(self._prometheus()) + "\n"
+        atomic_write(self.prom_path, texte)
+
+    def _prometheus(self):
+        lignes = [
+            "# HELP scrap_requete_duree_secondes Durée des requêtes par phase",
+            "# TYPE scrap_requete_duree_secondes histogram",
+        ]
+        for (domaine, phase), histo in sorted(self._latences.items()):
+            lignes += histo.prometheus("scrap_requete_duree_secondes", f'domaine="{domaine}",phase="{phase}"')
+        lignes += [
+            "# HELP scrap_parse_duree_secondes Durée du parsing d'une page",
+            "# TYPE scrap_parse_duree_secondes histogram",
+        ]
+        for domaine, histo in sorted(self._parse.items()):
+            lignes += histo.prometheus("scrap_parse_duree_secondes", f'domaine="{domaine}"')
+        lignes += [
+            "# HELP scrap_reponse_octets Taille des réponses",
+            "# TYPE scrap_reponse_octets histogram",
+        ]
+        for domaine, histo in sorted(self._octets.items()):
+            lignes += histo.prometheus("scrap_reponse_octets", f'domaine="{domaine}"')
+        lignes += ["# HELP scrap_requetes_total Requêtes par statut", "# TYPE scrap_requetes_total counter"]
+        for (domaine, statut, cache), nombre in sorted(self._requetes.items()):
+            lignes.append(f'scrap_requetes_total{{domaine="{domaine}",statut="{statut}",cache="{cache}"}} {nombre}')
+        lignes += ["# HELP scrap_tentatives_total Tentatives HTTP (reprises comprises)", "# TYPE scrap_tentatives_total counter"]
+        for domaine, nombre in sorted(self._tentatives.items()):
+            lignes.append(f'scrap_tentatives_total{{domaine="{domaine}"}} {nombre}')
+        return lignes
+
+
+def get_telemetrie(repertoire):
+    """
+    Collecteur unique pour tout le processus, None si la télémétrie est désactivée
+    """
+    global _telemetrie
+    if not SCRAP_TELEMETRIE:
+        return None
+    with _telemetrie_lock:
+        if _telemetrie is None:
+            _telemetrie = Telemetrie(repertoire)
+        return _telemetrie
+
+
+def aiohttp_trace_config():
+    """
+    TraceConfig aiohttp : remplit le dict passé en trace_request_ctx avec les durées
+    DNS, connexion et premier octet de la requête
+    """
+    import aiohttp
+
+    async def debut_requete(session, ctx, params):
+        ctx.trace_request_ctx["debut"] = time.perf_counter()
+
+    async def debut_dns(session, ctx, params):
+        ctx.trace_request_ctx["debut_dns"] = time.perf_counter()
+
+    async def fin_dns(session, ctx, params):
+        ctx.trace_request_ctx["dns"] = time.perf_counter() - ctx.trace_request_ctx["debut_dns"]
+
+    async def debut_connexion(session, ctx, params):
+        ctx.trace_request_ctx["debut_connexion"] = time.perf_counter()
+
+    async def fin_connexion(session, ctx, params):
+        mesure = ctx.trace_request_ctx
+        # La création de connexion inclut la résolution DNS
+        mesure["connect"] = time.perf_counter() - mesure["debut_connexion"] - mesure.get("dns", 0.0)
+
+    async def fin_requete(session, ctx, params):
+        ctx.trace_request_ctx["ttfb"] = time.perf_counter() - ctx.trace_request_ctx["debut"]
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(debut_requete)
+    trace_config.on_dns_resolvehost_start.append(debut_dns)
+    trace_config.on_dns_resolvehost_end.append(fin_dns)
+    trace_config.on_connection_create_start.append(debut_connexion)
+    trace_config.on_connection_create_end.append(fin_connexion)
+    trace_config.on_request_end.append(fin_requete)
+    return trace_config
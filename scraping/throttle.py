@@ -0,0 +1,104 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+# Débit par hôte (requêtes / seconde) : départ prudent, plancher et plafond de l'AIMD
+RATE_INITIALE = float(os.getenv("SCRAP_RATE_INITIALE", "0.2"))
+RATE_MIN = float(os.getenv("SCRAP_RATE_MIN", "0.05"))
+RATE_MAX = float(os.getenv("SCRAP_RATE_MAX", "2"))
+# Hausse additive après chaque réponse saine, baisse multiplicative sur 429 / 503
+RATE_INCREMENT = float(os.getenv("SCRAP_RATE_INCREMENT", "0.02"))
+RATE_FACTEUR_BAISSE = float(os.getenv("SCRAP_RATE_FACTEUR_BAISSE", "0.5"))
+
+THROTTLE_STATUSES = {429, 503}
+
+_controllers = {}
+_controllers_lock = threading.Lock()
+
+
+def parse_retry_after(value):
+    """
+    Valeur de l'en-tête Retry-After en secondes (délai ou date HTTP), None si absente / invalide
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return max(0.0, (date - datetime.now(timezone.utc)).total_seconds())
+
+
+class AdaptiveRateController:
+    """
+    Contrôleur AIMD partagé par toutes les requêtes vers un hôte.
+    Les créneaux sont réservés sous verrou, utilisable depuis des threads comme depuis asyncio
+    """
+    def __init__(self, host, rate_initiale=RATE_INITIALE, rate_min=RATE_MIN, rate_max=RATE_MAX,
+                 increment=RATE_INCREMENT, facteur_baisse=RATE_FACTEUR_BAISSE):
+        self.host = host
+        self.rate_min = rate_min
+        self.rate_max = rate_max
+        self.rate = min(max(rate_initiale, rate_min), rate_max)
+        self.increment = increment
+        self.facteur_baisse = facteur_baisse
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """
+        Réserve le prochain créneau d'envoi et renvoie le délai d'attente en secondes
+        """
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + 1.0 / self.rate
+            return slot - now
+
+    def wait(self):
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    async def async_wait(self):
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def on_success(self):
+        with self._lock:
+            self.rate = min(self.rate_max, self.rate + self.increment)
+
+    def on_throttle(self, retry_after=None):
+        with self._lock:
+            self.rate = max(self.rate_min, self.rate * self.facteur_baisse)
+            pause = retry_after if retry_after is not None else 1.0 / self.rate
+            self._next_slot = max(self._next_slot, time.monotonic() + pause)
+            rate = self.rate
+        logging.warning(
+            f"Throttling {self.host} : débit abaissé à {rate:.3f} req/s"
+            + (f", Retry-After {retry_after:.0f}s" if retry_after is not None else "")
+        )
+
+
+def get_controller(host, **kwargs):
+    """
+    Contrôleur AIMD unique par hôte pour tout le processus (rate_max peut être réajusté)
+    """
+    with _controllers_lock:
+        if host not in _controllers:
+            _controllers[host] = AdaptiveRateController(host, **kwargs)
+        elif "rate_max" in kwargs:
+            controller = _controllers[host]
+            controller.rate_max = kwargs["rate_max"]
+            controller.rate = min(controller.rate, controller.rate_max)
+        return _controllers[host]
@@ -0,0 +1,142 @@
+import os
+import csv
+import json
+import logging
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# Formats d'export des avis, séparés par des virgules (parquet, csv, json, xlsx)
+SCRAP_WRITERS = os.getenv("SCRAP_WRITERS", "parquet")
+# Formats utilisés à la place de Parquet quand pyarrow n'est pas installé
+FORMATS_SANS_PYARROW = ["csv", "json"]
+
+COLONNES_AVIS = ["id_avis_trustpilot", "page", "url_page", "auteur", "date", "commentaire", "note_commentaire"]
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+BATCH_SIZE = 5000
+
+
+class ResultWriter:
+    """
+    Export des avis d'un run à partir du journal JSONL (lu par lots)
+    """
+    extension = None
+
+    def write(self, sink, base_path):
+        path = base_path + self.extension
+        self._write(sink, path)
+        return path
+
+    def _write(self, sink, path):
+        raise NotImplementedError
+
+
+class ParquetWriter(ResultWriter):
+    """
+    Parquet compressé (zstd) avec schéma explicite : page, date et note typées
+    """
+    extension = ".parquet"
+
+    def __init__(self):
+        if pa is None:
+            raise RuntimeError("pyarrow est requis pour l'export Parquet (pip install pyarrow)")
+        self.schema = pa.schema([
+            ("id_avis_trustpilot", pa.string()),
+            ("page", pa.int32()),
+            ("url_page", pa.string()),
+            ("auteur", pa.string()),
+            ("date", pa.timestamp("s")),
+            ("commentaire", pa.string()),
+            ("note_commentaire", pa.int8()),
+        ])
+
+    def _to_table(self, records):
+        columns = {col: [r.get(col) for r in records] for col in COLONNES_AVIS}
+        dates = pa.array([str(d) if d is not None else None for d in columns["date"]], pa.string())
+        notes = pa.array([str(n) if n not in (None, "") else None for n in columns["note_commentaire"]], pa.string())
+        return pa.table({
+            "id_avis_trustpilot": pa.array(columns["id_avis_trustpilot"], pa.string()),
+            "page": pa.array(columns["page"], pa.int32()),
+            "url_page": pa.array(columns["url_page"], pa.string()),
+            "auteur": pa.array(columns["auteur"], pa.string()),
+            "date": pc.strptime(dates, format=DATE_FORMAT, unit="s", error_is_null=True),
+            "commentaire": pa.array(columns["commentaire"], pa.string()),
+            "note_commentaire": pc.cast(notes, pa.int8()),
+        }, schema=self.schema)
+
+    def _write(self, sink, path):
+        with pq.ParquetWriter(path, self.schema, compression="zstd") as writer:
+            for batch in sink.iter_batches(BATCH_SIZE):
+                writer.write_table(self._to_table(batch))
+
+
+class CsvWriter(ResultWriter):
+    extension = ".csv"
+
+    def _write(self, sink, path):
+        with open(path, "w", encoding="utf-8-sig", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=COLONNES_AVIS, extrasaction="ignore")
+            writer.writeheader()
+            for batch in sink.iter_batches(BATCH_SIZE):
+                writer.writerows(batch)
+
+
+class JsonWriter(ResultWriter):
+    extension = ".json"
+
+    def _write(self, sink, path):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("[\n")
+            for i, review in enumerate(sink):
+                f.write((",\n" if i else "") + json.dumps(review, ensure_ascii=False))
+            f.write("\n]")
+
+
+class XlsxWriter(ResultWriter):
+    """
+    Export Excel (openpyxl) : charge tout le run en mémoire, à activer explicitement
+    """
+    extension = ".xlsx"
+
+    def _write(self, sink, path):
+        import pandas as pd
+        pd.read_json(sink.path, lines=True, dtype=False).to_excel(path, index=False)
+
+
+WRITERS = {
+    "parquet": ParquetWriter,
+    "csv": CsvWriter,
+    "json": JsonWriter,
+    "xlsx": XlsxWriter,
+}
+
+
+def get_writers(names=None):
+    """
+    Instancie les writers demandés ("parquet,csv" ou liste de noms)
+    """
+    names = names or SCRAP_WRITERS
+    if isinstance(names, str):
+        names = [n.strip().lower() for n in names.split(",") if n.strip()]
+    inconnus = [n for n in names if n not in WRITERS]
+    if inconnus:
+        raise ValueError(f"Format(s) d'export inconnu(s) : {', '.join(inconnus)} (disponibles : {', '.join(WRITERS)})")
+    if "parquet" in names and pa is None:
+        logging.warning(f"pyarrow absent (pip install pyarrow) : export Parquet remplacé par {', '.join(FORMATS_SANS_PYARROW)}")
+        i = names.index("parquet")
+        names = names[:i] + [n for n in FORMATS_SANS_PYARROW if n not in names] + [n for n in names[i + 1:] if n != "parquet"]
+    return [WRITERS[n]() for n in names]
+
+
+def write_results(writers, sink, base_path):
+    paths = []
+    for writer in writers:
+        try:
+            paths.append(writer.write(sink, base_path))
+        except Exception as e:
+            logging.error(f"Erreur export {writer.extension} : {e}")
+    return paths